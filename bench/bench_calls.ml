@@ -0,0 +1,208 @@
+(* Measures the per-call overhead of cheap bindings through the statically
+   linked stubs that the library uses, against the libffi path that it used
+   to take, in which the same functions are looked up with dlsym and called
+   through Foreign. Also measures how long it takes to start a program that
+   uses the library, the cost of converting a constant with (~~), the time
+   and OCaml allocation that it takes to marshal a mat output and a vector
+   of points, and what passing structs costs.
+
+   Usage: dune build @bench/bench, or bench_calls.exe [iterations] *)
+
+open Opencv
+
+(* Ctypes.FOREIGN over libffi, i.e. how every binding used to be made *)
+module Libffi = struct
+  type 'a fn = 'a Ctypes.fn
+  type 'a return = 'a
+  let ( @-> ) = Ctypes.( @-> )
+  let returning = Ctypes.returning
+  type 'a result = 'a
+  let foreign name fn = Foreign.foreign name fn
+  let foreign_value name typ = Foreign.foreign_value name typ
+end
+
+let time f =
+  let start = Unix.gettimeofday () in
+  f ();
+  Unix.gettimeofday () -. start
+
+let ns_per_call iterations f =
+  let elapsed = time (fun () ->
+      for _ = 1 to iterations do
+        ignore (Sys.opaque_identity (f ()))
+      done)
+  in
+  elapsed *. 1e9 /. float_of_int iterations
+
+let words_per_call iterations f =
+  let before = Gc.minor_words () in
+  for _ = 1 to iterations do
+    ignore (Sys.opaque_identity (f ()))
+  done;
+  (Gc.minor_words () -. before) /. float_of_int iterations
+
+(* minor collections per million calls, which memory allocated outside the
+   OCaml heap for custom blocks, such as ctypes structures, brings forward *)
+let collections_per_million iterations f =
+  let before = (Gc.quick_stat ()).Gc.minor_collections in
+  for _ = 1 to iterations do
+    ignore (Sys.opaque_identity (f ()))
+  done;
+  float_of_int ((Gc.quick_stat ()).Gc.minor_collections - before)
+  *. 1e6 /. float_of_int iterations
+
+(* rect2i as the bindings used to convert struct arguments, into a ctypes
+   structure made for each call, which mallocs its memory and frees it
+   from a finaliser *)
+module Made_rect = struct
+  open Ctypes
+  type t
+  let t : t structure typ = structure "rect2i"
+  let x = field t "x" int
+  let y = field t "y" int
+  let width = field t "width" int
+  let height = field t "height" int
+  let () = seal t
+
+  let ocaml2c (r : Opencv.rect2i) =
+    let s = make t in
+    setf s x r.x;
+    setf s y r.y;
+    setf s width r.width;
+    setf s height r.height;
+    to_voidp (addr s)
+end
+
+(* the time it takes to run startup.exe, which only initializes the library,
+   averaged over runs *)
+let startup_time runs =
+  let exe = Filename.concat (Filename.dirname Sys.executable_name) "startup.exe" in
+  let elapsed = time (fun () ->
+      for _ = 1 to runs do
+        let pid = Unix.create_process exe [| exe |] Unix.stdin Unix.stdout Unix.stderr in
+        ignore (Unix.waitpid [] pid)
+      done)
+  in
+  elapsed /. float_of_int runs
+
+let () =
+  let iterations =
+    if Array.length Sys.argv > 1 then int_of_string Sys.argv.(1) else 1_000_000 in
+
+  (* binding every function with libffi is what loading the library used to
+     cost, on top of the dlopen *)
+  let start = Unix.gettimeofday () in
+  let module Dynamic = Opencv_bindings.Make (Libffi) in
+  let module Dynamic_unlocked = Opencv_bindings.Make_unlocked (Libffi) in
+  let bind_time = Unix.gettimeofday () -. start in
+
+  (* the C names are numbered by the generator; these are the ones for the
+     default set of modules *)
+  let border_interpolate_libffi p len border_type =
+    Dynamic.c_borderInterpolate1 p len border_type in
+  let bounding_rect_libffi array =
+    let array' = Cvdata.pack_cvdata array in
+    (* the rect is read in place, as the library does; libffi does not
+       release the runtime lock, which the static stub does *)
+    let r = Ctypes.(CArray.from_ptr (from_voidp int (Dynamic_unlocked.c_boundingRect1 array')) 4) in
+    let res : rect2i = {
+      x = Ctypes.CArray.get r 0;
+      y = Ctypes.CArray.get r 1;
+      width = Ctypes.CArray.get r 2;
+      height = Ctypes.CArray.get r 3;
+    } in
+    Cvdata.pack_cvdata_post array array';
+    res
+  in
+
+  let image = Bigarray.Genarray.create Bigarray.Int8_unsigned Bigarray.C_layout
+      [| 16; 16; 1 |] in
+  Bigarray.Genarray.fill image 0;
+  Bigarray.Genarray.set image [| 4; 5; 0 |] 255;
+  Bigarray.Genarray.set image [| 9; 11; 0 |] 255;
+  let points = Cvdata.Mat image in
+
+  let results = [
+    "border_interpolate",
+    ns_per_call iterations (fun () -> border_interpolate_libffi 20 10 ~~`BORDER_REFLECT),
+    ns_per_call iterations (fun () -> border_interpolate 20 10 ~~`BORDER_REFLECT);
+    "bounding_rect",
+    ns_per_call iterations (fun () -> bounding_rect_libffi points),
+    ns_per_call iterations (fun () -> bounding_rect points);
+  ] in
+
+  (* opaque so that the conversion is not specialized to the constant *)
+  let cv_const_time = ns_per_call iterations (fun () ->
+      ~~(Sys.opaque_identity `COLOR_BGR2Lab)) in
+  let startup = startup_time 20 in
+
+  (* what every mat output of a generated function goes through: reading
+     back the header of a mat that OpenCV returned, and updating the
+     bigarray passed as an OutputArray *)
+  let cmat = Mat.cmat_of_bigarray image in
+  let output = Cvdata.Mat image in
+  let arr = Cvdata.pack_cvdata output in
+  (* passing 10000 points to a std::vector parameter, the way the bindings
+     used to, through a list, and the way they do now *)
+  let points_list = List.init 20_000 (fun i -> i) in
+  let points_vector = Vector.of_array Bigarray.Int32 ~fields:2 (Array.init 20_000 Int32.of_int) in
+  let marshalling = [
+    "bigarray_of_cmat", (fun () -> ignore (Mat.bigarray_of_cmat Bigarray.Int8_unsigned cmat));
+    "pack_cvdata_post", (fun () -> Cvdata.pack_cvdata_post output arr);
+  ] |> List.map (fun (name, f) ->
+      name, ns_per_call iterations f, words_per_call iterations f) in
+  (* clip_line takes three structs. Made_rect.ocaml2c, made three times,
+     is what converting them used to cost before the call was even made;
+     the library now writes them into buffers that it reuses. *)
+  let rect : rect2i = { x = 0; y = 0; width = 100; height = 100 } in
+  let pt1 : point2i = { x = -10; y = 50 } and pt2 : point2i = { x = 110; y = 50 } in
+  let struct_args = [
+    "make x3", (fun () ->
+        ignore (Sys.opaque_identity (Made_rect.ocaml2c rect));
+        ignore (Sys.opaque_identity (Made_rect.ocaml2c rect));
+        ignore (Sys.opaque_identity (Made_rect.ocaml2c rect)));
+    "clip_line", (fun () -> ignore (clip_line rect pt1 pt2));
+  ] |> List.map (fun (name, f) ->
+      name, ns_per_call iterations f, words_per_call iterations f,
+      collections_per_million iterations f) in
+  let vector_iterations = max 1 (iterations / 1000) in
+  let marshalling = marshalling @ ([
+    "vector_of_list", (fun () ->
+        Vector.release (Vector.vector_of_list Ctypes.int (List.map (fun x -> x) points_list)));
+    "Vector.pack", (fun () -> Vector.release (Vector.pack points_vector));
+  ] |> List.map (fun (name, f) ->
+      name, ns_per_call vector_iterations f, words_per_call vector_iterations f)) in
+
+  Printf.printf "Binding all functions with libffi: %.3fms\n" (bind_time *. 1e3);
+  Printf.printf "Starting a program using the library: %.3fms\n" (startup *. 1e3);
+  Printf.printf "~~`COLOR_BGR2Lab: %.1fns\n" cv_const_time;
+  Printf.printf "%-20s %12s %12s\n" "Function" "libffi" "static";
+  List.iter (fun (name, before, after) ->
+      Printf.printf "%-20s %9.1fns %9.1fns\n" name before after) results;
+  Printf.printf "%-20s %12s %12s\n" "Marshalling" "time" "words";
+  List.iter (fun (name, ns, words) ->
+      Printf.printf "%-20s %9.1fns %12.1f\n" name ns words) marshalling;
+  Printf.printf "%-20s %12s %12s %12s\n" "Struct arguments" "time" "words" "minor GCs/M";
+  List.iter (fun (name, ns, words, collections) ->
+      Printf.printf "%-20s %9.1fns %12.1f %12.1f\n" name ns words collections) struct_args;
+
+  let oc = open_out "bench_calls.json" in
+  Printf.fprintf oc "{\n  \"iterations\": %d,\n  \"libffi_bind_time\": %f,\n"
+    iterations bind_time;
+  Printf.fprintf oc "  \"startup_time\": %f,\n  \"cv_const_ns\": %f,\n  \"calls\": {\n"
+    startup cv_const_time;
+  List.iteri (fun i (name, before, after) ->
+      Printf.fprintf oc "    \"%s\": {\"libffi_ns\": %f, \"static_ns\": %f}%s\n"
+        name before after (if i < List.length results - 1 then "," else "")) results;
+  Printf.fprintf oc "  },\n  \"marshalling\": {\n";
+  List.iteri (fun i (name, ns, words) ->
+      Printf.fprintf oc "    \"%s\": {\"ns\": %f, \"minor_words\": %f}%s\n"
+        name ns words (if i < List.length marshalling - 1 then "," else "")) marshalling;
+  Printf.fprintf oc "  },\n  \"struct_args\": {\n";
+  List.iteri (fun i (name, ns, words, collections) ->
+      Printf.fprintf oc "    \"%s\": {\"ns\": %f, \"minor_words\": %f, \"minor_collections_per_million\": %f}%s\n"
+        name ns words collections (if i < List.length struct_args - 1 then "," else ""))
+    struct_args;
+  Printf.fprintf oc "  }\n}\n";
+  close_out oc;
+  print_endline "Wrote results to bench_calls.json"
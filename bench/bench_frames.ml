@@ -0,0 +1,82 @@
+(* Measures how the throughput of Parallel.map_frames scales with the
+   number of worker domains, on the chain of demos/basic up to
+   bounding_rect, and checks that it gives the results in frame order.
+   The frames are made by converting a synthetic frame, standing in for
+   decoding, so that no video file is needed, and are numbered in their
+   first pixel. The threads of OpenCV are turned off.
+
+   Usage: dune build @bench/bench, or bench_frames.exe [frames] *)
+
+open Opencv
+
+let width = 1280
+let height = 720
+
+let source () =
+  let frame = Mat.acquire Bigarray.Int8_unsigned [| height; width; 3 |] in
+  for y = 0 to height - 1 do
+    for x = 0 to width - 1 do
+      Bigarray.Genarray.set frame [| y; x; 0 |] (x * 255 / width);
+      Bigarray.Genarray.set frame [| y; x; 1 |] (y * 255 / height);
+      Bigarray.Genarray.set frame [| y; x; 2 |] 128
+    done
+  done;
+  Cvdata.Mat frame
+
+let process frame =
+  let number = Bigarray.Genarray.get (Cvdata.to_mat frame) [| 0; 0; 0 |] in
+  let lab = cvt_color frame ~~`COLOR_BGR2Lab in
+  let lab_l = extract_channel lab 0 in
+  let blurred = gaussian_blur lab_l {width = 21; height = 21} 10. in
+  let threshed, _ = threshold blurred 100. 200. ~~`THRESH_BINARY in
+  let contours, _ = find_contours threshed ~~`RETR_EXTERNAL ~~`CHAIN_APPROX_SIMPLE in
+  number, List.length contours, bounding_rect threshed
+
+let frames_per_second frames domains source =
+  let read_count = ref 0 and expected = ref 0 in
+  let read image =
+    if !read_count = frames then None
+    else begin
+      let frame = cvt_color source ~dst:image ~~`COLOR_BGR2RGB in
+      Bigarray.Genarray.set (Cvdata.to_mat frame) [| 0; 0; 0 |] (!read_count land 255);
+      incr read_count;
+      Some frame
+    end in
+  let consume (number, _, _) =
+    if number <> !expected land 255 then begin
+      Printf.eprintf "map_frames with %d domains gave frame %d out of order\n" domains !expected;
+      exit 1
+    end;
+    incr expected in
+  let start = Unix.gettimeofday () in
+  Parallel.map_frames ~domains ~read process consume;
+  float_of_int frames /. (Unix.gettimeofday () -. start)
+
+let () =
+  let frames = if Array.length Sys.argv > 1 then int_of_string Sys.argv.(1) else 200 in
+  let source = source () in
+  Parallel.set_opencv_threads 1;
+  let sequential =
+    let start = Unix.gettimeofday () in
+    for _ = 1 to frames do ignore (Sys.opaque_identity (process source)) done;
+    float_of_int frames /. (Unix.gettimeofday () -. start) in
+  let rec counts n limit = if n >= limit then [limit] else n :: counts (n * 2) limit in
+  let results = List.map (fun domains ->
+      domains, frames_per_second frames domains source)
+      (counts 1 (max 1 (Domain.recommended_domain_count () - 1))) in
+
+  Printf.printf "%dx%d frames, in order\n" width height;
+  Printf.printf "one frame at a time %8.1f frames/s\n" sequential;
+  List.iter (fun (domains, fps) ->
+      Printf.printf "%3d domain%s        %8.1f frames/s\n" domains
+        (if domains = 1 then " " else "s") fps) results;
+
+  let oc = open_out "bench_frames.json" in
+  Printf.fprintf oc "{\n  \"frames\": %d,\n  \"sequential\": %f,\n  \"frames_per_second\": {\n"
+    frames sequential;
+  List.iteri (fun i (domains, fps) ->
+      Printf.fprintf oc "    \"%d\": %f%s\n"
+        domains fps (if i < List.length results - 1 then "," else "")) results;
+  Printf.fprintf oc "  }\n}\n";
+  close_out oc;
+  print_endline "Wrote results to bench_frames.json"
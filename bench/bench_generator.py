@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+# Benchmarks header parsing and binding generation against a synthetic
+# header corpus at several scales, so that performance regressions in
+# hdr_parser.py, type_manager.py or generator.py show up as numbers.
+#
+# Usage: bench/bench_generator.py [--scales 1,5,10,25,50] [--output FILE]
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import hdr_parser
+import generator
+
+# number of functions per header at scale 1; classes and enums are
+# generated in proportion
+FUNCTIONS_PER_HEADER = 30
+
+FUNCTION_TEMPLATES = [
+    ('void', 'InputArray src, OutputArray dst, int ksize, double sigma = 0, '
+     'int borderType = BORDER_DEFAULT'),
+    ('double', 'InputArray src, OutputArray dst, double thresh, double maxval, int type'),
+    ('void', 'InputOutputArray img, Point pt1, Point pt2, const Scalar& color, '
+     'int thickness = 1, int lineType = LINE_8, int shift = 0'),
+    ('Rect', 'InputArray points'),
+    ('void', 'InputArray image, OutputArrayOfArrays contours, OutputArray hierarchy, '
+     'int mode, int method, Point offset = Point()'),
+    ('int', 'const String& filename, Size size, bool flag = false'),
+    ('RotatedRect', 'InputArray points'),
+    ('void', 'InputArrayOfArrays images, const std::vector<int>& channels, '
+     'InputArray mask, OutputArray hist, const std::vector<float>& ranges'),
+]
+
+
+def docstring(name, args):
+    params = [arg.split('=')[0].split()[-1] for arg in args.split(', ')]
+    lines = ['/** @brief Synthetic function {}.'.format(name), '',
+             'A longer description that mentions `{}` and some math '
+             '\\f$\\sum_i x_i\\f$.'.format(name)]
+    lines += ['@param {} the {} parameter.'.format(param, param) for param in params]
+    lines += ['@sa {}'.format(name), '*/']
+    return lines
+
+
+def header_contents(prefix, scale):
+    lines = ['#ifndef {}_HPP'.format(prefix.upper()),
+             '#define {}_HPP'.format(prefix.upper()),
+             '', 'namespace cv', '{', '']
+
+    for i in range(max(1, FUNCTIONS_PER_HEADER * scale // 10)):
+        name = '{}Codes{}'.format(prefix.capitalize(), i)
+        lines.append('//! @brief Synthetic enum {}'.format(name))
+        lines.append('enum {} {{'.format(name))
+        for j in range(5):
+            lines.append('    {}_{}_VALUE{} = {}, //!< value {}'
+                         .format(prefix.upper(), i, j, j, j))
+        lines += ['};', '']
+
+    for i in range(FUNCTIONS_PER_HEADER * scale):
+        ret, args = FUNCTION_TEMPLATES[i % len(FUNCTION_TEMPLATES)]
+        name = '{}Func{}'.format(prefix, i)
+        lines += docstring(name, args)
+        lines.append('CV_EXPORTS_W {} {}({});'.format(ret, name, args))
+        lines.append('')
+
+    for i in range(max(1, FUNCTIONS_PER_HEADER * scale // 10)):
+        name = '{}Class{}'.format(prefix.capitalize(), i)
+        lines += ['/** @brief Synthetic class {}. */'.format(name),
+                  'class CV_EXPORTS_W {}'.format(name), '{', 'public:',
+                  '    CV_WRAP {}();'.format(name),
+                  '    CV_WRAP {}(const String& filename, int flags = 0);'.format(name),
+                  '    CV_WRAP virtual bool open(const String& filename, int flags = 0);',
+                  '    CV_WRAP virtual bool read(OutputArray image);',
+                  '    CV_WRAP virtual double get(int propId) const;',
+                  '    CV_WRAP static int create(int a, int b);',
+                  '    /* not wrapped */',
+                  '    void internal();',
+                  '};', '']
+
+    lines += ['} // namespace cv', '', '#endif']
+    return '\n'.join(lines) + '\n'
+
+
+# headers of the modules that are generated by default
+HEADERS = generator.module_headers(generator.default_modules)
+
+
+def build_corpus(include_dir, scale):
+    """Writes synthetic versions of each of HEADERS, scale times the size of
+    the base corpus, under include_dir.
+    """
+    for hname in HEADERS:
+        fname = os.path.join(include_dir, hname)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        prefix = os.path.splitext(os.path.basename(hname))[0]
+        with open(fname, 'wt') as f:
+            f.write(header_contents(prefix, scale))
+
+
+def bench_parse(include_dir):
+    hpaths = [os.path.join(include_dir, hname) for hname in HEADERS]
+    lines = 0
+    for hpath in hpaths:
+        with open(hpath) as f:
+            lines += sum(1 for _ in f)
+
+    def parse():
+        decls = []
+        for hpath in hpaths:
+            parser = hdr_parser.CppHeaderParser()
+            decls += parser.parse(hpath, wmode=False)
+        return decls
+
+    # tracemalloc slows parsing down by an order of magnitude, so time and
+    # memory are measured in separate runs
+    start = time.perf_counter()
+    decls = parse()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'header_lines': lines,
+        'decls': len(decls),
+        'time': elapsed,
+        'decls_per_second': len(decls) / elapsed,
+        'peak_memory': peak,
+    }
+
+
+def run_generator(include_dir, out_dir, profile):
+    subprocess.run([sys.executable, os.path.join(ROOT, 'generator.py'),
+                    out_dir, include_dir, '--no-cache', '--jobs', '1',
+                    '--modules', ','.join(generator.default_modules),
+                    '--profile', profile],
+                   check=True, stdout=subprocess.DEVNULL)
+    with open(os.path.join(out_dir, generator.PROFILE_REPORT)) as f:
+        return json.load(f)
+
+
+def bench_generate(include_dir, out_dir):
+    start = time.perf_counter()
+    profile = run_generator(include_dir, out_dir, 'time')
+    elapsed = time.perf_counter() - start
+    memory_profile = run_generator(include_dir, out_dir, 'full')
+
+    phases = profile['phases']
+    # the write_* phases nest inside each other, so rather than adding them
+    # up, count everything that is not parsing, collecting or saving as
+    # emission
+    emit_time = profile['total_time'] - sum(
+        phases[phase]['time'] for phase in
+        ['parse_headers', 'pass_classes', 'pass_overloads', 'pass_functions', 'save'])
+    lines = profile['counters']['lines_emitted']
+
+    return {
+        'time': elapsed,
+        'generator_time': profile['total_time'],
+        'emit_time': emit_time,
+        'lines_emitted': lines,
+        'lines_per_second': lines / emit_time if emit_time > 0 else None,
+        'functions_generated': profile['counters']['functions_generated'],
+        'peak_memory': max(phase['peak_memory']
+                           for phase in memory_profile['phases'].values()),
+        'phases': {name: phase['time'] for name, phase in phases.items()},
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark header parsing and binding generation.')
+    arg_parser.add_argument('--scales', default='1,5,10,25,50',
+                            help='comma-separated corpus sizes, relative to the base corpus')
+    arg_parser.add_argument('--output', default='bench_generator.json',
+                            help='file to write the results to')
+    arg_parser.add_argument('--keep', action='store_true',
+                            help='keep the generated corpus and outputs')
+    args = arg_parser.parse_args()
+
+    results = {'python': sys.version.split()[0], 'runs': []}
+    work_dir = tempfile.mkdtemp(prefix='opencv-bench-')
+    try:
+        for scale in map(int, args.scales.split(',')):
+            include_dir = os.path.join(work_dir, 'x{}'.format(scale), 'include')
+            out_dir = os.path.join(work_dir, 'x{}'.format(scale), 'out')
+            os.makedirs(out_dir)
+            build_corpus(include_dir, scale)
+
+            parse = bench_parse(include_dir)
+            generate = bench_generate(include_dir, out_dir)
+            results['runs'].append({'scale': scale, 'parse': parse, 'generate': generate})
+
+            print('x{:<3} {:7d} lines {:6d} decls  parse {:7.3f}s ({:8.0f} decls/s, {:6.1f} MB)'
+                  '  generate {:7.3f}s ({:8.0f} lines/s, {:6.1f} MB)'
+                  .format(scale, parse['header_lines'], parse['decls'], parse['time'],
+                          parse['decls_per_second'], parse['peak_memory'] / 1e6,
+                          generate['generator_time'], generate['lines_per_second'] or 0,
+                          generate['peak_memory'] / 1e6))
+    finally:
+        if args.keep:
+            print('Corpus and outputs kept in {}'.format(work_dir))
+        else:
+            shutil.rmtree(work_dir)
+
+    with open(args.output, 'wt') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    print('Wrote results to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Generates the bindings for a set of OpenCV modules and compiles each
+# module's C++ unit on its own, reporting per-module generation time, build
+# time and object size, so that the cost of each module in the configured
+# set is visible.
+#
+# Usage: bench/bench_modules.py [--modules core,imgproc,...] [--include-dir DIR]
+#                               [--cxxflags FLAGS] [--output FILE]
+
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generator
+
+# the flags dune passes to the compiler for the stubs, besides OpenCV's own
+CXXFLAGS = ['-O2', '-fPIC', '-g', '-std=c++11']
+
+
+def command_output(cmd):
+    """The output of cmd split into arguments, or [] if it cannot be run."""
+    try:
+        return shlex.split(subprocess.run(cmd, check=True, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL,
+                                          universal_newlines=True).stdout)
+    except (OSError, subprocess.CalledProcessError):
+        return []
+
+
+def compiler_flags(extra):
+    flags = CXXFLAGS + command_output(['pkg-config', '--cflags', 'opencv4'])
+    ocaml_where = command_output(['ocamlfind', 'ocamlc', '-where']) \
+        or command_output(['ocamlc', '-where'])
+    flags += ['-I' + where for where in ocaml_where]
+    return flags + ['-I' + os.path.join(ROOT, 'src')] + shlex.split(extra)
+
+
+def generate(modules, include_dir, out_dir):
+    cmd = [sys.executable, os.path.join(ROOT, 'generator.py'), out_dir,
+           '--no-cache', '--jobs', '1', '--profile', 'time', '--modules', ','.join(modules)]
+    if include_dir is not None:
+        cmd.insert(3, include_dir)
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    with open(os.path.join(out_dir, generator.PROFILE_REPORT)) as f:
+        return json.load(f)
+
+
+def build(cxx, flags, out_dir, module):
+    unit = os.path.join(out_dir, 'opencv_{}.cpp'.format(module))
+    obj = os.path.join(out_dir, 'opencv_{}.o'.format(module))
+    start = time.perf_counter()
+    subprocess.run([cxx, '-c'] + flags + ['-I' + out_dir, unit, '-o', obj], check=True)
+    return time.perf_counter() - start, os.path.getsize(obj)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Report generation and build time for each OpenCV module.')
+    arg_parser.add_argument('--modules', default=','.join(generator.modules),
+                            help='comma-separated modules to generate (default: all)')
+    arg_parser.add_argument('--include-dir', default=None,
+                            help='directory containing opencv4/opencv2/')
+    arg_parser.add_argument('--cxx', default=os.environ.get('CXX', 'c++'),
+                            help='C++ compiler (default: $CXX or c++)')
+    arg_parser.add_argument('--cxxflags', default='',
+                            help='extra compiler flags, e.g. include directories')
+    arg_parser.add_argument('--output', default='bench_modules.json',
+                            help='file to write the results to')
+    args = arg_parser.parse_args()
+
+    flags = compiler_flags(args.cxxflags)
+    out_dir = tempfile.mkdtemp(prefix='opencv-modules-')
+    try:
+        profile = generate(args.modules.split(','), args.include_dir, out_dir)
+        results = {'cxx': args.cxx, 'flags': flags, 'modules': profile['modules']}
+
+        print('{:<12} {:>8} {:>8} {:>10} {:>8} {:>10}'
+              .format('Module', 'Parse', 'Emit', 'C++ lines', 'Build', 'Object'))
+        # the report's keys are sorted, so go back to module order
+        for module in [module for module in generator.modules if module in profile['modules']]:
+            report = profile['modules'][module]
+            report['build_time'], report['object_size'] = build(
+                args.cxx, flags, out_dir, module)
+            print('{:<12} {:>7.3f}s {:>7.3f}s {:>10} {:>7.2f}s {:>8.0f}kB'
+                  .format(module, report['parse_time'], report['emit_time'],
+                          report['cpp_lines'], report['build_time'],
+                          report['object_size'] / 1e3))
+    finally:
+        shutil.rmtree(out_dir)
+
+    with open(args.output, 'wt') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    print('Wrote results to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
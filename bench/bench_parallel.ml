@@ -0,0 +1,84 @@
+(* Checks that Parallel.map gives the same result as a single call for a
+   blur, a threshold and a colour conversion of a large image, exiting with
+   an error if it does not, and measures how its speed scales with the
+   number of domains, with the threads of OpenCV turned off, against a
+   single call that OpenCV parallelises itself.
+
+   Usage: dune build @bench/bench, or bench_parallel.exe [size] [iterations] *)
+
+open Opencv
+
+(* noise, so that every tile has something different to blur *)
+let image size =
+  let image = Mat.acquire Bigarray.Int8_unsigned [| size; size; 3 |] in
+  let flat = Bigarray.reshape_1 image (size * size * 3) in
+  let state = Random.State.make [| 42 |] in
+  for i = 0 to Bigarray.Array1.dim flat - 1 do
+    Bigarray.Array1.unsafe_set flat i (Random.State.int state 256)
+  done;
+  Cvdata.Mat image
+
+let ops = [
+  "gaussian_blur", 10, (fun src -> gaussian_blur src {width = 21; height = 21} 10.);
+  "threshold", 0, (fun src -> fst (threshold src 100. 255. ~~`THRESH_BINARY));
+  "cvt_color", 0, (fun src -> cvt_color src ~~`COLOR_BGR2GRAY);
+]
+
+let same a b =
+  Cvdata.with_mat { f = fun a -> Cvdata.to_typed (Bigarray.Genarray.kind a) b = a } false a
+
+let ms_per_call iterations f =
+  ignore (Sys.opaque_identity (f ()));
+  let start = Unix.gettimeofday () in
+  for _ = 1 to iterations do
+    ignore (Sys.opaque_identity (f ()))
+  done;
+  (Unix.gettimeofday () -. start) *. 1e3 /. float_of_int iterations
+
+let rec powers_of_two n limit =
+  if n >= limit then [limit] else n :: powers_of_two (n * 2) limit
+
+let () =
+  let size = if Array.length Sys.argv > 1 then int_of_string Sys.argv.(1) else 4096 in
+  let iterations = if Array.length Sys.argv > 2 then int_of_string Sys.argv.(2) else 5 in
+  let image = image size in
+  let default_threads = Parallel.opencv_threads () in
+  let counts = powers_of_two 1 (Domain.recommended_domain_count ()) in
+
+  let results = List.map (fun (name, halo, op) ->
+      Parallel.set_opencv_threads 1;
+      let expected = op image in
+      List.iter (fun domains ->
+          if not (same expected (Parallel.map ~domains ~halo op image)) then begin
+            Printf.eprintf "%s: Parallel.map with %d domains differs from a single call\n"
+              name domains;
+            exit 1
+          end) counts;
+      let scaling = List.map (fun domains ->
+          domains, ms_per_call iterations (fun () -> Parallel.map ~domains ~halo op image))
+          counts in
+      Parallel.set_opencv_threads default_threads;
+      let opencv = ms_per_call iterations (fun () -> op image) in
+      name, opencv, scaling) ops in
+
+  Printf.printf "%dx%d image, results identical to a single call\n" size size;
+  List.iter (fun (name, opencv, scaling) ->
+      Printf.printf "%s: single call with %d OpenCV threads %.2fms\n"
+        name default_threads opencv;
+      List.iter (fun (domains, ms) ->
+          Printf.printf "  %3d domain%s %8.2fms\n" domains
+            (if domains = 1 then " " else "s") ms) scaling) results;
+
+  let oc = open_out "bench_parallel.json" in
+  Printf.fprintf oc "{\n  \"size\": %d,\n  \"iterations\": %d,\n  \"opencv_threads\": %d,\n"
+    size iterations default_threads;
+  Printf.fprintf oc "  \"ms\": {\n";
+  List.iteri (fun i (name, opencv, scaling) ->
+      Printf.fprintf oc "    \"%s\": {\"single_call\": %f, \"domains\": {%s}}%s\n"
+        name opencv
+        (String.concat ", " (List.map (fun (domains, ms) ->
+             Printf.sprintf "\"%d\": %f" domains ms) scaling))
+        (if i < List.length results - 1 then "," else "")) results;
+  Printf.fprintf oc "  }\n}\n";
+  close_out oc;
+  print_endline "Wrote results to bench_parallel.json"
@@ -0,0 +1,140 @@
+(* Compares the throughput of the pipeline of demos/basic written in the
+   functional style, in which every function returns a new mat and
+   Draw.draw draws on a clone of its source, with the same pipeline in the
+   imperative style of demos/reuse, in which the outputs are made once and
+   written in place. The functional pipeline is run with the copy-on-write
+   clones that Draw.draw makes, and with eager copies, which is what it used
+   to make, both for frames with something to draw and for frames with
+   nothing to draw. The same chain declared as a Pipeline, which reuses
+   the outputs as the imperative style does, is checked to give the same
+   results as the imperative style, and its stages are timed.
+
+   Usage: dune build @bench/bench, or bench_pipeline.exe [frames] *)
+
+open Opencv
+
+let width = 1280
+let height = 720
+
+(* a gradient, so that the threshold finds something to draw around *)
+let frame () =
+  let frame = Mat.acquire Bigarray.Int8_unsigned [| height; width; 3 |] in
+  for y = 0 to height - 1 do
+    for x = 0 to width - 1 do
+      Bigarray.Genarray.set frame [| y; x; 0 |] (x * 255 / width);
+      Bigarray.Genarray.set frame [| y; x; 1 |] (y * 255 / height);
+      Bigarray.Genarray.set frame [| y; x; 2 |] 128
+    done
+  done;
+  Cvdata.Mat frame
+
+let color = Scalar.color1 255.
+
+let draw_cow rects mat =
+  Draw.draw (List.map (fun rect -> Draw.rectangle2 rect color ~thickness:2) rects) mat
+
+let draw_eager rects mat =
+  let copy = Cvdata.Mat (Mat.clone (Cvdata.to_mat mat)) in
+  List.iter (fun rect -> ignore (rectangle2 copy rect color ~thickness:2)) rects;
+  copy
+
+let functional draw ~empty frame =
+  let lab = cvt_color frame ~~`COLOR_BGR2Lab in
+  let lab_l = extract_channel lab 0 in
+  let blurred = gaussian_blur lab_l {width = 21; height = 21} 10. in
+  let threshed, _ = threshold blurred 100. 200. ~~`THRESH_BINARY in
+  let rect = bounding_rect threshed in
+  draw (if empty then [] else [rect]) blurred
+
+let imperative ~empty =
+  let lab = Cvdata.Mat (Mat.create ()) in
+  let chan = Cvdata.Mat (Mat.create ()) in
+  let threshed = Cvdata.Mat (Mat.create ()) in
+  fun frame ->
+    let _ = cvt_color frame ~dst:lab ~~`COLOR_BGR2Lab in
+    let _ = extract_channel lab ~dst:chan 0 in
+    let _ = gaussian_blur chan ~dst:chan {width = 21; height = 21} 10. in
+    let _ = threshold chan ~dst:threshed 100. 200. ~~`THRESH_BINARY in
+    let rect = bounding_rect threshed in
+    if not empty then ignore (rectangle2 chan rect color ~thickness:2);
+    chan
+
+let streamed ~empty = Pipeline.(
+    stage "cvt_color" (fun ~dst frame -> cvt_color frame ~dst ~~`COLOR_BGR2Lab)
+    >>> stage "extract_channel" (fun ~dst lab -> extract_channel lab ~dst 0)
+    >>> stage "gaussian_blur" (fun ~dst chan ->
+        gaussian_blur chan ~dst {width = 21; height = 21} 10.)
+    >>> (id &&& stage "threshold" (fun ~dst chan ->
+        fst (threshold chan ~dst 100. 200. ~~`THRESH_BINARY)))
+    >>> map "draw" (fun (chan, threshed) ->
+        let rect = bounding_rect threshed in
+        if not empty then rectangle2 chan rect color ~thickness:2;
+        chan))
+
+let same a b =
+  Cvdata.with_mat { f = fun a -> Cvdata.to_typed (Bigarray.Genarray.kind a) b = a } false a
+
+let check_streamed frame =
+  let expected = Cvdata.clone (imperative ~empty:false frame) in
+  let frames = Seq.take 3 (Seq.repeat frame) in
+  Seq.iteri (fun i result ->
+      if not (same expected result) then begin
+        Printf.eprintf "Pipeline differs from the imperative style at frame %d\n" i;
+        exit 1
+      end) (Pipeline.run (streamed ~empty:false) frames)
+
+let frames_per_second frames pipeline frame =
+  (* one frame to warm up, so that the imperative outputs are allocated *)
+  ignore (Sys.opaque_identity (pipeline frame));
+  let start = Unix.gettimeofday () in
+  for _ = 1 to frames do
+    ignore (Sys.opaque_identity (pipeline frame))
+  done;
+  float_of_int frames /. (Unix.gettimeofday () -. start)
+
+let () =
+  let frames = if Array.length Sys.argv > 1 then int_of_string Sys.argv.(1) else 200 in
+  let frame = frame () in
+  check_streamed frame;
+
+  let results = List.concat_map (fun empty ->
+      let suffix = if empty then " (nothing drawn)" else "" in
+      [
+        "imperative" ^ suffix, imperative ~empty;
+        "functional" ^ suffix, functional draw_cow ~empty;
+        "functional, eager" ^ suffix, functional draw_eager ~empty;
+      ]) [false; true]
+    |> List.map (fun (name, pipeline) ->
+        name, frames_per_second frames pipeline frame) in
+  let streamed = streamed ~empty:false in
+  let stream_fps =
+    let frames' = Seq.take frames (Seq.repeat frame) in
+    (* one frame to warm up, so that the outputs are allocated *)
+    Seq.iter ignore (Pipeline.run streamed (Seq.return frame));
+    Pipeline.reset_metrics streamed;
+    let start = Unix.gettimeofday () in
+    Seq.iter (fun x -> ignore (Sys.opaque_identity x)) (Pipeline.run streamed frames');
+    float_of_int frames /. (Unix.gettimeofday () -. start) in
+  let results = results @ ["pipeline", stream_fps] in
+
+  Printf.printf "%dx%d frames\n" width height;
+  List.iter (fun (name, fps) -> Printf.printf "%-36s %8.1f frames/s\n" name fps) results;
+  List.iter (fun (m : Pipeline.metrics) ->
+      Printf.printf "  %-34s %8.3fms mean %8.3fms max\n" m.name (m.mean *. 1e3) (m.max *. 1e3))
+    (Pipeline.metrics streamed);
+
+  let oc = open_out "bench_pipeline.json" in
+  Printf.fprintf oc "{\n  \"frames\": %d,\n  \"width\": %d,\n  \"height\": %d,\n"
+    frames width height;
+  Printf.fprintf oc "  \"frames_per_second\": {\n";
+  List.iteri (fun i (name, fps) ->
+      Printf.fprintf oc "    \"%s\": %f%s\n"
+        name fps (if i < List.length results - 1 then "," else "")) results;
+  Printf.fprintf oc "  },\n  \"pipeline_stage_ms\": {\n";
+  let metrics = Pipeline.metrics streamed in
+  List.iteri (fun i (m : Pipeline.metrics) ->
+      Printf.fprintf oc "    \"%s\": %f%s\n"
+        m.name (m.mean *. 1e3) (if i < List.length metrics - 1 then "," else "")) metrics;
+  Printf.fprintf oc "  }\n}\n";
+  close_out oc;
+  print_endline "Wrote results to bench_pipeline.json"
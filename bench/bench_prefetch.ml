@@ -0,0 +1,94 @@
+(* Writes a video with Video_writer, checks that Prefetch reads back every
+   frame in order, and compares the frames per second of a loop that blurs
+   each frame when the frames are read with Video_capture.read, which
+   decodes on the calling thread, and with Prefetch, which decodes ahead
+   on a thread of its own.
+
+   Usage: dune build @bench/bench, or bench_prefetch.exe [frames] *)
+
+open Opencv
+
+let width = 1280
+let height = 720
+
+(* frame i is a flat grey that survives compression, so that the frames can
+   be told apart when they are read back *)
+let grey i = i * 7 mod 256
+
+let write_video filename frames =
+  let writer = Video_writer.video_writer2 filename (Video_writer.fourcc 'M' 'J' 'P' 'G')
+      30. {width; height} in
+  if not (Video_writer.is_opened writer) then false
+  else begin
+    let frame = Mat.acquire Bigarray.Int8_unsigned [| height; width; 3 |] in
+    for i = 0 to frames - 1 do
+      Bigarray.Genarray.fill frame (grey i);
+      Video_writer.write writer (Cvdata.Mat frame)
+    done;
+    Video_writer.release writer;
+    true
+  end
+
+let process frame =
+  ignore (Sys.opaque_identity (gaussian_blur frame {width = 21; height = 21} 10.))
+
+let check_frames filename frames =
+  let reader = Prefetch.open_file filename in
+  let count = ref 0 in
+  Prefetch.iter (fun image ->
+      let value = Bigarray.Genarray.get (Cvdata.to_mat image) [| height / 2; width / 2; 0 |] in
+      if abs (value - grey !count) > 3 then begin
+        Printf.eprintf "Prefetch: frame %d reads as %d, not %d\n" !count value (grey !count);
+        exit 1
+      end;
+      incr count) reader;
+  Prefetch.close reader;
+  if !count <> frames then begin
+    Printf.eprintf "Prefetch: read %d frames of %d\n" !count frames;
+    exit 1
+  end
+
+let frames_per_second frames f =
+  let start = Unix.gettimeofday () in
+  f ();
+  float_of_int frames /. (Unix.gettimeofday () -. start)
+
+let () =
+  let frames = if Array.length Sys.argv > 1 then int_of_string Sys.argv.(1) else 200 in
+  let filename = Filename.temp_file "bench_prefetch" ".avi" in
+  if not (write_video filename frames) then begin
+    print_endline "Cannot write MJPG videos with this build of OpenCV, skipping";
+    Sys.remove filename;
+    exit 0
+  end;
+  check_frames filename frames;
+
+  let synchronous = frames_per_second frames (fun () ->
+      let capture = Video_capture.video_capture2 filename in
+      let image = Cvdata.Mat (Mat.create ()) in
+      let rec loop () =
+        match Video_capture.read capture ~image with
+          | frame, true -> process frame; loop ()
+          | _, false -> () in
+      loop ();
+      Video_capture.release capture) in
+  let stats = ref None in
+  let prefetched = frames_per_second frames (fun () ->
+      let reader = Prefetch.open_file filename in
+      Prefetch.iter process reader;
+      stats := Some (Prefetch.stats reader);
+      Prefetch.close reader) in
+  Sys.remove filename;
+  let stats = Option.get !stats in
+
+  Printf.printf "%d %dx%d frames, read back in order\n" frames width height;
+  Printf.printf "Video_capture.read %8.1f frames/s\n" synchronous;
+  Printf.printf "Prefetch           %8.1f frames/s (waited for %d frames, ring full %d times)\n"
+    prefetched stats.waits stats.stalls;
+
+  let oc = open_out "bench_prefetch.json" in
+  Printf.fprintf oc "{\n  \"frames\": %d,\n  \"video_capture_read\": %f,\n" frames synchronous;
+  Printf.fprintf oc "  \"prefetch\": %f,\n  \"prefetch_waits\": %d,\n  \"prefetch_stalls\": %d\n}\n"
+    prefetched stats.waits stats.stalls;
+  close_out oc;
+  print_endline "Wrote results to bench_prefetch.json"
@@ -0,0 +1,73 @@
+(* Measures how long find_contours takes to return the contours of an
+   image of noise, which are extracted into a single Cvdata.Ragged, and
+   checks that a contour, a view of the ragged mat, can be passed as the
+   output of a function that resizes it: the function returns a new mat
+   and leaves the contour, and the ragged mat, as they were.
+
+   Usage: dune build @bench/bench, or bench_ragged.exe [size] [iterations] *)
+
+open Opencv
+
+(* blobs of noise, so that there are many contours of different lengths *)
+let image size =
+  let image = Mat.acquire Bigarray.Int8_unsigned [| size; size; 1 |] in
+  let state = Random.State.make [| 42 |] in
+  for y = 0 to size - 1 do
+    for x = 0 to size - 1 do
+      Bigarray.Genarray.set image [| y; x; 0 |] (if Random.State.int state 4 = 0 then 255 else 0)
+    done
+  done;
+  Cvdata.Mat image
+
+let contours image = fst (find_contours image ~~`RETR_LIST ~~`CHAIN_APPROX_NONE)
+
+let rows cvdata = (Bigarray.Genarray.dims (Cvdata.to_typed Bigarray.Int32 cvdata)).(0)
+
+let check_resize contours =
+  let small = List.find (fun c -> rows c > 1) contours in
+  (* one that OpenCV cannot write over small in place *)
+  match List.find_opt (fun c -> 3 * rows c <> rows small) contours with
+    | Some other ->
+        let before = Cvdata.to_typed Bigarray.Int32 (Cvdata.clone small) in
+        let small_rows = rows small in
+        let result = repeat other 3 1 ~dst:small in
+        if rows result <> 3 * rows other then begin
+          Printf.eprintf "Ragged: resized output has %d rows, not %d\n"
+            (rows result) (3 * rows other);
+          exit 1
+        end;
+        if rows small <> small_rows || Cvdata.to_typed Bigarray.Int32 small <> before then begin
+          prerr_endline "Ragged: resizing a contour changed the ragged mat";
+          exit 1
+        end
+    | None ->
+        prerr_endline "Ragged: too few contours to check";
+        exit 1
+
+let () =
+  let size = if Array.length Sys.argv > 1 then int_of_string Sys.argv.(1) else 1024 in
+  let iterations = if Array.length Sys.argv > 2 then int_of_string Sys.argv.(2) else 20 in
+  let noise = image size in
+  let found = contours noise in
+  check_resize found;
+  (* a smaller image, so that the contours found into the same list change
+     in number and length *)
+  let again = find_contours (image (size / 2)) ~contours:(ref found)
+      ~~`RETR_LIST ~~`CHAIN_APPROX_NONE |> fst in
+  check_resize again;
+
+  let start = Unix.gettimeofday () in
+  for _ = 1 to iterations do
+    ignore (Sys.opaque_identity (contours noise))
+  done;
+  let ms = (Unix.gettimeofday () -. start) *. 1e3 /. float_of_int iterations in
+
+  Printf.printf "%dx%d image of noise, %d contours\n" size size (List.length found);
+  Printf.printf "find_contours %8.2fms\n" ms;
+  print_endline "Resizing a contour as an output gives a new mat and leaves the ragged mat alone";
+
+  let oc = open_out "bench_ragged.json" in
+  Printf.fprintf oc "{\n  \"size\": %d,\n  \"contours\": %d,\n  \"find_contours_ms\": %f\n}\n"
+    size (List.length found) ms;
+  close_out oc;
+  print_endline "Wrote results to bench_ragged.json"
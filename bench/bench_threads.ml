@@ -0,0 +1,81 @@
+(* Measures how well calls into OpenCV run alongside other threads now that
+   the bindings of functions taking image data release the runtime lock:
+   the throughput of gaussian_blur run from several threads at once, and the
+   longest that a thread running only OCaml code goes without running while
+   another thread blurs frames. While the lock was held for the whole call,
+   the threads took turns, and the OCaml thread stalled for about as long as
+   a blur takes. OpenCV parallelises the blur itself too, so the speedup
+   with more threads depends on how many cores it leaves idle.
+
+   Usage: dune build @bench/bench, or bench_threads.exe [frames] *)
+
+open Opencv
+
+let width = 1280
+let height = 720
+
+let frame () =
+  let frame = Mat.acquire Bigarray.Int8_unsigned [| height; width; 3 |] in
+  Bigarray.Genarray.fill frame 128;
+  Cvdata.Mat frame
+
+let blur_frames frame frames =
+  let dst = Cvdata.Mat (Mat.create ()) in
+  for _ = 1 to frames do
+    ignore (Sys.opaque_identity (gaussian_blur frame ~dst {width = 21; height = 21} 10.))
+  done
+
+let frames_per_second threads frames frame =
+  let start = Unix.gettimeofday () in
+  List.init threads (fun _ -> Thread.create (blur_frames frame) frames)
+  |> List.iter Thread.join;
+  float_of_int (threads * frames) /. (Unix.gettimeofday () -. start)
+
+(* the longest gap between two iterations of a loop of OCaml code, run in a
+   thread of its own while another thread blurs frames *)
+let max_stall frames frame =
+  let running = Atomic.make true in
+  let stall = ref 0. in
+  let ticker = Thread.create (fun () ->
+      let last = ref (Unix.gettimeofday ()) in
+      while Atomic.get running do
+        let now = Unix.gettimeofday () in
+        stall := Float.max !stall (now -. !last);
+        last := now;
+        Thread.yield ()
+      done) () in
+  blur_frames frame frames;
+  Atomic.set running false;
+  Thread.join ticker;
+  !stall
+
+let () =
+  let frames = if Array.length Sys.argv > 1 then int_of_string Sys.argv.(1) else 100 in
+  let frame = frame () in
+  (* one frame to warm up *)
+  blur_frames frame 1;
+
+  let start = Unix.gettimeofday () in
+  blur_frames frame frames;
+  let blur_time = (Unix.gettimeofday () -. start) /. float_of_int frames in
+  let stall = max_stall frames frame in
+  let results = List.map (fun threads ->
+      threads, frames_per_second threads frames frame) [1; 2; 4; 8] in
+
+  Printf.printf "%dx%d frames, gaussian_blur 21x21\n" width height;
+  Printf.printf "One blur: %.3fms\n" (blur_time *. 1e3);
+  Printf.printf "Longest stall of an OCaml thread: %.3fms\n" (stall *. 1e3);
+  List.iter (fun (threads, fps) ->
+      Printf.printf "%d thread%s %8.1f frames/s\n" threads
+        (if threads = 1 then " " else "s") fps) results;
+
+  let oc = open_out "bench_threads.json" in
+  Printf.fprintf oc "{\n  \"frames\": %d,\n  \"blur_ms\": %f,\n  \"max_stall_ms\": %f,\n"
+    frames (blur_time *. 1e3) (stall *. 1e3);
+  Printf.fprintf oc "  \"frames_per_second\": {\n";
+  List.iteri (fun i (threads, fps) ->
+      Printf.fprintf oc "    \"%d\": %f%s\n"
+        threads fps (if i < List.length results - 1 then "," else "")) results;
+  Printf.fprintf oc "  }\n}\n";
+  close_out oc;
+  print_endline "Wrote results to bench_threads.json"
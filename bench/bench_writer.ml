@@ -0,0 +1,103 @@
+(* Compares the frames per second of a loop that blurs each frame and
+   writes it to a video with Video_writer.write, which encodes on the
+   calling thread, and with Async_writer.write, which encodes on a thread of
+   its own, and checks that every frame written asynchronously can be read
+   back and that a frame of the wrong size is rejected. Also reports how
+   many frames a small queue that drops the newest frames when full
+   drops.
+
+   Usage: dune build @bench/bench, or bench_writer.exe [frames] *)
+
+open Opencv
+
+let width = 1280
+let height = 720
+
+let fourcc = Video_writer.fourcc 'M' 'J' 'P' 'G'
+
+let frame () =
+  let frame = Mat.acquire Bigarray.Int8_unsigned [| height; width; 3 |] in
+  for y = 0 to height - 1 do
+    for x = 0 to width - 1 do
+      Bigarray.Genarray.set frame [| y; x; 0 |] (x * 255 / width);
+      Bigarray.Genarray.set frame [| y; x; 1 |] (y * 255 / height);
+      Bigarray.Genarray.set frame [| y; x; 2 |] 128
+    done
+  done;
+  Cvdata.Mat frame
+
+let frames_per_second frames f =
+  let start = Unix.gettimeofday () in
+  f ();
+  float_of_int frames /. (Unix.gettimeofday () -. start)
+
+let count_frames filename =
+  let capture = Video_capture.video_capture2 filename in
+  let image = Cvdata.Mat (Mat.create ()) in
+  let rec loop count =
+    match Video_capture.read capture ~image with
+      | _, true -> loop (count + 1)
+      | _, false -> count in
+  let count = loop 0 in
+  Video_capture.release capture;
+  count
+
+let () =
+  let frames = if Array.length Sys.argv > 1 then int_of_string Sys.argv.(1) else 200 in
+  let filename = Filename.temp_file "bench_writer" ".avi" in
+  let source = frame () in
+  (* a different buffer each frame would be what a pipeline writes *)
+  let dst = Cvdata.Mat (Mat.create ()) in
+  let blurred () = gaussian_blur source ~dst {width = 21; height = 21} 10. in
+
+  let writer = Video_writer.video_writer2 filename fourcc 30. {width; height} in
+  if not (Video_writer.is_opened writer) then begin
+    print_endline "Cannot write MJPG videos with this build of OpenCV, skipping";
+    Sys.remove filename;
+    exit 0
+  end;
+  let synchronous = frames_per_second frames (fun () ->
+      for _ = 1 to frames do Video_writer.write writer (blurred ()) done;
+      Video_writer.release writer) in
+
+  let stats = ref None in
+  let asynchronous = frames_per_second frames (fun () ->
+      let writer = Async_writer.open_file filename fourcc 30. ~width ~height in
+      for _ = 1 to frames do ignore (Async_writer.write writer (blurred ())) done;
+      Async_writer.flush writer;
+      stats := Some (Async_writer.stats writer);
+      Async_writer.close writer) in
+  let stats = Option.get !stats in
+  let read_back = count_frames filename in
+  if read_back <> frames then begin
+    Printf.eprintf "Async_writer: read back %d frames of %d\n" read_back frames;
+    exit 1
+  end;
+
+  let writer = Async_writer.open_file filename fourcc 30. ~width ~height
+      ~policy:Drop_newest ~capacity:2 in
+  let small = Cvdata.Mat (Mat.acquire Bigarray.Int8_unsigned [| height / 2; width; 3 |]) in
+  (match Async_writer.write writer small with
+    | exception Invalid_argument _ -> ()
+    | _ ->
+        prerr_endline "Async_writer: a frame of the wrong size was not rejected";
+        exit 1);
+  for _ = 1 to frames do ignore (Async_writer.write writer source) done;
+  Async_writer.flush writer;
+  let dropping = Async_writer.stats writer in
+  Async_writer.close writer;
+  Sys.remove filename;
+
+  Printf.printf "%d %dx%d frames\n" frames width height;
+  Printf.printf "Video_writer.write %8.1f frames/s\n" synchronous;
+  Printf.printf "Async_writer.write %8.1f frames/s (queue at most %d deep)\n"
+    asynchronous stats.max_depth;
+  Printf.printf "Unprocessed frames to a queue of 2 dropping the newest: %d dropped\n"
+    dropping.dropped;
+
+  let oc = open_out "bench_writer.json" in
+  Printf.fprintf oc "{\n  \"frames\": %d,\n  \"video_writer_write\": %f,\n" frames synchronous;
+  Printf.fprintf oc "  \"async_writer_write\": %f,\n  \"max_depth\": %d,\n  \"dropped\": %d\n}\n"
+    asynchronous stats.max_depth dropping.dropped;
+  close_out oc;
+  print_endline "Wrote results to bench_writer.json"
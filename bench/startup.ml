@@ -0,0 +1,4 @@
+(* Does nothing but initialize the library, so that bench_calls can time
+   how long that takes by running it. *)
+
+let () = ignore (Sys.opaque_identity Opencv.(~~`BORDER_REFLECT))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Checks that selecting modules does not rename overloads: the bindings
+# generated for core with each other module, and for the default modules,
+# must all be in the bindings generated for every module, with the same
+# names. Runs on a synthetic corpus, in which every module declares an
+# overloaded function and classes with methods of the same names, and on
+# the installed OpenCV if there is one. Runs with dune test, or with pytest.
+#
+# Usage: bench/test_overloads.py [--include-dir DIR]
+
+import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generator
+import bench_generator
+
+# declared in every header of the corpus, so that it is overloaded across
+# modules
+SHARED_FUNCTION = 'CV_EXPORTS_W void blend(InputArray src, OutputArray dst, int k);'
+
+
+def build_corpus(include_dir):
+    for hname in generator.module_headers(list(generator.modules)):
+        fname = os.path.join(include_dir, hname)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        prefix = os.path.splitext(os.path.basename(hname))[0]
+        contents = bench_generator.header_contents(prefix, 1)
+        contents = contents.replace('} // namespace cv',
+                                    SHARED_FUNCTION + '\n\n} // namespace cv')
+        with open(fname, 'wt') as f:
+            f.write(contents)
+
+
+def names(include_dir, out_dir, modules):
+    """The OCaml values and C functions that the generator declares for
+    modules, with their types.
+    """
+    os.makedirs(out_dir)
+    subprocess.run([sys.executable, os.path.join(ROOT, 'generator.py'), out_dir,
+                    include_dir, '--no-cache', '--jobs', '1',
+                    '--modules', ','.join(modules)],
+                   check=True, stdout=subprocess.DEVNULL)
+    with open(os.path.join(out_dir, 'opencv.mli')) as f:
+        values = set(line.strip() for line in f if line.lstrip().startswith('val '))
+    with open(os.path.join(out_dir, 'opencv_bindings.ml')) as f:
+        stubs = set(re.findall(r'foreign "[^"]*" .*', f.read()))
+    return values | stubs
+
+
+def check_overloads(include_dir, work_dir):
+    installed = [module for module in generator.modules
+                 if all(os.path.exists(os.path.join(include_dir, hname))
+                        for hname in generator.modules[module])]
+    everything = names(include_dir, os.path.join(work_dir, 'all'), installed)
+    selections = [generator.default_modules] + \
+        [['core', module] for module in installed if module != 'core']
+    for modules in selections:
+        renamed = names(include_dir, os.path.join(work_dir, '_'.join(modules)),
+                        modules) - everything
+        assert len(renamed) == 0, 'selecting {} renames {}'.format(
+            ','.join(modules), ', '.join(sorted(renamed)[:5]))
+
+
+def check_corpus():
+    work_dir = tempfile.mkdtemp(prefix='opencv-overloads-')
+    try:
+        include_dir = os.path.join(work_dir, 'include')
+        build_corpus(include_dir)
+        check_overloads(include_dir, work_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def check_installed(include_dirs):
+    for include_dir in include_dirs:
+        if os.path.exists(os.path.join(include_dir, generator.modules['core'][0])):
+            work_dir = tempfile.mkdtemp(prefix='opencv-overloads-')
+            try:
+                check_overloads(include_dir, work_dir)
+            finally:
+                shutil.rmtree(work_dir)
+            return
+
+
+def test_overloads_stable():
+    check_corpus()
+    check_installed(generator.system_include_dir_search)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        description='Check that selecting modules does not rename overloads.')
+    arg_parser.add_argument('--include-dir', default=None,
+                            help='directory containing opencv4/opencv2/ '
+                            '(default: where the generator looks)')
+    args = arg_parser.parse_args()
+    check_corpus()
+    check_installed([args.include_dir] if args.include_dir is not None
+                    else generator.system_include_dir_search)
@@ -0,0 +1,60 @@
+(* Checks that the mats that OpenCV allocates for the results of bindings
+   are released once the results are garbage collected: those returned by
+   value, and those of outputs whose depth OpenCV changes, which are
+   returned in place of the mats passed. Each is the owner of its data
+   until it is released, so the number of owners must come back to where it
+   was after every round of calls.
+
+   Usage: dune test, or test_owners.exe [rounds] [calls] *)
+
+open Opencv
+
+let image size =
+  let image = Mat.acquire Bigarray.Int8_unsigned [| size; size; 1 |] in
+  Bigarray.Genarray.fill image 128;
+  Cvdata.Mat image
+
+(* the number of owners once every unreachable result has been released,
+   and the pooled mats with them *)
+let settled_owners () =
+  Gc.full_major ();
+  Gc.full_major ();
+  Mat.Pool.clear ();
+  Mat.owners ()
+
+let check name depth cvdata =
+  if Cvdata.depth cvdata <> depth then begin
+    Printf.eprintf "Owners: %s returned a mat of depth %d, not %d\n"
+      name (Cvdata.depth cvdata) depth;
+    exit 1
+  end;
+  cvdata
+
+let expect what owners expected =
+  if owners <> expected then begin
+    Printf.eprintf "Owners: %d owners %s, not %d\n" owners what expected;
+    exit 1
+  end
+
+let () =
+  let rounds = if Array.length Sys.argv > 1 then int_of_string Sys.argv.(1) else 10 in
+  let calls = if Array.length Sys.argv > 2 then int_of_string Sys.argv.(2) else 100 in
+  let src = image 64 in
+  let float32 = Mat.depth_of_kind Bigarray.Float32 in
+  let float64 = Mat.depth_of_kind Bigarray.Float64 in
+  let before = settled_owners () in
+  for round = 1 to rounds do
+    let held = ref [] in
+    for _ = 1 to calls do
+      (* into a fresh 8-bit mat, which OpenCV gives 32-bit float data *)
+      held := [check "sobel" float32 (sobel src float32 1 0);
+               check "get_gaussian_kernel" float64 (get_gaussian_kernel 5 1.)]
+    done;
+    (* the results of the last calls own their data until they are dropped *)
+    expect (Printf.sprintf "while holding the results of round %d" round)
+      (settled_owners ()) (before + List.length !held);
+    held := [];
+    expect (Printf.sprintf "after round %d" round) (settled_owners ()) before
+  done;
+  ignore (Sys.opaque_identity src);
+  Printf.printf "Owners: %d after %d calls\n" before (2 * rounds * calls)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Checks that the streaming tokenizer of hdr_parser.py gives the same
+# declarations as the original line scanner, on the synthetic corpus of
+# bench_generator.py and on the headers of every module of the installed
+# OpenCV, so that the fast path cannot drift from the one it replaced.
+# Runs with dune test, or with pytest.
+#
+# Usage: bench/test_tokenizer.py [--include-dir DIR]
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import hdr_parser
+import generator
+import bench_generator
+
+
+def installed_headers(include_dirs):
+    """The headers of every module of the first OpenCV install found in
+    include_dirs, or [] if there is none.
+    """
+    for include_dir in include_dirs:
+        if os.path.exists(os.path.join(include_dir, generator.modules['core'][0])):
+            return [os.path.join(include_dir, hname)
+                    for hname in generator.module_headers(list(generator.modules))
+                    if os.path.exists(os.path.join(include_dir, hname))]
+    return []
+
+
+def check_scanners(include_dirs):
+    work_dir = tempfile.mkdtemp(prefix='opencv-tokenizer-')
+    try:
+        bench_generator.build_corpus(work_dir, 1)
+        hpaths = [os.path.join(work_dir, hname) for hname in bench_generator.HEADERS]
+        hpaths += installed_headers(include_dirs)
+        # an empty result on both sides would agree without testing anything
+        for hpath in hpaths:
+            assert len(hdr_parser.CppHeaderParser().parse(hpath, wmode=False)) > 0, \
+                'no declarations in {}'.format(hpath)
+        assert hdr_parser.compare_scanners(hpaths) == 0, \
+            'the streaming tokenizer and the line scanner disagree'
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def test_scanners_agree():
+    check_scanners(generator.system_include_dir_search)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        description='Check that both header scanners give the same declarations.')
+    arg_parser.add_argument('--include-dir', default=None,
+                            help='directory containing opencv4/opencv2/ '
+                            '(default: where the generator looks)')
+    args = arg_parser.parse_args()
+    check_scanners([args.include_dir] if args.include_dir is not None
+                   else generator.system_include_dir_search)
@@ -0,0 +1,76 @@
+
+# On-disk cache of the declarations produced by hdr_parser, so that
+# regenerating the bindings (e.g. after editing type_manager.py) does not
+# need to re-parse OpenCV headers that have not changed.
+
+import os
+import sys
+import hashlib
+import marshal
+
+import hdr_parser
+
+CACHE_ENV = 'OPENCV_DECL_CACHE'
+
+
+def default_cache_dir():
+    if CACHE_ENV in os.environ:
+        return os.environ[CACHE_ENV]
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'ocaml-opencv', 'decls')
+
+
+def _hash_file(fname):
+    with open(fname, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def parser_version():
+    """A string identifying the parser that produced a set of declarations.
+    Any edit to hdr_parser.py (or a different Python, since marshal is not
+    portable between versions) invalidates all cached declarations.
+    """
+    return '{}:{}'.format(_hash_file(hdr_parser.__file__),
+                          '.'.join(map(str, sys.version_info[:2])))
+
+
+class DeclCache():
+    def __init__(self, cache_dir=None, parser_options=()):
+        self.cache_dir = cache_dir if cache_dir is not None else default_cache_dir()
+        self.version = '{}:{}'.format(parser_version(),
+                                      ','.join(map(str, parser_options)))
+
+    def _entry_path(self, hname):
+        key = hashlib.sha1(os.path.abspath(hname).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + '.decls')
+
+    def _key(self, hname, wmode):
+        return (os.path.abspath(hname), _hash_file(hname), self.version, wmode)
+
+    def load(self, hname, wmode=True):
+        """Returns the cached declarations for the header hname, or None if
+        there are none or they are stale.
+        """
+        try:
+            with open(self._entry_path(hname), 'rb') as f:
+                key, decls = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if tuple(key) != self._key(hname, wmode):
+            return None
+        return decls
+
+    def store(self, hname, decls, wmode=True):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write to a temporary file first so that concurrent builds
+            # never observe a partially written entry
+            path = self._entry_path(hname)
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp, 'wb') as f:
+                marshal.dump((self._key(hname, wmode), decls), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print('Warning: could not write declaration cache for {}: {}'
+                  .format(hname, e))
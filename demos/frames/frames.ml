@@ -0,0 +1,26 @@
+open Opencv
+
+(* Same chain as the basic demo, but with the frames processed in several
+   domains at once by Parallel.map_frames, and shown in order. *)
+
+let () =
+  let vid = Video_capture.video_capture2 "test.mp4" in
+  let read image =
+    match Video_capture.read vid ~image with
+      | frame, true -> Some frame
+      | _, false -> None in
+  let process frame =
+    let lab = cvt_color frame ~~`COLOR_BGR2Lab in
+    let lab_l = extract_channel lab 0 in
+    let blurred = gaussian_blur lab_l {width=21; height=21} 10. in
+    let threshed, _ = threshold blurred 100. 200. ~~`THRESH_BINARY in
+    let contours, _ = find_contours threshed ~~`RETR_EXTERNAL ~~`CHAIN_APPROX_SIMPLE in
+    let rect = bounding_rect threshed in
+    Draw.draw [
+      Draw.rectangle2 rect (Scalar.color1 255.) ~thickness:2;
+      Draw.draw_contours contours (-1) (Scalar.color1 0.) ~thickness:4;
+    ] blurred in
+  let show drawn =
+    imshow "foobar" drawn;
+    ignore (wait_key ~delay:1 ()) in
+  Parallel.map_frames ~read process show
@@ -4,20 +4,72 @@ import sys
 import os
 from io import StringIO
 import re
+import time
+import argparse
+import multiprocessing
 
 # from OpenCV
 import hdr_parser
 # custom thing for handling C++ types
 import type_manager
+# on-disk cache of parsed headers
+import decl_cache
+# timing and memory usage of generator phases
+import profiler
+
+# OpenCV modules that bindings can be generated for and the headers that are
+# parsed for each of them. Overloaded names are numbered over the
+# declarations of every one of these modules that is installed, in this
+# order, whichever are selected, so that selecting a module does not rename
+# the overloads of another.
+modules = {
+    'core': ['opencv4/opencv2/core/types.hpp',
+             'opencv4/opencv2/core/mat.hpp',
+             'opencv4/opencv2/core.hpp'],
+    'imgproc': ['opencv4/opencv2/imgproc.hpp'],
+    'videoio': ['opencv4/opencv2/videoio.hpp'],
+    'highgui': ['opencv4/opencv2/highgui.hpp'],
+    'imgcodecs': ['opencv4/opencv2/imgcodecs.hpp'],
+    'features2d': ['opencv4/opencv2/features2d.hpp'],
+    'calib3d': ['opencv4/opencv2/calib3d.hpp'],
+    'video': ['opencv4/opencv2/video/tracking.hpp',
+              'opencv4/opencv2/video/background_segm.hpp'],
+    'objdetect': ['opencv4/opencv2/objdetect.hpp'],
+    'photo': ['opencv4/opencv2/photo.hpp'],
+    'dnn': ['opencv4/opencv2/dnn/dnn.hpp'],
+}
+
+# modules generated when none are configured; core is always generated
+default_modules = ['core', 'imgproc', 'videoio', 'highgui']
+
+MODULES_ENV = 'OPENCV_MODULES'
+
+# Functions, and classes all of whose methods, can block on I/O or on the
+# user without taking any image data. These and every function that takes
+# image data are bound so that they release the OCaml runtime lock for the
+# duration of the call, letting other threads run.
+blocking_functions = ['imread', 'imreadmulti', 'imwrite', 'imdecode', 'imencode',
+                      'waitKey', 'waitKeyEx', 'pollKey']
+blocking_classes = ['VideoCapture', 'VideoWriter']
+
+# namespaces nested in cv whose contents are bound as if they were in cv,
+# with the namespace as a prefix of their names, e.g. cv::fisheye::calibrate
+# becomes fisheye_calibrate
+namespaces = ['fisheye', 'dnn']
+
+
+def module_headers(selected):
+    return [hname for module in modules if module in selected
+            for hname in modules[module]]
+
+
+def header_group(hname):
+    """The OpenCV module that a header belongs to, e.g. 'core' for
+    'opencv4/opencv2/core/types.hpp'. Each module is compiled as a separate
+    C++ translation unit.
+    """
+    return hname.split('opencv2/', 1)[1].split('/', 1)[0].replace('.hpp', '')
 
-src_files = [
-    'opencv4/opencv2/core/types.hpp',
-    'opencv4/opencv2/core/mat.hpp',
-    'opencv4/opencv2/core.hpp',
-    'opencv4/opencv2/imgproc.hpp',
-    'opencv4/opencv2/videoio.hpp',
-    'opencv4/opencv2/highgui.hpp',
-]
 
 system_include_dir_search = [
     '/usr/include/',
@@ -52,8 +104,6 @@ class StructVal():
 
 class Struct():
     def __init__(self, cpp_name, ocaml_name, values):
-        self.clean_cpp_name = cpp_name.replace(
-            '::', '').replace('<', '_').replace('>', '')
         self.cpp_name = cpp_name
         self.ocaml_name = ocaml_name
         self.values = values
@@ -64,11 +114,17 @@ class Struct():
     def c2ocaml_name(self):
         return '{}_c2ocaml'.format(self.ocaml_name)
 
-    def c_constr_name(self):
-        return '{}_constr'.format(self.clean_cpp_name)
+    def layout_name(self):
+        return '{}_struct'.format(self.ocaml_name)
+
+    def layout_field_name(self, val):
+        return '{}_{}'.format(self.layout_name(), val.ocaml_name)
+
+    def of_layout_name(self):
+        return '{}_of_struct'.format(self.ocaml_name)
 
-    def c_getter_name(self, param):
-        return '{}_get_{}'.format(self.clean_cpp_name, param.cpp_name)
+    def write_layout_name(self):
+        return '{}_write_struct'.format(self.ocaml_name)
 
 
 structs = [
@@ -127,7 +183,7 @@ class Parameter():
 
 class Function():
     def __init__(self, cpp_name, c_name, ocaml_name,
-                 return_type, parameters, c_params, docs):
+                 return_type, parameters, c_params, docs, group, blocking=False):
         self.cpp_name = cpp_name
         self.c_name = c_name
         self.ocaml_name = ocaml_name
@@ -135,6 +191,8 @@ class Function():
         self.parameters = parameters
         self.c_params = c_params
         self.docs = docs
+        self.group = group
+        self.blocking = blocking
         self.param_map = {
             param.name: param.ocaml_name for param in self.parameters}
 
@@ -157,10 +215,11 @@ class EnumConstr():
 
 
 class Enum():
-    def __init__(self, name, values, docs):
+    def __init__(self, name, values, docs, group):
         self.name = name
         self.values = values
         self.docs = docs
+        self.group = group
 
     def __str__(self):
         return '{} ; {}'.format(self.name, self.values)
@@ -169,7 +228,7 @@ class Enum():
 class Class():
     def __init__(self, cpp_name, qualified_cpp_name, c_name,
                  ocaml_name, ocaml_type, ctypes_name,
-                 ctypes_type, inherits, docs, public_type=False):
+                 ctypes_type, inherits, docs, group, public_type=False):
         self.cpp_name = cpp_name
         self.qualified_cpp_name = qualified_cpp_name
         self.c_name = c_name
@@ -179,6 +238,7 @@ class Class():
         self.ctypes_type = ctypes_type
         self.inherits = inherits
         self.docs = docs
+        self.group = group
         self.public_type = public_type
 
         self.functions = []
@@ -217,8 +277,10 @@ class FileWriter():
         self.name = name
         self.spaces_per_indent = spaces_per_indent
         self.current_indent = ''
+        self.line_count = 0
 
     def write(self, s=''):
+        self.line_count += 1 + s.count('\n')
         self.buf.write(self.current_indent)
         self.buf.write(s)
         self.buf.write('\n')
@@ -236,8 +298,18 @@ class FileWriter():
         self.current_indent = self.current_indent[:-self.spaces_per_indent]
 
     def save(self):
-        with open(os.path.join(self.path, self.name), 'wt') as f:
-            f.write(self.buf.getvalue())
+        # leave unchanged files alone so that their timestamps are preserved
+        # and the build system does not needlessly recompile them
+        fname = os.path.join(self.path, self.name)
+        data = self.buf.getvalue().encode('utf-8')
+        try:
+            with open(fname, 'rb') as f:
+                if f.read() == data:
+                    return
+        except OSError:
+            pass
+        with open(fname, 'wb') as f:
+            f.write(data)
 
 
 def convert_name(name, is_function=True, create_ocaml_overload_counts=False,
@@ -246,12 +318,21 @@ def convert_name(name, is_function=True, create_ocaml_overload_counts=False,
     if name.startswith('cv.'):
         name = name[3:]
 
+    namespace = name.split('.', 1)[0]
+    if '.' in name and namespace in namespaces:
+        name = name[len(namespace) + 1:]
+    else:
+        namespace = None
+
     c_name = name
 
     # remap blacklisted functions (typically conflicting built-ins)
     if name in c_reserved:
         c_name = c_reserved[c_name]
 
+    if namespace is not None:
+        c_name = '{}_{}'.format(namespace, c_name)
+
     # rename overloaded functions to prevent conflicts
     if c_name in overload_counts:
         overload_counts[c_name] += 1
@@ -264,6 +345,9 @@ def convert_name(name, is_function=True, create_ocaml_overload_counts=False,
 
     # convert to camel case
     ocaml_name = snake_case(ocaml_name)
+    if namespace is not None:
+        ocaml_name = '{}_{}'.format(namespace, ocaml_name)
+        name = '{}.{}'.format(namespace, name)
 
     # in this case we detect a class method and re-run this function anyway,
     # so don't screw up the overload counts
@@ -347,30 +431,243 @@ def sanitize_docs(docs, name=None, params=[], param_map={}, extra_unit=False):
         return usage
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('No output folder specified!')
-        exit(1)
+int_literal_re = re.compile(r'^-?[0-9]+$')
+float_literal_re = re.compile(r'^-?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?[fF]?$')
+
+
+def ocaml_literal(typ, cpp_value):
+    """The OCaml equivalent of the C++ default value cpp_value for a
+    parameter of type typ, if it is a literal, otherwise None.
+    """
+    if not isinstance(typ, type_manager.BaseType):
+        return None
+    cpp_value = cpp_value.strip()
+    if typ.get_ocaml_type() == 'int' and int_literal_re.match(cpp_value):
+        literal = str(int(cpp_value))
+    elif typ.get_ocaml_type() == 'float' and float_literal_re.match(cpp_value):
+        literal = repr(float(cpp_value.rstrip('fF')))
+    elif typ.get_ocaml_type() == 'bool' and cpp_value in ['true', 'false']:
+        literal = cpp_value
+    else:
+        return None
+    return '({})'.format(literal) if literal.startswith('-') else literal
+
+
+# C types of the ctypes values in binding signatures, for the declarations
+# that the generated C stubs are compiled against; every other value is a
+# pointer of some kind, and C converts void * to and from any of those
+cstubs_c_types = {
+    'void': 'void',
+    'int': 'int',
+    'double': 'double',
+    'float': 'float',
+    'bool': 'bool',
+    'char': 'char',
+}
+
+
+def cstubs_c_type(ctypes_value):
+    return cstubs_c_types.get(ctypes_value, 'void *')
+
+
+def c_decl_prefix(c_type):
+    """c_type as it is written before a name, e.g. 'int ' or 'void *'."""
+    return c_type if c_type.endswith('*') else c_type + ' '
+
+
+def ocaml_variant_hash(tag):
+    """The runtime representation of the polymorphic variant `tag, as
+    computed by caml_hash_variant.
+    """
+    accu = 0
+    for c in tag.encode('utf-8'):
+        accu = (223 * accu + c) & 0x7FFFFFFF
+    # sign-extended from 31 bits, the same on 32 and 64-bit platforms
+    return accu - (1 << 31) if accu >= (1 << 30) else accu
+
+
+PROFILE_REPORT = 'generator_profile.json'
+
+
+def parse_header(job):
+    """Parses a single header with its own parser, so that headers can be
+    parsed independently in worker processes. Returns the declarations and
+    the profiled phases, which are empty unless profile is set.
+    """
+    hpath, generate_umat, generate_gpumat, profile, trace_memory = job
+    prof = profiler.Profiler(profile, trace_memory)
+    parser = hdr_parser.CppHeaderParser(
+        generate_umat_decls=generate_umat, generate_gpumat_decls=generate_gpumat)
+    try:
+        with prof.phase('parse {}'.format(hpath)):
+            return parser.parse(hpath, wmode=False), prof.phases
+    except SystemExit:
+        # hdr_parser exits on malformed input, which would otherwise
+        # silently kill a pool worker
+        raise Exception('Failed to parse {}'.format(hpath))
+
+
+def parse_headers(hpaths, generate_umat, generate_gpumat, cache, jobs, prof):
+    """Parses all of the headers in hpaths that are not in the cache, using
+    up to jobs worker processes. The declarations are returned in the same
+    order as hpaths regardless of which worker finishes first, as one list
+    per header, along with the number of headers that were loaded from the
+    cache.
+    """
+    with prof.phase('load_cache'):
+        header_decls = [cache.load(hpath, wmode=False) if cache is not None else None
+                        for hpath in hpaths]
+    missing = [i for i, decls in enumerate(header_decls) if decls is None]
+    header_jobs = [(hpaths[i], generate_umat, generate_gpumat, prof.enabled, prof.trace_memory)
+                   for i in missing]
+
+    if jobs > 1 and len(header_jobs) > 1:
+        with multiprocessing.Pool(min(jobs, len(header_jobs))) as pool:
+            parsed = pool.map(parse_header, header_jobs, chunksize=1)
+    else:
+        parsed = list(map(parse_header, header_jobs))
+
+    for i, (decls, phases) in zip(missing, parsed):
+        header_decls[i] = decls
+        prof.merge(phases)
+        if cache is not None:
+            with prof.phase('store_cache'):
+                cache.store(hpaths[i], decls, wmode=False)
+
+    return header_decls, len(hpaths) - len(missing)
+
+
+MANIFEST_ENV = 'OPENCV_MANIFEST'
+
+ocaml_name_re = re.compile(r"\b(?:[A-Z][\w']*\.)*[A-Za-z_][\w']*")
+poly_variant_re = re.compile(r"`[A-Za-z_][\w']*")
+opencv_alias_re = re.compile(r"\bmodule\s+([A-Z][\w']*)\s*=\s*Opencv\b")
+opencv_open_re = re.compile(r"\b(?:open!?|include)\s+Opencv\b|\bOpencv\.\(")
+
+
+def scan_ocaml_source(source):
+    """The names of the bindings that an OCaml source file refers to, e.g.
+    gaussian_blur for Opencv.gaussian_blur, Video_capture.read for
+    Opencv.Video_capture.read and `THRESH_BINARY for a constant. A file
+    that opens Opencv may refer to any binding without qualifying it, so
+    every name in it is taken.
+    """
+    prefixes = tuple('{}.'.format(module)
+                     for module in ['Opencv'] + opencv_alias_re.findall(source))
+    opened = opencv_open_re.search(source) is not None
+    names = set(poly_variant_re.findall(source))
+    for name in ocaml_name_re.findall(source):
+        if name.startswith(prefixes):
+            names.add(name.split('.', 1)[1])
+        elif opened:
+            names.add(name)
+    return names
+
+
+def read_manifest(paths):
+    """Collects the names of the bindings to generate. OCaml sources, and
+    directories containing them, are scanned with scan_ocaml_source; any
+    other file is read as a list of names in the same form, separated by
+    whitespace, with # starting a comment.
+    """
+    names = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, fnames in os.walk(path):
+                # skip build directories such as _build
+                dirnames[:] = [d for d in dirnames if not d.startswith(('_', '.'))]
+                names |= read_manifest([os.path.join(dirpath, fname) for fname in fnames
+                                        if fname.endswith(('.ml', '.mli'))])
+        elif path.endswith(('.ml', '.mli')):
+            with open(path) as f:
+                names |= scan_ocaml_source(f.read())
+        else:
+            with open(path) as f:
+                for line in f:
+                    names.update(line.split('#', 1)[0].split())
+    return names
+
 
-    dest = sys.argv[1]
+if __name__ == '__main__':
+    start_time = time.time()
+
+    arg_parser = argparse.ArgumentParser(
+        description='Generate OCaml bindings for OpenCV.')
+    arg_parser.add_argument('dest', help='output directory')
+    arg_parser.add_argument('include_dir', nargs='?', default=None,
+                            help='directory containing opencv4/opencv2/')
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help='always re-parse headers instead of using the declaration cache')
+    arg_parser.add_argument('--cache-dir', default=None,
+                            help='location of the declaration cache (default: ${} or ~/.cache/ocaml-opencv/decls)'
+                            .format(decl_cache.CACHE_ENV))
+    arg_parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                            help='number of processes used to parse headers (default: number of cores)')
+    arg_parser.add_argument('--modules', default=os.environ.get(MODULES_ENV),
+                            help='comma-separated OpenCV modules to generate bindings for, out of {} '
+                            '(default: ${} or {})'
+                            .format(', '.join(modules), MODULES_ENV, ','.join(default_modules)))
+    arg_parser.add_argument('--manifest', nargs='+', metavar='PATH',
+                            default=os.environ[MANIFEST_ENV].split(os.pathsep)
+                            if os.environ.get(MANIFEST_ENV) else None,
+                            help='only generate the bindings used by these OCaml sources or listed '
+                            'in these files, and what they depend on (default: ${}, a {}-separated '
+                            'list of paths)'.format(MANIFEST_ENV, os.pathsep))
+    arg_parser.add_argument('--profile', nargs='?', const='full', choices=['full', 'time'],
+                            help='write the time and memory used by each phase to {} in the output directory; '
+                            'with "time", memory is not traced, which keeps timings representative'
+                            .format(PROFILE_REPORT))
+    args = arg_parser.parse_args()
+
+    selected_modules = args.modules.split(',') if args.modules else default_modules
+    for module in selected_modules:
+        if module not in modules:
+            arg_parser.error('unknown module {} (known modules: {})'
+                             .format(module, ', '.join(modules)))
+    selected_modules = [module for module in modules
+                        if module == 'core' or module in selected_modules]
+
+    prof = profiler.Profiler(args.profile is not None, trace_memory=args.profile == 'full')
+    sanitize_docs = prof.timed('sanitize_docs', sanitize_docs)
+    for counter in ['functions_generated', 'functions_skipped_missing_types', 'lines_emitted']:
+        prof.count(counter, 0)
+
+    dest = args.dest
     print('Output directory: {}'.format(dest))
 
-    if len(sys.argv) > 2:
-        system_include_dir_search.insert(0, sys.argv[2])
+    if args.include_dir is not None:
+        system_include_dir_search.insert(0, args.include_dir)
 
     system_include_dir = None
     for include_dir in system_include_dir_search:
-        if os.path.exists(os.path.join(include_dir, src_files[0])):
+        if os.path.exists(os.path.join(include_dir, modules['core'][0])):
             system_include_dir = include_dir
             break
 
     print('Using include dir: {}'.format(system_include_dir))
 
+    # not every OpenCV build has every module, so skip the ones that are
+    # missing rather than failing
+    installed_modules = []
+    for module in modules:
+        missing_headers = [hname for hname in modules[module] if not
+                           os.path.exists(os.path.join(system_include_dir, hname))]
+        if module == 'core' or len(missing_headers) == 0:
+            installed_modules.append(module)
+        elif module in selected_modules:
+            print('Warning: skipping module {} because {} is missing'
+                  .format(module, missing_headers[0]))
+            selected_modules.remove(module)
+    src_files = module_headers(selected_modules)
+    # the headers of the modules that are not selected are parsed too, but
+    # only to number overloads
+    parsed_files = module_headers(installed_modules)
+    print('Modules: {}'.format(', '.join(selected_modules)))
+
     # TODO enable UMat support, and make a wrapper for handling both Mat and UMat identically
     generate_umat = False
+    generate_gpumat = generate_umat
 
-    parser = hdr_parser.CppHeaderParser(
-        generate_umat_decls=generate_umat, generate_gpumat_decls=generate_umat)
     functions = []
     enums = []
     enum_map = {}
@@ -380,12 +677,26 @@ if __name__ == '__main__':
     ocaml_overload_counts = {}
     draw_functions = []
 
+    def number_fields(struct):
+        """The C++ number type of every field of struct, with the fields of
+        nested structs flattened, e.g. ['int', 'int'] for Point.
+        """
+        fields = []
+        for val in struct.values:
+            cpp_type = type_manager.base_type(val.get_val_type()).get_cpp_type()
+            nested = [s for s in structs if s.cpp_name == cpp_type]
+            fields += number_fields(nested[0]) if len(nested) > 0 else [cpp_type]
+        return fields
+
     def add_struct(struct):
+        fields = number_fields(struct)
+        numeric = len(set(fields)) == 1 and fields[0] in type_manager.numeric_kinds
         type_manager.add_type(type_manager.CustomType(
             struct.cpp_name, struct.cpp_name, 'unit ptr', 'ptr void', struct.ocaml_name,
             ctypes2ocaml='({} ({{}}))'.format(struct.c2ocaml_name()),
             ocaml2ctypes='({} ({{}}))'.format(struct.ocaml2c_name()),
-            must_pointerize=True))
+            must_pointerize=True, value=True,
+            numeric_fields=(fields[0], len(fields)) if numeric else None))
 
     for struct in structs:
         add_struct(struct)
@@ -393,7 +704,7 @@ if __name__ == '__main__':
     for alias, struct_name in struct_aliases.items():
         type_manager.add_type_alias(struct_name, alias)
 
-    def add_enum(decl):
+    def add_enum(decl, group):
         def build_enum_constr(arg):
             cpp_name = arg[0].rsplit(' ', 1)[1]
             ocaml_name = cpp_name[cpp_name.rindex('.') + 1:]
@@ -405,24 +716,33 @@ if __name__ == '__main__':
                     ocaml_name)
             return EnumConstr(cpp_name, ocaml_name, cpp_value, ocaml_value)
         values = list(map(build_enum_constr, decl[3]))
-        enums.append(Enum(decl[0].rsplit(' ', 1)[1], values, decl[5]))
+        enums.append(Enum(decl[0].rsplit(' ', 1)[1], values, decl[5], group))
         for constr in values:
             enum_map[constr.ocaml_name] = constr
 
-    def add_class(decl):
+    def add_class(decl, group):
         full_class_name = decl[0].rsplit(' ', 1)[1]
         name, c_name, ocaml_name = convert_name(full_class_name, is_function=False)
-        inherits = decl[1].rsplit('::', 1)[1] if len(decl[1]) > 0 else None
+        # the last base class, e.g. ': cv::dnn::Model' for dnn.Model
+        inherits = decl[1].rsplit(' ', 1)[-1].split('cv::', 1)[-1].replace('::', '.') \
+            if len(decl[1]) > 0 else None
 
-        cpp_name = name
-        qualified_cpp_name = 'cv::' + name + "*"
-        c_name = 'cv::' + c_name + "*"
+        cpp_name = name.replace('.', '::')
+        qualified_cpp_name = 'cv::' + cpp_name + "*"
+        c_name = qualified_cpp_name if '.' in name else 'cv::' + c_name + "*"
         ctypes_name = ocaml_name + '_type'
         ocaml_name = ocaml_name.capitalize()
 
         if ocaml_name in masked_modules:
             return
 
+        if full_class_name.startswith('cv.'):
+            full_class_name = full_class_name[3:]
+        if group not in selected_modules:
+            # only its name is taken up, and those of its methods
+            other_classes.add(full_class_name)
+            return
+
         params = {
             'ctypes_type': 'ptr void',
             'ocaml_type': 'unit ptr',
@@ -432,18 +752,16 @@ if __name__ == '__main__':
             'post_action': None,
         }
 
-        if full_class_name.startswith('cv.'):
-            full_class_name = full_class_name[3:]
         classes[full_class_name] = \
             Class(cpp_name, qualified_cpp_name, c_name, ocaml_name, params['ocaml_type'],
-                  ctypes_name, params['ctypes_type'], inherits, decl[5],
+                  ctypes_name, params['ctypes_type'], inherits, decl[5], group,
                   public_type=params['public_type'])
         type_manager.add_type(type_manager.CustomType(
             qualified_cpp_name, c_name, ctypes_name, ctypes_name, ocaml_name + '.t',
             ctypes2ocaml=params['c2ocaml'], ocaml2ctypes=params['ocaml2c'],
             post=params['post_action']), silent_on_exists=True)
 
-    def add_function(decl):
+    def add_function(decl, group):
         if decl[1] is None:
             decl[1] = 'void'
 
@@ -460,7 +778,7 @@ if __name__ == '__main__':
                             arg[2] if len(arg[2]) > 0 else None,
                             '/O' in arg[3]) for arg in decl[3]]
 
-        if '.' in name:
+        if '.' in name and name.rsplit('.', 1)[0] not in namespaces:
             # class method
             cls = name.rsplit('.', 1)[0]
             if cls in classes:
@@ -470,9 +788,9 @@ if __name__ == '__main__':
 
                 c_params = params[:]
 
-                if name == classes[cls].cpp_name:
+                if name == cls.rsplit('.', 1)[-1]:
                     # constructor
-                    name = 'new cv::' + name
+                    name = 'new cv::' + classes[cls].cpp_name
                     return_type = classes[cls].cpp_name + "*"
                 else:
                     if '/S' in decl[2]:
@@ -486,99 +804,277 @@ if __name__ == '__main__':
                     return_type = decl[1]
 
                 classes[cls].add_function(
-                    Function(name, c_name, ocaml_name, return_type, params, c_params, decl[5]))
+                    Function(name, c_name, ocaml_name, return_type, params, c_params, decl[5],
+                             classes[cls].group, blocking=cls in blocking_classes))
             else:
                 print('ERROR: Missing class: {}'.format(cls))
         else:
-            functions.append(Function('cv::' + name, c_name,
-                                      ocaml_name, decl[1], params, params, decl[5]))
+            functions.append(Function('cv::' + name.replace('.', '::'), c_name,
+                                      ocaml_name, decl[1], params, params, decl[5], group,
+                                      blocking=name in blocking_functions))
+
+    cache = None if args.no_cache else \
+        decl_cache.DeclCache(args.cache_dir, parser_options=(generate_umat, generate_gpumat))
+
+    parse_start = time.time()
+    with prof.phase('parse_headers'):
+        header_decls, cached_count = parse_headers(
+            [os.path.join(system_include_dir, hname) for hname in parsed_files],
+            generate_umat, generate_gpumat, cache, args.jobs, prof)
+    all_decls = [(header_group(hname), decl)
+                 for hname, hdecls in zip(parsed_files, header_decls) for decl in hdecls]
+    decls = [(group, decl) for group, decl in all_decls if group in selected_modules]
+    parse_time = time.time() - parse_start
+
+    if cache is None:
+        print('Parsed {} headers in {:.3f}s with {} jobs (cache disabled)'
+              .format(len(parsed_files), parse_time, args.jobs))
+    else:
+        print('Parsed {} headers in {:.3f}s with {} jobs ({}: {} cached, {} re-parsed)'
+              .format(len(parsed_files), parse_time, args.jobs,
+                      'warm' if cached_count == len(parsed_files) else 'cold',
+                      cached_count, len(parsed_files) - cached_count))
 
-    decls = []
-    for hname in src_files:
-        decls += parser.parse(os.path.join(system_include_dir, hname), wmode=False)
+    # the classes of the modules that are not selected, which are named but
+    # not added
+    other_classes = set()
+
+    def is_class(cls):
+        return cls in classes or cls in other_classes
 
     # first pass to collect classes and add types
-    for decl in decls:
-        if decl[0].startswith('enum'):
-            # there's something screwy that happens where sometimes classes
-            # show up as enums, this is a really hacky way to make it work
-            if decl[0].endswith('.<unnamed>'):
-                decl[0] = decl[0][:-10]
-                full_class_name = decl[0].rsplit(' ', 1)[1]
-                if full_class_name.startswith('cv.'):
-                    full_class_name = full_class_name[3:]
-                if not full_class_name in classes:
-                    add_class(decl)
-            add_enum(decl)
-        elif decl[0].startswith('class'):
-            add_class(decl)
-        else:
-            pass
+    with prof.phase('pass_classes'):
+        for group, decl in all_decls:
+            if decl[0].startswith('enum'):
+                # there's something screwy that happens where sometimes classes
+                # show up as enums, this is a really hacky way to make it work
+                if decl[0].endswith('.<unnamed>'):
+                    decl[0] = decl[0][:-10]
+                    full_class_name = decl[0].rsplit(' ', 1)[1]
+                    if full_class_name.startswith('cv.'):
+                        full_class_name = full_class_name[3:]
+                    if not is_class(full_class_name) \
+                       and full_class_name not in namespaces:
+                        add_class(decl, group)
+                if group in selected_modules:
+                    add_enum(decl, group)
+            elif decl[0].startswith('class'):
+                add_class(decl, group)
+            else:
+                pass
 
     # second pass to identify overloaded OCaml functions
-    for decl in decls:
-        if decl[0].startswith('enum') or decl[0].startswith('class'):
-            pass
-        else:
-            name, _, _ = convert_name(decl[0], create_ocaml_overload_counts=True)
+    with prof.phase('pass_overloads'):
+        for _, decl in all_decls:
+            if decl[0].startswith('enum') or decl[0].startswith('class'):
+                pass
+            else:
+                name, _, _ = convert_name(decl[0], create_ocaml_overload_counts=True)
 
-            if '.' in name:
-                # class method
-                cls = name.rsplit('.', 1)[0]
-                if cls in classes:
-                    name = name.rsplit('.', 1)[1]
-                    convert_name(name, create_ocaml_overload_counts=True,
-                                 parent_module=cls)
+                if '.' in name:
+                    # class method
+                    cls = name.rsplit('.', 1)[0]
+                    if is_class(cls):
+                        name = name.rsplit('.', 1)[1]
+                        convert_name(name, create_ocaml_overload_counts=True,
+                                     parent_module=cls)
 
     # only add numbers for functions that are actually overloaded
     ocaml_overload_counts = \
         {name: 0 for name, count in ocaml_overload_counts.items() if count > 0}
 
-    # third pass to collect functions and methods
-    for decl in decls:
-        if decl[0].startswith('enum'):
-            pass
-        elif decl[0].startswith('class'):
-            pass
-        else:
-            add_function(decl)
+    # third pass to collect functions and methods; those of the modules that
+    # are not selected only use up their overload numbers
+    with prof.phase('pass_functions'):
+        for group, decl in all_decls:
+            if decl[0].startswith('enum'):
+                pass
+            elif decl[0].startswith('class'):
+                pass
+            elif group in selected_modules:
+                add_function(decl, group)
+            else:
+                name, _, _ = convert_name(decl[0])
+                cls = name.rsplit('.', 1)[0]
+                if '.' in name and cls not in namespaces and is_class(cls):
+                    convert_name(name.rsplit('.', 1)[1], parent_module=cls)
+
+    def trim_bindings(names):
+        """Drops the functions and methods that are not in names, along with
+        the classes, structs and enums that nothing left needs. Returns the
+        constants in names, which are the only ones looked up at runtime.
+        """
+        kept_functions = set()
+        kept_classes = set()
+        kept_structs = set()
+
+        class_keys = {cls.ocaml_name: key for key, cls in classes.items()}
+        class_types = {cls.qualified_cpp_name: key for key, cls in classes.items()}
+        struct_types = {struct.cpp_name: struct for struct in structs}
+
+        def ancestors(key):
+            while key in classes:
+                yield key
+                key = classes[key].inherits
+
+        def keep_type(cpp_name):
+            typ = type_manager.get_type(cpp_name)
+            if typ is None:
+                return
+            cpp_type = type_manager.base_type(typ).get_cpp_type()
+            if cpp_type in class_types:
+                kept_classes.update(ancestors(class_types[cpp_type]))
+            elif cpp_type in struct_types and cpp_type not in kept_structs:
+                kept_structs.add(cpp_type)
+                for val in struct_types[cpp_type].values:
+                    keep_type(val.val_type_cpp_name)
+
+        def keep_function(function):
+            kept_functions.add(function)
+            keep_type(function.return_type)
+            for param in function.parameters:
+                keep_type(param.arg_type)
+
+        for function in functions:
+            if function.ocaml_name in names or 'Draw.' + function.ocaml_name in names:
+                keep_function(function)
+
+        for name in names:
+            module, _, member = name.rpartition('.')
+            if module in class_keys:
+                # methods may be inherited, so look in the base classes too
+                for key in ancestors(class_keys[module]):
+                    kept_classes.add(key)
+                    for function in classes[key].functions:
+                        if function.ocaml_name == member:
+                            keep_function(function)
+
+        consts = {name[1:] for name in names if name.startswith('`')}
+        kept_enums = [enum for enum in enums
+                      if any(constr.ocaml_name in consts for constr in enum.values)]
+
+        print('Manifest: keeping {} of {} functions, {} of {} classes, {} of {} enums'
+              .format(len(kept_functions), len(functions) + sum(len(cls.functions)
+                                                                for cls in classes.values()),
+                      len(kept_classes), len(classes), len(kept_enums), len(enums)))
+
+        for cls in classes.values():
+            cls.functions = [function for function in cls.functions
+                             if function in kept_functions]
+        for key in [key for key in classes if key not in kept_classes]:
+            removed_classes[key] = classes.pop(key)
+        functions[:] = [function for function in functions if function in kept_functions]
+        structs[:] = [struct for struct in structs if struct.cpp_name in kept_structs]
+        enums[:] = kept_enums
+        enum_map.clear()
+        for enum in kept_enums:
+            for constr in enum.values:
+                enum_map[constr.ocaml_name] = constr
+        return consts
+
+    # classes dropped by trim_bindings, which still name anonymous enums
+    removed_classes = {}
+    used_enum_consts = None
+    if args.manifest is not None:
+        with prof.phase('trim_bindings'):
+            used_enum_consts = trim_bindings(read_manifest(args.manifest))
 
     missing_types = set()
 
     path = os.path.join(os.getcwd(), dest)
 
+    # opencv.h is the prelude shared by all of the generated C++ units (and
+    # so a good candidate for precompiling); each OpenCV module gets its own
+    # unit that only includes that module's header, so that the units can be
+    # compiled in parallel and unchanged units are not rebuilt. Units are
+    # written for every known module, since the build needs to know their
+    # names up front; those of unselected modules are left empty.
+    #
+    # The C functions are declared in opencv_bindings.ml, from which ctypes
+    # generates C stubs that are linked into the library, so nothing is
+    # looked up at runtime. Those stubs are C rather than C++, so they are
+    # compiled against the plain C declarations in opencv_cstubs.h.
     opencv_h = FileWriter(path, 'opencv.h')
-    opencv_cpp = FileWriter(path, 'opencv.cpp')
+    opencv_cpp_units = {group: FileWriter(path, 'opencv_{}.cpp'.format(group))
+                        for group in selected_modules}
+    unselected_cpp_units = [FileWriter(path, 'opencv_{}.cpp'.format(group))
+                            for group in modules if group not in selected_modules]
     opencv_ml = FileWriter(path, 'opencv.ml')
     opencv_mli = FileWriter(path, 'opencv.mli')
+    opencv_bindings = FileWriter(path, 'opencv_bindings.ml')
+    opencv_cstubs_h = FileWriter(path, 'opencv_cstubs.h')
 
-    opencv_h.write('#include <opencv2/opencv.hpp>')
     opencv_h.write('#include <opencv2/core.hpp>')
-    opencv_h.write('#include <opencv2/imgproc.hpp>')
     opencv_h.write()
     opencv_h.write('#include "glue.h"')
     opencv_h.write()
     opencv_h.write('using namespace cv;')
-    opencv_h.write()
-    opencv_h.write('extern "C" {')
-    opencv_h.indent()
 
-    opencv_cpp.write('#include "opencv.h"')
-    opencv_cpp.write()
-    opencv_cpp.write('extern "C" {')
-    opencv_cpp.indent()
+    for group, opencv_cpp in opencv_cpp_units.items():
+        opencv_cpp.write('#include "opencv.h"')
+        opencv_cpp.write('#include <opencv2/{}.hpp>'.format(group))
+        opencv_cpp.write()
+        opencv_cpp.write('extern "C" {')
+        opencv_cpp.indent()
+
+    for opencv_cpp in unselected_cpp_units:
+        opencv_cpp.write('// module not selected, see {} in generator.py'.format(MODULES_ENV))
+
+    opencv_bindings.write('open Ctypes')
+    opencv_bindings.write()
+    for cls in classes.values():
+        opencv_bindings.write('let {} = {}'.format(cls.ctypes_name, cls.ctypes_type))
+    opencv_bindings.write()
+    opencv_bindings.write('module Make (F : Ctypes.FOREIGN) = struct')
+    opencv_bindings.indent()
+    opencv_bindings.write('open F')
+
+    opencv_cstubs_h.write('#include <stdbool.h>')
+    opencv_cstubs_h.write()
+
+    # bindings of the functions that release the runtime lock, which are
+    # written to a functor of their own once the others are done
+    unlocked_bindings = []
+
+    def write_binding(c_name, params_ctypes, ret_ctypes, unlocked=False):
+        """Declares the C function c_name, taking and returning the given
+        ctypes values, in opencv_bindings.ml and opencv_cstubs.h. If
+        unlocked, its stub releases the runtime lock while it runs. Returns
+        the OCaml expression for the bound function.
+        """
+        ctypes_sig = ' @-> '.join((params_ctypes or ['void'])
+                                  + ['returning ({})'.format(ret_ctypes)])
+        binding = 'let c_{} = foreign "{}" ({})'.format(c_name, c_name, ctypes_sig)
+        if unlocked:
+            unlocked_bindings.append(binding)
+        else:
+            opencv_bindings.write(binding)
+        opencv_cstubs_h.write('{}{}({});'.format(
+            c_decl_prefix(cstubs_c_type(ret_ctypes)), c_name,
+            ', '.join(map(cstubs_c_type, params_ctypes)) or 'void'))
+        return '{}.c_{}'.format('U' if unlocked else 'B', c_name)
 
     opencv_ml.write('open Ctypes')
-    opencv_ml.write('open Foreign')
     opencv_ml.write('open Ctypes_static')
-    opencv_ml.write('open Loader')
-
+    opencv_ml.write()
+    opencv_ml.write('module B = Opencv_bindings.Make (Opencv_generated)')
+    opencv_ml.write('module U = Opencv_bindings.Make_unlocked (Opencv_unlocked_generated)')
+    opencv_ml.write()
+    opencv_ml.write('(* keeps x reachable up to here, so that the GC, which other threads can')
+    opencv_ml.write('   run while a call in U has released the runtime lock, does not free')
+    opencv_ml.write('   memory that the call is using *)')
+    opencv_ml.write('let keep_alive x = ignore (Sys.opaque_identity x)')
+    opencv_ml.write()
 
     # Export local modules
     opencv_ml.write('module Vector = Vector')
     opencv_ml.write('module Scalar = Scalar')
     opencv_ml.write('module Mat = Mat')
     opencv_ml.write('module Cvdata = Cvdata')
+    opencv_ml.write('module Parallel = Parallel')
+    opencv_ml.write('module Prefetch = Prefetch')
+    opencv_ml.write('module Async_writer = Async_writer')
+    opencv_ml.write('module Pipeline = Pipeline')
 
     # TODO: Export local modules through the mli file also
 
@@ -587,13 +1083,13 @@ if __name__ == '__main__':
     opencv_mli.write('module Scalar = Scalar')
     opencv_mli.write('module Mat = Mat')
     opencv_mli.write('module Cvdata = Cvdata')
+    opencv_mli.write('module Parallel = Parallel')
+    opencv_mli.write('module Prefetch = Prefetch')
+    opencv_mli.write('module Async_writer = Async_writer')
+    opencv_mli.write('module Pipeline = Pipeline')
 
-    opencv_ml.write(
-        'let foreign_value name typ = foreign_value ~from:lib_opencv name typ')
     opencv_ml.write()
 
-
-
     def write_struct(struct):
         decl_fields = '; '.join(['{} : {}'
                                  .format(val.ocaml_name, val.get_val_type().get_ocaml_type())
@@ -606,64 +1102,85 @@ if __name__ == '__main__':
         opencv_ml.write(type_decl)
         opencv_ml.write()
 
-        constr_ctypes = ' @-> '.join([field.get_val_type().get_ctypes_value()
-                                      for field in struct.values])
-        opencv_ml.write('let _{} = foreign "{}" ({} @-> returning (ptr void))'
-                        .format(struct.c_constr_name(), struct.c_constr_name(), constr_ctypes))
+        # A ctypes layout of the C++ struct, which is passed to and from C
+        # as a pointer to a copy, so that a struct crosses in one call and
+        # is read and written in place. An argument is written into a buffer
+        # from Glue.struct_arg, so that converting it allocates no memory
+        # outside the OCaml heap. The C++ struct cannot be passed by value,
+        # since its copy constructor is not trivial, which makes it a
+        # different argument to C and C++.
+        layout = struct.layout_name()
+
+        def nested_struct(field):
+            return struct_types.get(type_manager.base_type(field.get_val_type()).get_cpp_type())
+
+        opencv_ml.write('type {}'.format(layout))
+        opencv_ml.write('let {} : {} structure typ = structure "{}"'
+                        .format(layout, layout, struct.ocaml_name))
         for field in struct.values:
-            opencv_ml.write('let _{} = foreign "{}" (ptr void @-> returning ({}))'
-                            .format(struct.c_getter_name(field), struct.c_getter_name(field),
-                                    field.get_val_type().get_ctypes_value()))
-
-        ocaml_params = ' '.join([field.get_val_type().ocaml_to_ctypes(
-            's.{}'.format(field.ocaml_name)) for field in struct.values])
-        opencv_ml.write('let {} s = _{} {}'.format(
-            struct.ocaml2c_name(), struct.c_constr_name(), ocaml_params))
-
-        opencv_ml.write('let {} s ='.format(struct.c2ocaml_name()))
+            nested = nested_struct(field)
+            opencv_ml.write('let {} = field {} "{}" {}'.format(
+                struct.layout_field_name(field), layout, field.ocaml_name,
+                nested.layout_name() if nested is not None
+                else field.get_val_type().get_ctypes_value()))
+        opencv_ml.write('let () = seal {}'.format(layout))
+
+        opencv_ml.write('let {} s : {} ='.format(struct.of_layout_name(), struct.ocaml_name))
         opencv_ml.indent()
         opencv_ml.write('{')
         opencv_ml.indent()
         for field in struct.values:
-            opencv_ml.write('{} = {};'
-                            .format(field.ocaml_name, field.get_val_type().ctypes_to_ocaml(
-                                '_{} s'.format(struct.c_getter_name(field)))))
+            nested = nested_struct(field)
+            fmt = '{}' if nested is None else '{} ({{}})'.format(nested.of_layout_name())
+            opencv_ml.write('{} = {};'.format(field.ocaml_name, fmt.format(
+                'getf s {}'.format(struct.layout_field_name(field)))))
         opencv_ml.unindent()
         opencv_ml.write('}')
         opencv_ml.unindent()
 
-        opencv_ml.write()
-
-        cpp_params = ', '.join(['{} {}'.format(field.get_val_type().get_cpp_type(),
-                                               field.cpp_name) for field in struct.values])
-        opencv_h.write('{} *{}({});'.format(struct.cpp_name,
-                                            struct.c_constr_name(), cpp_params))
-
-        opencv_cpp.write('{} *{}({}) {{'.format(struct.cpp_name,
-                                                struct.c_constr_name(), cpp_params))
-        opencv_cpp.indent()
-        opencv_cpp.write('return new {}({});'
-                         .format(struct.cpp_name,
-                                 ', '.join([field.cpp_name for field in struct.values])))
-        opencv_cpp.unindent()
-        opencv_cpp.write('}')
+        # a nested struct is written through a view of its field
+        opencv_ml.write('let {} s (v : {}) ='.format(struct.write_layout_name(),
+                                                      struct.ocaml_name))
+        opencv_ml.indent()
+        for i, field in enumerate(struct.values):
+            nested = nested_struct(field)
+            field_name = struct.layout_field_name(field)
+            value = 'v.{}'.format(field.ocaml_name)
+            if nested is None:
+                write = 'setf s {} {}'.format(field_name, value)
+            else:
+                write = '{} (getf s {}) {}'.format(nested.write_layout_name(), field_name, value)
+            opencv_ml.write(write + (';' if i < len(struct.values) - 1 else ''))
+        opencv_ml.unindent()
 
-        for field in struct.values:
-            opencv_h.write('{} {}({} *s);'.format(field.get_val_type().get_cpp_type(),
-                                                  struct.c_getter_name(field), struct.cpp_name))
-            opencv_cpp.write('{} {}({} *s) {{'.format(field.get_val_type().get_cpp_type(),
-                                                      struct.c_getter_name(field), struct.cpp_name))
-            opencv_cpp.indent()
-            opencv_cpp.write('return s->{};'.format(field.cpp_name))
-            opencv_cpp.unindent()
-            opencv_cpp.write('}')
+        opencv_ml.write('let {} v ='.format(struct.ocaml2c_name()))
+        opencv_ml.indent()
+        opencv_ml.write('let p = Glue.struct_arg () in')
+        opencv_ml.write('{} (!@ (from_voidp {} p)) v;'.format(struct.write_layout_name(), layout))
+        opencv_ml.write('p')
+        opencv_ml.unindent()
+        opencv_ml.write('let {} p = {} (!@ (from_voidp {} p))'
+                        .format(struct.c2ocaml_name(), struct.of_layout_name(), layout))
+        opencv_ml.write()
 
-    def write_enum(enum):
+        # the layout above assumes that the fields are laid out one after
+        # the other, and that the struct fits in a buffer from struct_arg,
+        # which the compiler checks
+        opencv_cpp = opencv_cpp_units['core']
+        opencv_cpp.write('static_assert(std::is_standard_layout<{}>::value'.format(struct.cpp_name))
+        opencv_cpp.write('              && sizeof({}) == {}'.format(
+            struct.cpp_name, ' + '.join(['sizeof({})'.format(
+                type_manager.base_type(field.get_val_type()).get_cpp_type())
+                for field in struct.values])))
+        opencv_cpp.write('              && sizeof({}) <= STRUCT_ARG_SIZE,'.format(struct.cpp_name))
+        opencv_cpp.write('              "unexpected layout of {}");'.format(struct.cpp_name))
+
+    def write_enum(enum, consts):
         name = enum.name
         if name.startswith('cv.'):
             name = name[3:]
         # catch all anonymous enums
-        if name in classes:
+        if name in classes or name in removed_classes or name in namespaces:
             name = None
         if name == 'cv':
             name = None
@@ -696,17 +1213,51 @@ if __name__ == '__main__':
             opencv_mli.unindent()
             opencv_mli.write()
 
-        for constr in enum.values:
-            if constr.ocaml_name not in defined_enum_consts and not constr.cpp_name.startswith('cv.Param'):
-                defined_enum_consts.add(constr.ocaml_name)
-                opencv_h.write('int __{} = (int) {};'
-                               .format(constr.ocaml_name, constr.cpp_name.replace('.', '::')))
-                opencv_ml.write('let __{} = foreign_value "__{}" int |> (!@)'
-                                .format(constr.ocaml_name, constr.ocaml_name))
-
-        opencv_h.write()
+        for constr, index in consts:
+            opencv_ml.write('let __{} = CArray.get __consts_{} {}'.format(
+                constr.ocaml_name, enum.group, index))
         opencv_ml.write()
 
+    def write_enum_consts(group):
+        """Exports the values of the constants defined by the enums of group
+        in one C array, which is fetched with a single call when the OCaml
+        module is initialized. Returns, for each of the enums, the constants
+        that it defines and their indices in the array.
+        """
+        group_enums = [enum for enum in enums if enum.group == group]
+        enum_consts = []
+        count = 0
+        for enum in group_enums:
+            consts = []
+            for constr in enum.values:
+                if constr.ocaml_name not in defined_enum_consts and not constr.cpp_name.startswith('cv.Param') \
+                   and (used_enum_consts is None or constr.ocaml_name in used_enum_consts):
+                    defined_enum_consts.add(constr.ocaml_name)
+                    consts.append((constr, count))
+                    count += 1
+            enum_consts.append((enum, consts))
+
+        if count > 0:
+            opencv_cpp = opencv_cpp_units[group]
+            opencv_cpp.write('static const int __consts[] = {')
+            opencv_cpp.indent()
+            for _, consts in enum_consts:
+                for constr, _ in consts:
+                    opencv_cpp.write('(int) {},'.format(constr.cpp_name.replace('.', '::')))
+            opencv_cpp.unindent()
+            opencv_cpp.write('};')
+            opencv_cpp.write()
+            opencv_cpp.write('const int *__consts_{}() {{'.format(group))
+            opencv_cpp.write('  return __consts;')
+            opencv_cpp.write('}')
+            opencv_cpp.write()
+
+            opencv_ml.write('let __consts_{} = CArray.from_ptr ({} ()) {}'.format(
+                group, write_binding('__consts_' + group, [], 'ptr int'), count))
+            opencv_ml.write()
+
+        return enum_consts
+
     def write_enum_converter():
         opencv_mli.write('type cv_const = [')
         opencv_mli.indent()
@@ -730,18 +1281,67 @@ if __name__ == '__main__':
         opencv_ml.unindent()
         opencv_ml.write()
 
-        opencv_ml.write('let int_of_cv_const = function')
+        # a match over thousands of variants compiles to a binary search on
+        # their hashes, so instead the constants are put in an open
+        # addressing hash table keyed on the same hashes, which is built
+        # here so that a lookup is usually a single probe
+        supported = [name for name in enum_map if name in defined_enum_consts]
+        size = 1
+        while size < 2 * len(supported):
+            size *= 2
+        hashes = [None] * size
+        values = ['0'] * size
+        for name in supported:
+            h = ocaml_variant_hash(name)
+            i = h & (size - 1)
+            while hashes[i] is not None:
+                i = (i + 1) & (size - 1)
+            hashes[i] = h
+            values[i] = '__' + name
+        empty = 0
+        while empty in hashes:
+            empty += 1
+        hashes = [empty if h is None else h for h in hashes]
+
+        opencv_ml.write('let __const_hashes = [|')
+        opencv_ml.indent()
+        for i in range(0, size, 8):
+            opencv_ml.write(' '.join('{};'.format(h) for h in hashes[i:i + 8]))
+        opencv_ml.unindent()
+        opencv_ml.write('|]')
+        opencv_ml.write()
+
+        opencv_ml.write('let __const_values = [|')
         opencv_ml.indent()
+        for i in range(0, size, 8):
+            opencv_ml.write(' '.join('{};'.format(v) for v in values[i:i + 8]))
+        opencv_ml.unindent()
+        opencv_ml.write('|]')
+        opencv_ml.write()
 
-        for name, constr in enum_map.items():
-            if constr.ocaml_name in defined_enum_consts:
-                opencv_ml.write(
-                    '| `{} -> __{}'.format(constr.ocaml_name, constr.ocaml_name))
-            else:
-                opencv_ml.write('| `{} -> failwith "constant `{} unsupported"'
-                                .format(constr.ocaml_name, constr.ocaml_name))
+        opencv_ml.write('let __unsupported_const = function')
+        opencv_ml.indent()
+        for name in enum_map:
+            if name not in defined_enum_consts:
+                opencv_ml.write('| `{} -> "constant `{} unsupported"'.format(name, name))
+        opencv_ml.write('| _ -> "unrecognized cv constant"')
+        opencv_ml.unindent()
+        opencv_ml.write()
 
-        opencv_ml.write('| _ -> failwith "unrecognized cv constant"')
+        # constant constructors of polymorphic variants are represented by
+        # the hashes of their names
+        opencv_ml.write('let int_of_cv_const (c : cv_const) =')
+        opencv_ml.indent()
+        opencv_ml.write('let h : int = Obj.magic c in')
+        opencv_ml.write('let rec probe i =')
+        opencv_ml.indent()
+        opencv_ml.write('let k = Array.unsafe_get __const_hashes i in')
+        opencv_ml.write('if k = h then Array.unsafe_get __const_values i')
+        opencv_ml.write('else if k = {} then failwith (__unsupported_const c)'.format(empty))
+        opencv_ml.write('else probe ((i + 1) land {})'.format(size - 1))
+        opencv_ml.unindent()
+        opencv_ml.write('in')
+        opencv_ml.write('probe (h land {})'.format(size - 1))
         opencv_ml.unindent()
         opencv_ml.write()
 
@@ -750,12 +1350,16 @@ if __name__ == '__main__':
             print('Skipping {} because return type {} not in type map'.format(
                 function.cpp_name, function.return_type))
             missing_types.add(function.return_type)
+            if not mli_only:
+                prof.count('functions_skipped_missing_types')
             return
         for param in function.parameters:
             if not type_manager.has_type(param.arg_type):
                 print('Skipping {} because param type {} not in type map'.format(
                     function.cpp_name, param.arg_type))
                 missing_types.add(param.arg_type)
+                if not mli_only:
+                    prof.count('functions_skipped_missing_types')
                 return
 
         def check_enclosing_module(name):
@@ -774,8 +1378,7 @@ if __name__ == '__main__':
                                                   .get_type(function.return_type), cpp=True),
                                   function.c_name, params_h)
 
-        if not mli_only:
-            opencv_h.write('{};'.format(stub))
+        opencv_cpp = opencv_cpp_units[function.group]
 
         draw_in_out_mat_count = 0
 
@@ -786,7 +1389,8 @@ if __name__ == '__main__':
         # without supplying that parameter)
         total_default_params = 0
 
-        # default parameters
+        # default parameters, and those of them that are literals
+        default_literals = {}
         for param in function.parameters:
             arg_type = type_manager.get_type(param.arg_type)
             draw_in_out_mat_count += arg_type.is_draw_function()
@@ -800,39 +1404,79 @@ if __name__ == '__main__':
                 cpp_type = arg_type.get_cpp_type()
                 pointerized_type = pointerize_type(arg_type, cpp=True)
 
-                # There are screwy things with autoboxing rules and whatnot,
-                # so the easiest thing for us to do here is put the default
-                # value as a default argument in a helper function and then
-                # call that function - that way it is the same syntactic
-                # class as the header file from which it is pulled.
-
-                opencv_h.write('{} {}();'.format(pointerized_type, c_name))
-
-                opencv_cpp.write(
-                    '{} _{}({} v = {}) {{'.format(cpp_type, c_name,
-                                                  cpp_type, param.default_value))
-                opencv_cpp.indent()
-                opencv_cpp.write('return v;')
-                opencv_cpp.unindent()
-                opencv_cpp.write('}')
-
-                opencv_cpp.write('{} {}() {{'.format(pointerized_type, c_name))
-                opencv_cpp.indent()
-                if arg_type.must_pass_pointer() and not arg_type.is_pointer():
-                    opencv_cpp.write(
-                        'return new {}(_{}());'.format(cpp_type, c_name))
-                else:
-                    opencv_cpp.write('return _{}();'.format(c_name))
-                opencv_cpp.unindent()
-                opencv_cpp.write('}')
+                literal = ocaml_literal(arg_type, param.default_value)
+                if literal is not None:
+                    # no need to ask C++ what a literal is
+                    default_literals[param.name] = literal
+                elif not mli_only:
+                    # There are screwy things with autoboxing rules and whatnot,
+                    # so the easiest thing for us to do here is put the default
+                    # value as a default argument in a helper function and then
+                    # call that function - that way it is the same syntactic
+                    # class as the header file from which it is pulled.
 
-                opencv_ml.write('let {} ='.format(ocaml_name))
-                opencv_ml.indent()
-                opencv_ml.write('let f = foreign "{}" (void @-> returning ({})) in'
-                                .format(c_name, arg_type.get_ctypes_value()))
-                opencv_ml.write('fun () -> let v = f () in {}'
-                                .format(arg_type.ctypes_to_ocaml('v')))
-                opencv_ml.unindent()
+                    opencv_cpp.write(
+                        '{} _{}({} v = {}) {{'.format(cpp_type, c_name,
+                                                      cpp_type, param.default_value))
+                    opencv_cpp.indent()
+                    opencv_cpp.write('return v;')
+                    opencv_cpp.unindent()
+                    opencv_cpp.write('}')
+
+                    # whether the value made for each call is freed with the
+                    # OCaml value it is converted to
+                    default_new = arg_type.must_pass_pointer() and not arg_type.is_pointer() \
+                        and not arg_type.is_copied() \
+                        and arg_type.ctypes_to_ocaml_new('v') is not None
+                    opencv_cpp.write('{} {}() {{'.format(pointerized_type, c_name))
+                    opencv_cpp.indent()
+                    if default_new:
+                        opencv_cpp.write(
+                            'return new {}(_{}());'.format(cpp_type, c_name))
+                    elif arg_type.must_pass_pointer() and not arg_type.is_pointer():
+                        # copied when it is converted to OCaml (see below),
+                        # or else not freed by the value it is converted to,
+                        # so one object serves every call
+                        opencv_cpp.write('static {} v = _{}();'.format(cpp_type, c_name))
+                        opencv_cpp.write('return &v;')
+                    elif cpp_type.endswith('&'):
+                        # the default argument of the helper is a
+                        # temporary, which would not outlive the call
+                        opencv_cpp.write('static {} v = _{}();'.format(
+                            cpp_type[:-1].rstrip(), c_name))
+                        opencv_cpp.write('return v;')
+                    else:
+                        opencv_cpp.write('return _{}();'.format(c_name))
+                    opencv_cpp.unindent()
+                    opencv_cpp.write('}')
+
+                    default_binding = write_binding(c_name, [], arg_type.get_ctypes_value())
+                    opencv_ml.write('let {} ='.format(ocaml_name))
+                    opencv_ml.indent()
+                    if arg_type.is_value():
+                        # fetched on first use and shared by all later calls;
+                        # a ref rather than a lazy value, since forcing a lazy
+                        # value concurrently from two domains raises
+                        opencv_ml.write('let cache = ref None in')
+                        opencv_ml.write('fun () ->')
+                        opencv_ml.indent()
+                        opencv_ml.write('match !cache with')
+                        opencv_ml.write('| Some v -> v')
+                        opencv_ml.write('| None ->')
+                        opencv_ml.indent()
+                        opencv_ml.write('let v = {} in'.format(
+                            arg_type.ctypes_to_ocaml('{} ()'.format(default_binding))))
+                        opencv_ml.write('cache := Some v;')
+                        opencv_ml.write('v')
+                        opencv_ml.unindent()
+                        opencv_ml.unindent()
+                    elif default_new:
+                        opencv_ml.write('fun () -> let v = {} () in {}'
+                                        .format(default_binding, arg_type.ctypes_to_ocaml_new('v')))
+                    else:
+                        opencv_ml.write('fun () -> let v = {} () in {}'
+                                        .format(default_binding, arg_type.ctypes_to_ocaml('v')))
+                    opencv_ml.unindent()
 
                 total_default_params += 1
             elif type_manager.get_type(param.arg_type).has_default_value():
@@ -851,23 +1495,36 @@ if __name__ == '__main__':
         ret_type = type_manager.get_type(function.return_type)
 
         if function.return_type == 'void':
-            invoke_fmt = '{};'
+            invoke_fmt = ['{};']
         elif ret_type.must_pass_pointer() and not ret_type.is_pointer():
-            invoke_fmt = 'return new {} ({{}});'.format(
-                ret_type.get_cpp_type())
+            if ret_type.is_copied():
+                # copied into an OCaml value as soon as the call returns,
+                # so it only needs to live until then
+                invoke_fmt = ['static thread_local {} __ret;'.format(ret_type.get_cpp_type()),
+                              '__ret = {};',
+                              'return &__ret;']
+            else:
+                invoke_fmt = ['return new {} ({{}});'.format(
+                    ret_type.get_cpp_type())]
         else:
-            invoke_fmt = 'return {};'
+            invoke_fmt = ['return {};']
+        returns_new = function.return_type != 'void' and ret_type.must_pass_pointer() \
+            and not ret_type.is_pointer() and not ret_type.is_copied() \
+            and ret_type.ctypes_to_ocaml_new('') is not None
 
         if not mli_only:
             opencv_cpp.write('{} {{'.format(stub))
             opencv_cpp.indent()
-            opencv_cpp.write(invoke_fmt.format(ret_type.cpp_to_c(value)))
+            for line in invoke_fmt:
+                opencv_cpp.write(line.format(ret_type.cpp_to_c(value)))
             opencv_cpp.unindent()
             opencv_cpp.write('}')
 
         def get_param_name(param):
             typ = type_manager.get_type(param.arg_type)
-            if param.default_value is not None:
+            if param.name in default_literals:
+                return '?({} = {})'.format(param.ocaml_name, default_literals[param.name])
+            elif param.default_value is not None:
                 return '?({} = {} ())' \
                     .format(param.ocaml_name,
                             param.get_default_val_ocaml_name(enclosing_module,
@@ -905,15 +1562,6 @@ if __name__ == '__main__':
         if len(function.parameters) == 0:
             param_names_prime.append('()')
 
-        ctypes_sig_list = [type_manager.get_type(param.arg_type).get_ctypes_value()
-                           for param in function.parameters]
-        if len(ctypes_sig_list) == 0:
-            ctypes_sig_list.append('void')
-        ctypes_sig_list.append('returning ({})'
-                               .format(type_manager.get_type(function.return_type)
-                                       .get_ctypes_value()))
-        ctypes_sig = ' @-> '.join(ctypes_sig_list)
-
         returned_params = list(filter(lambda param: type_manager.get_type(
             param.arg_type).return_value('') is not None, function.parameters))
         returned_values = list(
@@ -933,12 +1581,32 @@ if __name__ == '__main__':
             and len(returned_params) == 0 \
             and optional_param_count < len(floated_params) - 1
 
+        unlocked = function.blocking or any(
+            type_manager.get_type(param.arg_type).is_array()
+            for param in function.parameters)
+
         if not mli_only:
-            opencv_ml.write('let __{} = foreign "{}" ({})'
-                            .format(function.ocaml_name, function.c_name, ctypes_sig))
+            opencv_ml.write('let __{} = {}'.format(function.ocaml_name, write_binding(
+                function.c_name,
+                [type_manager.get_type(param.arg_type).get_ctypes_value()
+                 for param in function.parameters],
+                type_manager.get_type(function.return_type).get_ctypes_value(),
+                unlocked=unlocked)))
             opencv_ml.write('let {} {} ='
                             .format(function.ocaml_name, ' '.join(floated_param_names)))
             opencv_ml.indent()
+            releases_headers = any(type_manager.get_type(param.arg_type).is_array()
+                                   for param in function.parameters)
+            if releases_headers:
+                # the headers made for the mats passed, which the results no
+                # longer need once they have been converted; only those made
+                # here, as the caller may have some of its own
+                opencv_ml.write('let __mark = Mat.headers_mark () in')
+                opencv_ml.write('Fun.protect ~finally:(fun () -> Mat.release_headers __mark) (fun () ->')
+                opencv_ml.indent()
+            # the scopes opened for the conversions that are released even if
+            # the call raises
+            protected = 1 if releases_headers else 0
             for param in function.parameters:
                 param_type = type_manager.get_type(param.arg_type)
                 if param_type.is_cloneable():
@@ -946,14 +1614,33 @@ if __name__ == '__main__':
                         .format(param.ocaml_name)
                 else:
                     fmt = "let {}' = {} in"
-                opencv_ml.write(fmt.format(param.ocaml_name, param_type
-                                           .ocaml_to_ctypes(param.ocaml_name)))
+                conv = param_type.ocaml_to_ctypes(param.ocaml_name)
+                opencv_ml.write(fmt.format(param.ocaml_name, conv))
+                if conv.release is not None:
+                    opencv_ml.write('Fun.protect ~finally:(fun () -> {}) (fun () ->'.format(
+                        conv.release(param.ocaml_name, "{}'".format(param.ocaml_name))))
+                    opencv_ml.indent()
+                    protected += 1
+            call = '__{} {}'.format(function.ocaml_name, ' '.join(param_names_prime))
+            if returns_new:
+                # the object allocated by the stub for the result is freed
+                # with the value it is converted to
+                res = ret_type.ctypes_to_ocaml_new(call)
+            else:
+                res = ret_type.ctypes_to_ocaml(call)
             opencv_ml.write('let {} = {} in'
-                            .format('_' if erase_return_unit else 'res',
-                                    type_manager.get_type(function.return_type)
-                                    .ctypes_to_ocaml('__{} {}'
-                                                     .format(function.ocaml_name,
-                                                             ' '.join(param_names_prime)))))
+                            .format('_' if erase_return_unit else 'res', res))
+            if unlocked:
+                # the data of arrays, and the memory that conversions allocate
+                kept = []
+                for param in function.parameters:
+                    param_type = type_manager.get_type(param.arg_type)
+                    if param_type.is_array():
+                        kept.append(param.ocaml_name)
+                    if param_type.ocaml_to_ctypes(param.ocaml_name) != param.ocaml_name:
+                        kept.append("{}'".format(param.ocaml_name))
+                if kept:
+                    opencv_ml.write(' '.join('keep_alive {};'.format(name) for name in kept))
             for param in function.parameters:
                 post_func = type_manager.get_type(param.arg_type) \
                     .ocaml_to_ctypes(param.ocaml_name).post
@@ -961,7 +1648,9 @@ if __name__ == '__main__':
                     post = post_func(param.ocaml_name,
                                      "{}'".format(param.ocaml_name))
                     opencv_ml.write('{};'.format(post))
-            opencv_ml.write(', '.join(returned_values))
+            opencv_ml.write(', '.join(returned_values) + ')' * protected)
+            for _ in range(protected):
+                opencv_ml.unindent()
             opencv_ml.unindent()
 
         def get_param_type(param):
@@ -990,6 +1679,9 @@ if __name__ == '__main__':
 
         opencv_mli.write('val {} : {}'.format(function.ocaml_name, ocaml_sig))
 
+        if not mli_only:
+            prof.count('functions_generated')
+
         if is_draw_function:
             def is_draw_function_param(param):
                 return type_manager.get_type(param.arg_type).is_draw_function()
@@ -1062,8 +1754,9 @@ if __name__ == '__main__':
         opencv_mli.write()
         opencv_mli.write('(** [draw queue mat] is the mat resulting from sequentially')
         opencv_mli.write('    performing all drawing operations in the [queue] to [mat].')
-        opencv_mli.write('    The returned mat starts as a clone of [mat], so [mat] is')
-        opencv_mli.write('    not modified, i.e. this is a pure function. *)')
+        opencv_mli.write('    The returned mat starts as a copy-on-write clone of [mat],')
+        opencv_mli.write('    so [mat] is not modified, i.e. this is a pure function, and')
+        opencv_mli.write('    it is only copied if there is something to draw. *)')
         opencv_mli.write('val draw : t list -> Cvdata.t -> Cvdata.t')
 
         opencv_ml.write('type t = Cvdata.t -> unit')
@@ -1111,15 +1804,29 @@ if __name__ == '__main__':
         opencv_ml.unindent()
         opencv_ml.write('end')
 
+    write_struct = prof.timed('write_struct', write_struct)
+    write_class = prof.timed('write_class', write_class)
+    write_function = prof.timed('write_function', write_function)
+    write_enum = prof.timed('write_enum', write_enum)
+    write_draw_module = prof.timed('write_draw_module', write_draw_module)
 
+    struct_types = {struct.cpp_name: struct for struct in structs}
     for struct in structs:
         write_struct(struct)
 
-    for cls in classes.values():
-        write_class(cls)
+    # everything is emitted in module order, with each module's share of
+    # the time recorded separately
+    for group in selected_modules:
+        with prof.phase('module {}'.format(group)):
+            for cls in classes.values():
+                if cls.group == group:
+                    write_class(cls)
 
-    for function in functions:
-        write_function(function)
+    for group in selected_modules:
+        with prof.phase('module {}'.format(group)):
+            for function in functions:
+                if function.group == group:
+                    write_function(function)
 
     write_draw_module()
 
@@ -1131,8 +1838,10 @@ if __name__ == '__main__':
     opencv_ml.write('module Cvconst = struct')
     opencv_ml.indent()
 
-    for enum in enums:
-        write_enum(enum)
+    for group in selected_modules:
+        with prof.phase('module {}'.format(group)):
+            for enum, consts in write_enum_consts(group):
+                write_enum(enum, consts)
 
     write_enum_converter()
 
@@ -1150,15 +1859,57 @@ if __name__ == '__main__':
     opencv_mli.write('val (~~) : Cvconst.cv_const -> int')
     opencv_mli.write()
 
-    opencv_h.unindent()
-    opencv_h.write('}')
-
-    opencv_cpp.unindent()
-    opencv_cpp.write('}')
+    for opencv_cpp in opencv_cpp_units.values():
+        opencv_cpp.unindent()
+        opencv_cpp.write('}')
 
-    opencv_h.save()
-    opencv_cpp.save()
-    opencv_ml.save()
-    opencv_mli.save()
+    opencv_bindings.unindent()
+    opencv_bindings.write('end')
+    opencv_bindings.write()
+    opencv_bindings.write('(* bound with the runtime lock released; see write_binding *)')
+    opencv_bindings.write('module Make_unlocked (F : Ctypes.FOREIGN) = struct')
+    opencv_bindings.indent()
+    opencv_bindings.write('open F')
+    opencv_bindings.write_all(unlocked_bindings)
+    opencv_bindings.unindent()
+    opencv_bindings.write('end')
+
+    output_files = [opencv_h] + list(opencv_cpp_units.values()) + unselected_cpp_units \
+        + [opencv_ml, opencv_mli, opencv_bindings, opencv_cstubs_h]
+    with prof.phase('save'):
+        for output_file in output_files:
+            output_file.save()
+            prof.count('lines_emitted', output_file.line_count)
 
     print('Missing types:', missing_types)
+    print('Type resolution cache:', type_manager.cache_stats)
+    print('Generated bindings in {:.3f}s'.format(time.time() - start_time))
+
+    if args.profile is not None:
+        module_report = {}
+        for group in selected_modules:
+            hpaths = [os.path.join(system_include_dir, hname) for hname in modules[group]]
+            module_report[group] = {
+                'headers': modules[group],
+                'parse_time': sum(prof.phases.get('parse {}'.format(hpath), {'time': 0})['time']
+                                  for hpath in hpaths),
+                'emit_time': prof.phases['module {}'.format(group)]['time'],
+                'cpp_lines': opencv_cpp_units[group].line_count,
+            }
+
+        print('{:<12} {:>8} {:>8} {:>10}'.format('Module', 'Parse', 'Emit', 'C++ lines'))
+        for group, report in module_report.items():
+            print('{:<12} {:>7.3f}s {:>7.3f}s {:>10}'.format(
+                group, report['parse_time'], report['emit_time'], report['cpp_lines']))
+
+        prof.save(os.path.join(path, PROFILE_REPORT), extra={
+            'modules': module_report,
+            'total_time': time.time() - start_time,
+            'jobs': args.jobs,
+            'headers': src_files,
+            'cached_headers': cached_count,
+            'lines_per_file': {output_file.name: output_file.line_count
+                               for output_file in output_files},
+            'type_cache': vars(type_manager.cache_stats),
+        })
+        print('Wrote profile to {}'.format(os.path.join(path, PROFILE_REPORT)))
@@ -816,10 +816,80 @@ class CppHeaderParser(object):
                 token = t
         return token, tpos
 
-    def parse(self, hname, wmode=True):
+    def process_stmt(self, stmt, token, docstring, decls):
+        """
+        Handles a complete statement terminated by 'token' (one of ';', '{' or '}'),
+        appending any resulting declarations to 'decls' and maintaining the block stack.
+        Returns the docstring that applies to the following statements.
+        """
+        stack_top = self.block_stack[-1]
+
+        decl = None
+        if stack_top[self.PROCESS_FLAG]:
+            # even if stack_top[PUBLIC_SECTION] is False, we still try to process the statement,
+            # since it can start with "public:"
+            docstring = docstring.strip()
+            stmt_type, name, parse_flag, decl = self.parse_stmt(
+                stmt, token, docstring=docstring)
+            if decl:
+                if stmt_type.startswith("enum"):
+                    decls.append(
+                        [stmt_type + " " + self.get_dotted_name(name), "", [], decl, None, ""])
+                else:
+                    decls.append(decl)
+
+                    if self._generate_gpumat_decls and "cv.cuda" in decl[0]:
+                        # If function takes as one of arguments Mat or vector<Mat> - we want to create the
+                        # same declaration working with GpuMat
+                        args = decl[3]
+                        has_mat = len(
+                            list(filter(lambda x: x[0] in {"Mat", "vector_Mat"}, args))) > 0
+                        if has_mat:
+                            _, _, _, gpumat_decl = self.parse_stmt(
+                                stmt, token, mat="cuda::GpuMat", docstring=docstring)
+                            decls.append(gpumat_decl)
+
+                    if self._generate_umat_decls:
+                        # If function takes as one of arguments Mat or vector<Mat> - we want to create the
+                        # same declaration working with UMat (this is important for T-Api access)
+                        args = decl[3]
+                        has_mat = len(
+                            list(filter(lambda x: x[0] in {"Mat", "vector_Mat"}, args))) > 0
+                        if has_mat:
+                            _, _, _, umat_decl = self.parse_stmt(
+                                stmt, token, mat="UMat", docstring=docstring)
+                            decls.append(umat_decl)
+
+                docstring = ""
+            if stmt_type == "namespace":
+                chunks = [
+                    block[1] for block in self.block_stack if block[0] == 'namespace'] + [name]
+                self.namespaces.add('.'.join(chunks))
+        else:
+            stmt_type, name, parse_flag = "block", "", False
+
+        if token == "{":
+            if stmt_type == "class":
+                public_section = False
+            else:
+                public_section = True
+            self.block_stack.append(
+                [stmt_type, name, parse_flag, public_section, decl])
+
+        if token == "}":
+            if not self.block_stack:
+                print("Error at %d: the block stack is empty" %
+                      (self.lineno,))
+            self.block_stack[-1:] = []
+
+        return docstring
+
+    def parse(self, hname, wmode=True, streaming=True):
         """
         The main method. Parses the input file.
         Returns the list of declarations (that can be print using print_decls)
+        If 'streaming' is False, the original line-by-line scanner is used instead of tokenize();
+        both produce the same declarations.
         """
         self.hname = hname
         decls = []
@@ -827,6 +897,209 @@ class CppHeaderParser(object):
         linelist = list(f.readlines())
         f.close()
 
+        self.block_stack = [["file", hname, True, True, None]]
+        self.wrap_mode = wmode
+
+        if not streaming:
+            return self.parse_lines(linelist, decls)
+
+        docstring = ""
+        for event in self.tokenize(linelist):
+            if event[0] == "stmt":
+                docstring = self.process_stmt(event[1], event[2], docstring, decls)
+            elif event[0] == "docstring":
+                docstring = event[1]
+
+        return decls
+
+    # matches the statement tokens searched for by parse_lines: ';', '"', '{', '}', '//', '/*'
+    _stmt_token_re = re.compile(r'[;"{}]|//|/\*')
+    _string_token_re = re.compile(r'[\\"]')
+    _line_comment_re = re.compile(r'//(.+)?')
+
+    def tokenize(self, linelist):
+        """
+        Scans the lines of a header, yielding events:
+            ("stmt", statement, token) for each statement terminated by ';', '{' or '}',
+            ("docstring", text) for each docstring, which applies to the statements after it,
+            ("directive", text) for each preprocessor directive outside of '#if 0' blocks.
+        Tokens are found with a single precompiled regular expression, and each line is scanned
+        by position rather than by repeatedly slicing it, so the work done is linear in the
+        length of the input.
+        """
+        # states:
+        SCAN = 0  # outside of a comment or preprocessor directive
+        COMMENT = 1  # inside a multi-line comment
+        DIRECTIVE = 2  # inside a multi-line preprocessor directive
+        DOCSTRING = 3  # inside a multi-line docstring
+        DIRECTIVE_IF_0 = 4  # inside a '#if 0' directive
+
+        state = SCAN
+
+        stmt_token_search = self._stmt_token_re.search
+        string_token_search = self._string_token_re.search
+
+        # the pieces of the current statement so far, and the first and last non-blank pieces,
+        # which are what the CV_ENUM_FLAGS check needs to look at
+        head = []
+        head_first = head_last = ""
+        directive = []
+        docstring = []
+        self.lineno = 0
+
+        depth_if_0 = 0
+
+        for l0 in linelist:
+            self.lineno += 1
+
+            l = l0.strip()
+
+            if state == SCAN and l.startswith("#"):
+                state = DIRECTIVE
+                # fall through to the if state == DIRECTIVE check
+
+            if state == DIRECTIVE:
+                directive.append(l)
+                if l.endswith("\\"):
+                    continue
+                state = SCAN
+                l = self._line_comment_re.sub('', l).strip()  # drop // comment
+                if l == '#if 0' or l == '#if defined(__OPENCV_BUILD)' or l == '#ifdef __OPENCV_BUILD':
+                    state = DIRECTIVE_IF_0
+                    depth_if_0 = 1
+                yield ("directive", "\n".join(directive))
+                directive = []
+                continue
+
+            if state == DIRECTIVE_IF_0:
+                if l.startswith('#'):
+                    l = l[1:].strip()
+                    if l.startswith("if"):
+                        depth_if_0 += 1
+                        continue
+                    if l.startswith("endif"):
+                        depth_if_0 -= 1
+                        if depth_if_0 == 0:
+                            state = SCAN
+                continue
+
+            if state == COMMENT:
+                pos = l.find("*/")
+                if pos < 0:
+                    continue
+                l = l[pos+2:]
+                state = SCAN
+
+            if state == DOCSTRING:
+                pos = l.find("*/")
+                if pos < 0:
+                    docstring.append(l0)
+                    continue
+                docstring.append(l[:pos] + "\n")
+                yield ("docstring", "".join(docstring))
+                l = l[pos+2:]
+                state = SCAN
+
+            if l.startswith('CV__') or l.startswith('__CV_'):  # just ignore these lines
+                state = SCAN
+                continue
+
+            if state != SCAN:
+                print("Error at %d: invalid state = %d" % (self.lineno, state))
+                sys.exit(-1)
+
+            start = 0
+            end = len(l)
+            while 1:
+                m = stmt_token_search(l, start)
+
+                if m is None:
+                    piece = l[start:]
+                    start = end
+                    head.append(piece)
+                    if piece.strip():
+                        head_last = piece.rstrip()
+                        if not head_first:
+                            head_first = piece.lstrip()
+                    if head_last.endswith(')') and head_first.startswith('CV_ENUM_FLAGS('):
+                        token = ';'
+                        pos = end
+                        tail = ""
+                    else:
+                        break
+                else:
+                    token = m.group()
+                    pos = m.start()
+
+                    if token != ';' and token != '{' and token != '}':
+                        if token == "\"":
+                            pos2 = pos + 1
+                            while 1:
+                                m2 = string_token_search(l, pos2)
+                                if m2 is None:
+                                    print("Error at %d: no terminating '\"'" %
+                                          (self.lineno,))
+                                    sys.exit(-1)
+                                pos2 = m2.start()
+                                if m2.group() == "\"":
+                                    break
+                                pos2 += 2
+                            piece = l[start:pos2+1]
+                            start = pos2 + 1
+                        else:
+                            piece = l[start:pos]
+                        head.append(piece)
+                        if piece.strip():
+                            head_last = piece.rstrip()
+                            if not head_first:
+                                head_first = piece.lstrip()
+
+                        if token == "//":
+                            start = end
+                            continue
+
+                        if token == "/*":
+                            end_pos = l.find("*/", pos+2)
+                            if len(l) > pos + 2 and l[pos+2] == "*":
+                                # '/**', it's a docstring
+                                if end_pos < 0:
+                                    state = DOCSTRING
+                                    docstring = [l[pos+3:] + "\n"]
+                                    break
+                                else:
+                                    yield ("docstring", l[pos+3:end_pos])
+
+                            elif end_pos < 0:
+                                state = COMMENT
+                                break
+                            start = end_pos + 2
+
+                        continue
+
+                    tail = l[start:pos]
+
+                head.append(tail)
+                stmt = " ".join(" ".join(head).split())  # normalize the statement
+
+                if stmt.startswith("@"):
+                    # Objective C ?
+                    head.pop()
+                    break
+
+                head = []
+                head_first = head_last = ""
+
+                yield ("stmt", stmt, token)
+
+                if token == "}" and pos+1 < end and l[pos+1] == ';':
+                    pos += 1
+
+                start = pos + 1
+
+    def parse_lines(self, linelist, decls):
+        """
+        The original line-by-line scanner, kept as a reference for tokenize().
+        """
         # states:
         SCAN = 0  # outside of a comment or preprocessor directive
         COMMENT = 1  # inside a multi-line comment
@@ -836,11 +1109,9 @@ class CppHeaderParser(object):
 
         state = SCAN
 
-        self.block_stack = [["file", hname, True, True, None]]
         block_head = ""
         docstring = ""
         self.lineno = 0
-        self.wrap_mode = wmode
 
         depth_if_0 = 0
 
@@ -959,71 +1230,14 @@ class CppHeaderParser(object):
                 stmt = (block_head + " " + l[:pos]).strip()
                 stmt = " ".join(stmt.split())  # normalize the statement
                 # print(stmt)
-                stack_top = self.block_stack[-1]
-
                 if stmt.startswith("@"):
                     # Objective C ?
                     break
 
-                decl = None
-                if stack_top[self.PROCESS_FLAG]:
-                    # even if stack_top[PUBLIC_SECTION] is False, we still try to process the statement,
-                    # since it can start with "public:"
-                    docstring = docstring.strip()
-                    stmt_type, name, parse_flag, decl = self.parse_stmt(
-                        stmt, token, docstring=docstring)
-                    if decl:
-                        if stmt_type.startswith("enum"):
-                            decls.append(
-                                [stmt_type + " " + self.get_dotted_name(name), "", [], decl, None, ""])
-                        else:
-                            decls.append(decl)
-
-                            if self._generate_gpumat_decls and "cv.cuda" in decl[0]:
-                                # If function takes as one of arguments Mat or vector<Mat> - we want to create the
-                                # same declaration working with GpuMat
-                                args = decl[3]
-                                has_mat = len(
-                                    list(filter(lambda x: x[0] in {"Mat", "vector_Mat"}, args))) > 0
-                                if has_mat:
-                                    _, _, _, gpumat_decl = self.parse_stmt(
-                                        stmt, token, mat="cuda::GpuMat", docstring=docstring)
-                                    decls.append(gpumat_decl)
-
-                            if self._generate_umat_decls:
-                                # If function takes as one of arguments Mat or vector<Mat> - we want to create the
-                                # same declaration working with UMat (this is important for T-Api access)
-                                args = decl[3]
-                                has_mat = len(
-                                    list(filter(lambda x: x[0] in {"Mat", "vector_Mat"}, args))) > 0
-                                if has_mat:
-                                    _, _, _, umat_decl = self.parse_stmt(
-                                        stmt, token, mat="UMat", docstring=docstring)
-                                    decls.append(umat_decl)
-
-                        docstring = ""
-                    if stmt_type == "namespace":
-                        chunks = [
-                            block[1] for block in self.block_stack if block[0] == 'namespace'] + [name]
-                        self.namespaces.add('.'.join(chunks))
-                else:
-                    stmt_type, name, parse_flag = "block", "", False
+                docstring = self.process_stmt(stmt, token, docstring, decls)
 
-                if token == "{":
-                    if stmt_type == "class":
-                        public_section = False
-                    else:
-                        public_section = True
-                    self.block_stack.append(
-                        [stmt_type, name, parse_flag, public_section, decl])
-
-                if token == "}":
-                    if not self.block_stack:
-                        print("Error at %d: the block stack is empty" %
-                              (self.lineno,))
-                    self.block_stack[-1:] = []
-                    if pos+1 < len(l) and l[pos+1] == ';':
-                        pos += 1
+                if token == "}" and pos+1 < len(l) and l[pos+1] == ';':
+                    pos += 1
 
                 block_head = ""
                 l = l[pos+1:]
@@ -1046,7 +1260,44 @@ class CppHeaderParser(object):
                     print()
 
 
+def compare_scanners(hnames):
+    """
+    Differential check of tokenize() against the original line-by-line scanner:
+    parses every header with both and reports any header for which the declarations differ.
+    Returns the number of differing headers.
+    """
+    import time
+    failures = 0
+    elapsed = {False: 0.0, True: 0.0}
+    for hname in hnames:
+        results = {}
+        for streaming in (False, True):
+            for wmode in (False, True):
+                parser = CppHeaderParser(generate_umat_decls=True,
+                                         generate_gpumat_decls=True)
+                start = time.time()
+                try:
+                    result = (parser.parse(hname, wmode=wmode, streaming=streaming),
+                              parser.namespaces)
+                except SystemExit:
+                    # both scanners should give up at the same point
+                    result = ("exit", parser.lineno)
+                elapsed[streaming] += time.time() - start
+                results[(streaming, wmode)] = result
+        for wmode in (False, True):
+            if results[(False, wmode)] != results[(True, wmode)]:
+                print("MISMATCH: %s (wmode=%s)" % (hname, wmode))
+                failures += 1
+    print("%d headers, %d mismatches; line scanner %.3fs, streaming scanner %.3fs" %
+          (len(hnames), failures, elapsed[False], elapsed[True]))
+    return failures
+
+
 if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--compare':
+        # e.g. python hdr_parser.py --compare /usr/include/opencv4/opencv2/*.hpp
+        sys.exit(1 if compare_scanners(sys.argv[2:]) > 0 else 0)
+
     parser = CppHeaderParser(generate_umat_decls=True,
                              generate_gpumat_decls=True)
     decls = []
@@ -0,0 +1,109 @@
+
+# Phase-level timing and memory accounting for the binding generator,
+# enabled with generator.py --profile.
+
+import time
+import json
+import tracemalloc
+import contextlib
+
+
+class _Frame():
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        # highest traced memory seen so far in this phase, including
+        # in phases nested inside of it
+        self.peak = 0
+
+
+class Profiler():
+    def __init__(self, enabled=False, trace_memory=True):
+        # tracing memory allocations slows Python down considerably, so it
+        # can be turned off to get representative timings
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.phases = {}
+        self.counters = {}
+        self.stack = []
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _traced_peak(self):
+        return tracemalloc.get_traced_memory()[1] if self.trace_memory else 0
+
+    def _enter(self, name):
+        if len(self.stack) > 0 and self.trace_memory:
+            # resetting the peak below would lose the enclosing phase's
+            # peak so far, so save it first
+            self.stack[-1].peak = max(self.stack[-1].peak, self._traced_peak())
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.stack.append(_Frame(name))
+
+    def _exit(self):
+        frame = self.stack.pop()
+        elapsed = time.perf_counter() - frame.start
+        peak = max(frame.peak, self._traced_peak())
+        if len(self.stack) > 0:
+            self.stack[-1].peak = max(self.stack[-1].peak, peak)
+        self.record(frame.name, elapsed, peak)
+
+    def record(self, name, elapsed, peak, calls=1):
+        """Adds a measurement to the phase name. Times are inclusive of
+        any phases nested inside of this one. Peak memory is 0 if memory is
+        not being traced.
+        """
+        phase = self.phases.setdefault(
+            name, {'calls': 0, 'time': 0.0, 'peak_memory': 0})
+        phase['calls'] += calls
+        phase['time'] += elapsed
+        phase['peak_memory'] = max(phase['peak_memory'], peak)
+
+    def merge(self, phases):
+        """Adds the phases recorded by another profiler, e.g. one that was
+        running in a worker process.
+        """
+        for name, phase in phases.items():
+            self.record(name, phase['time'], phase['peak_memory'],
+                        calls=phase['calls'])
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def phase(self, name):
+        """A context manager that records the wall time and peak Python
+        memory usage of its body as part of the phase name.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._phase(name)
+
+    def timed(self, name, fn):
+        """Wraps fn so that each call to it is recorded as part of the
+        phase name.
+        """
+        if not self.enabled:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            with self._phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def save(self, fname, extra={}):
+        report = dict(extra)
+        report['phases'] = self.phases
+        report['counters'] = self.counters
+        with open(fname, 'wt') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
@@ -0,0 +1,112 @@
+open Ctypes
+
+let __async_writer_open = Glue.async_writer_open
+let __async_writer_write = Glue.async_writer_write
+let __async_writer_flush = Glue.async_writer_flush
+let __async_writer_stats = Glue.async_writer_stats
+let __async_writer_close = Glue.async_writer_close
+
+type policy = Block | Drop_newest | Drop_oldest
+
+type t = {
+  writer : unit ptr;
+  (* the dimensions of the frames, as those of a bigarray *)
+  dims : int array;
+  mutable closed : bool;
+}
+
+type stats = {
+  queued : int;
+  written : int;
+  dropped : int;
+  depth : int;
+  max_depth : int;
+}
+
+(* see glue.h *)
+let int_of_policy = function
+  | Block -> 0
+  | Drop_newest -> 1
+  | Drop_oldest -> 2
+
+(* offsets of the fields of the statistics filled in by async_writer_stats,
+   in C ints; see glue.h *)
+let stats_queued = 0
+let stats_written = 1
+let stats_dropped = 2
+let stats_depth = 3
+let stats_max_depth = 4
+let stats_size = 5
+
+let check_open name t =
+  if t.closed then invalid_arg (name ^ ": writer is closed")
+
+(* the writers that have not been closed, which are closed at exit so that
+   the frames in their queues are written *)
+let open_writers = ref []
+let open_writers_lock = Mutex.create ()
+
+let with_open_writers f =
+  Mutex.lock open_writers_lock;
+  Fun.protect ~finally:(fun () -> Mutex.unlock open_writers_lock) f
+
+let close t =
+  let closing = with_open_writers (fun () ->
+      let closing = not t.closed in
+      t.closed <- true;
+      open_writers := List.filter (fun t' -> t' != t) !open_writers;
+      closing) in
+  if closing then __async_writer_close t.writer
+
+let () = at_exit (fun () -> List.iter close (with_open_writers (fun () -> !open_writers)))
+
+let open_file ?(policy = Block) ?(capacity = 8) ?(is_color = true) filename fourcc fps
+    ~width ~height =
+  if capacity < 1 then invalid_arg "Async_writer.open_file: capacity must be positive";
+  let writer = __async_writer_open filename fourcc fps width height
+      (if is_color then 1 else 0) capacity (int_of_policy policy) in
+  if is_null writer then failwith ("Async_writer.open_file: cannot open " ^ filename);
+  let t = { writer; dims = [| height; width; if is_color then 3 else 1 |]; closed = false } in
+  with_open_writers (fun () -> open_writers := t :: !open_writers);
+  t
+
+let string_of_dims dims =
+  String.concat "x" (Array.to_list (Array.map string_of_int dims))
+
+let write_typed t (m : ('a, 'b) Mat.typed) =
+  let root = Root.create m in
+  let queued = __async_writer_write t.writer root in
+  Root.release root;
+  (* the data is copied before the call returns, but the runtime lock is
+     released while it waits for room *)
+  ignore (Sys.opaque_identity m);
+  queued <> 0
+
+let write t (cvdata : Cvdata.t) =
+  check_open "Async_writer.write" t;
+  match cvdata with
+    | Cvdata.Mat m ->
+        (* checked here, since the encoder would only fail later, on its own
+           thread *)
+        if Bigarray.Genarray.dims m <> t.dims then
+          invalid_arg (Printf.sprintf "Async_writer.write: frame is %s, not %s"
+                         (string_of_dims (Bigarray.Genarray.dims m)) (string_of_dims t.dims));
+        write_typed t m
+    | _ -> invalid_arg "Async_writer.write: not an 8-bit unsigned mat"
+
+let flush t =
+  check_open "Async_writer.flush" t;
+  __async_writer_flush t.writer
+
+let stats t =
+  check_open "Async_writer.stats" t;
+  let buf = Bytes.create (stats_size * sizeof int) in
+  __async_writer_stats t.writer (ocaml_bytes_start buf);
+  let field i = Int32.to_int (Bytes.get_int32_ne buf (i * sizeof int)) in
+  {
+    queued = field stats_queued;
+    written = field stats_written;
+    dropped = field stats_dropped;
+    depth = field stats_depth;
+    max_depth = field stats_max_depth;
+  }
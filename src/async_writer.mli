@@ -0,0 +1,46 @@
+(** Writing a video with a thread of its own that encodes the frames, so
+    that the caller does not wait for encoding. Frames are copied into a
+    bounded queue when they are written, so the mats written can be reused
+    at once, including by {!Mat.Pool}. *)
+
+type t
+
+(** What {!write} does when the queue is full: wait for the encoder to make
+    room, drop the frame being written, or drop the oldest frame in the
+    queue to make room for it. *)
+type policy = Block | Drop_newest | Drop_oldest
+
+type stats = {
+  queued : int;  (** the frames queued so far *)
+  written : int;  (** the frames encoded so far *)
+  dropped : int;  (** the frames dropped so far *)
+  depth : int;  (** the frames in the queue or being encoded *)
+  max_depth : int;  (** the most frames that have been in the queue at once *)
+}
+
+(** [open_file ?policy ?capacity ?is_color filename fourcc fps ~width ~height]
+    opens [filename] as [Video_writer] would, e.g. with a [fourcc] made by
+    [Video_writer.fourcc], to write frames of [width] by [height] through a
+    queue of at most [capacity] frames, 8 by default. [policy] is [Block]
+    by default. Raises [Failure] if the file cannot be opened. *)
+val open_file : ?policy:policy -> ?capacity:int -> ?is_color:bool -> string -> int ->
+  float -> width:int -> height:int -> t
+
+(** [write t frame] queues a copy of [frame] to be encoded, and is whether
+    it was queued rather than dropped. With [Block], it waits without
+    holding the runtime lock while the queue is full. Raises
+    [Invalid_argument] if [frame] is not an 8-bit unsigned mat of [height]
+    rows of [width] pixels, with 3 channels, or 1 if [is_color] was
+    [false]. *)
+val write : t -> Cvdata.t -> bool
+
+(** [flush t] waits until every frame queued has been encoded. *)
+val flush : t -> unit
+
+val stats : t -> stats
+
+(** [close t] encodes the frames still queued, closes the file and stops
+    the encoding thread. Writers that have not been closed are closed when
+    the program exits, but only then, so close a writer once it is no
+    longer needed. *)
+val close : t -> unit
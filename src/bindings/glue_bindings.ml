@@ -0,0 +1,115 @@
+open Ctypes
+
+(* The functions in glue.cpp, which are bound the same way as the generated
+   ones in Opencv_bindings; see stubgen/stubgen.ml. *)
+module Make (F : Ctypes.FOREIGN) = struct
+  open F
+
+  (* Mat functions *)
+
+  let mat_of_bigarray =
+    foreign "mat_of_bigarray" (int @-> ptr int @-> int @-> ptr void @-> returning (ptr void))
+  let headers_mark = foreign "headers_mark" (void @-> returning int)
+  let release_headers = foreign "release_headers" (int @-> returning void)
+  let mat_header =
+    foreign "mat_header" (ptr void @-> ocaml_bytes @-> returning (ptr void))
+  let bigarray_external =
+    foreign "bigarray_external" (ptr void @-> returning int)
+  let copy_inputarray_bigarray =
+    foreign "copy_inputarray_bigarray" (ptr void @-> ptr void @-> returning int)
+  let copy_mat_bigarray =
+    foreign "copy_mat_bigarray" (ptr void @-> ptr void @-> returning int)
+  let create_mat_typed =
+    foreign "create_mat_typed" (int @-> ptr int @-> int @-> returning (ptr void))
+  let release_mat = foreign "release_mat" (ptr void @-> returning void)
+  let adopt_mat = foreign "adopt_mat" (ptr void @-> returning void)
+  let mat_owns_data = foreign "mat_owns_data" (ptr void @-> returning int)
+  let mat_owners = foreign "mat_owners" (void @-> returning int)
+  let mat_copy = foreign "mat_copy" (ptr void @-> ptr void @-> returning void)
+
+  (* Vector functions *)
+
+  let vector_data = foreign "vector_data" (ptr void @-> returning (ptr void))
+  let vector_length = foreign "vector_length" (ptr void @-> returning int)
+  let create_vector =
+    foreign "create_vector" (ptr void @-> int @-> int @-> returning (ptr void))
+  let delete_vector = foreign "delete_vector" (ptr void @-> returning void)
+  let copy_vector_bigarray =
+    foreign "copy_vector_bigarray" (ptr void @-> ptr void @-> returning (ptr void))
+
+  (* InputArray functions *)
+
+  let inputarray_kind = foreign "inputarray_kind" (ptr void @-> returning int)
+  let mat_depth = foreign "mat_depth" (ptr void @-> returning int)
+  let inputarray_depth = foreign "inputarray_depth" (ptr void @-> returning int)
+  let inputarray_holds =
+    foreign "inputarray_holds" (ptr void @-> ptr void @-> int @-> returning int)
+  let mat_of_inputarray =
+    foreign "mat_of_inputarray" (ptr void @-> returning (ptr void))
+  let inputarray_mat =
+    foreign "inputarray_mat" (ptr void @-> returning (ptr void))
+  let mat_vector_of_inputarray =
+    foreign "mat_vector_of_inputarray" (ptr void @-> returning (ptr void))
+  let inputarray_array_length =
+    foreign "inputarray_array_length" (ptr void @-> returning int)
+  let mat_from_inputarray_array =
+    foreign "mat_from_inputarray_array" (ptr void @-> int @-> returning (ptr void))
+  let ragged_header =
+    foreign "ragged_header" (ptr void @-> ocaml_bytes @-> returning int)
+  let ragged_copy =
+    foreign "ragged_copy" (ptr void @-> ptr void @-> ptr void @-> returning void)
+  let inputarray_of_mat =
+    foreign "inputarray_of_mat" (ptr void @-> returning (ptr void))
+  let inputarray_of_mat_vector =
+    foreign "inputarray_of_mat_vector" (ptr void @-> returning (ptr void))
+  let create_vector_mat =
+    foreign "create_vector_mat" (int @-> returning (ptr void))
+  let add_vector_mat =
+    foreign "add_vector_mat" (ptr void @-> ptr void @-> returning void)
+
+  (* Struct argument functions *)
+
+  let struct_arg = foreign "struct_arg" (void @-> returning (ptr void))
+
+  (* Scalar functions *)
+
+  let build_scalar =
+    foreign "build_scalar" (double @-> double @-> double @-> double @-> returning (ptr void))
+  let scalar_w = foreign "scalar_w" (ptr void @-> returning double)
+  let scalar_x = foreign "scalar_x" (ptr void @-> returning double)
+  let scalar_y = foreign "scalar_y" (ptr void @-> returning double)
+  let scalar_z = foreign "scalar_z" (ptr void @-> returning double)
+
+  (* Thread functions *)
+
+  let get_num_threads = foreign "get_num_threads" (void @-> returning int)
+  let set_num_threads = foreign "set_num_threads" (int @-> returning void)
+
+  (* Prefetching reader functions *)
+
+  let prefetch_open =
+    foreign "prefetch_open" (string @-> int @-> int @-> returning (ptr void))
+  let prefetch_next = foreign "prefetch_next" (ptr void @-> returning int)
+  let prefetch_frame =
+    foreign "prefetch_frame" (ptr void @-> int @-> returning (ptr void))
+  let prefetch_release =
+    foreign "prefetch_release" (ptr void @-> int @-> returning void)
+  let prefetch_stats =
+    foreign "prefetch_stats" (ptr void @-> ocaml_bytes @-> returning void)
+  let prefetch_close = foreign "prefetch_close" (ptr void @-> returning void)
+
+  (* Asynchronous writer functions *)
+
+  let async_writer_open =
+    foreign "async_writer_open"
+      (string @-> int @-> double @-> int @-> int @-> int @-> int @-> int
+       @-> returning (ptr void))
+  let async_writer_write =
+    foreign "async_writer_write" (ptr void @-> ptr void @-> returning int)
+  let async_writer_flush =
+    foreign "async_writer_flush" (ptr void @-> returning void)
+  let async_writer_stats =
+    foreign "async_writer_stats" (ptr void @-> ocaml_bytes @-> returning void)
+  let async_writer_close =
+    foreign "async_writer_close" (ptr void @-> returning void)
+end
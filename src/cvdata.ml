@@ -1,7 +1,13 @@
+open Bigarray
 open Ctypes
-open Loader
 type t =
   | Mat of Mat.t
+  | Mat8s of (int, int8_signed_elt) Mat.typed
+  | Mat16u of (int, int16_unsigned_elt) Mat.typed
+  | Mat16s of (int, int16_signed_elt) Mat.typed
+  | Mat32s of (int32, int32_elt) Mat.typed
+  | Mat32f of (float, float32_elt) Mat.typed
+  | Mat64f of (float, float64_elt) Mat.typed
   | Unknown of unit Ctypes.ptr
 
 let of_mat mat =
@@ -11,97 +17,248 @@ let to_mat = function
   | Mat mat -> mat
   | _ -> failwith "to_mat"
 
+let of_typed : type a b. (a, b) Mat.typed -> t = fun mat ->
+  match Genarray.kind mat with
+    | Int8_unsigned -> Mat mat
+    | Int8_signed -> Mat8s mat
+    | Int16_unsigned -> Mat16u mat
+    | Int16_signed -> Mat16s mat
+    | Int32 -> Mat32s mat
+    | Float32 -> Mat32f mat
+    | Float64 -> Mat64f mat
+    | _ -> invalid_arg "of_typed: bigarray kind has no OpenCV depth"
+
+let to_typed : type a b. (a, b) kind -> t -> (a, b) Mat.typed = fun kind cvdata ->
+  match kind, cvdata with
+    | Int8_unsigned, Mat mat -> mat
+    | Int8_signed, Mat8s mat -> mat
+    | Int16_unsigned, Mat16u mat -> mat
+    | Int16_signed, Mat16s mat -> mat
+    | Int32, Mat32s mat -> mat
+    | Float32, Mat32f mat -> mat
+    | Float64, Mat64f mat -> mat
+    | _ -> failwith "to_typed"
+
+(* a function over mats of any depth *)
+type 'r mat_fn = { f : 'a 'b. ('a, 'b) Mat.typed -> 'r }
+
+(* fn applied to the mat in cvdata, or default if it is not a mat *)
+let with_mat (fn : 'r mat_fn) (default : 'r) (cvdata : t) : 'r =
+  match cvdata with
+    | Mat mat -> fn.f mat
+    | Mat8s mat -> fn.f mat
+    | Mat16u mat -> fn.f mat
+    | Mat16s mat -> fn.f mat
+    | Mat32s mat -> fn.f mat
+    | Mat32f mat -> fn.f mat
+    | Mat64f mat -> fn.f mat
+    | Unknown _ -> default
+
+let depth cvdata =
+  with_mat { f = fun mat -> Mat.depth_of_kind (Genarray.kind mat) } (-1) cvdata
+
 (* internal functions *)
 
-let __inputarray_kind =
-  foreign "inputarray_kind" (ptr void @-> returning int)
-let __mat_depth =
-  foreign "mat_depth" (ptr void @-> returning int)
-
-let __mat_of_inputarray =
-  foreign "mat_of_inputarray" (ptr void @-> returning (ptr void))
-let __mat_vector_of_inputarray =
-  foreign "mat_vector_of_inputarray" (ptr void @-> returning (ptr void))
-let __inputarray_array_length =
-  foreign "inputarray_array_length" (ptr void @-> returning int)
-let __mat_from_inputarray_array =
-  foreign "mat_from_inputarray_array" (ptr void @-> int @-> returning (ptr void))
-
-let extract_mat_from_cmat cmat =
-  let mat = Mat.bigarray_of_cmat cmat in
-  Mat.copy_cmat_bigarray cmat mat;
-  of_mat mat
+let __inputarray_kind = Glue.inputarray_kind
+let __inputarray_holds = Glue.inputarray_holds
+
+let __mat_of_inputarray = Glue.mat_of_inputarray
+let __mat_vector_of_inputarray = Glue.mat_vector_of_inputarray
+let __inputarray_array_length = Glue.inputarray_array_length
+let __mat_from_inputarray_array = Glue.mat_from_inputarray_array
+
+(* wraps the data of cmat, without copying it, in a bigarray of the kind
+   matching its depth *)
+let mat_of_cmat cmat =
+  let header = Mat.header cmat in
+  match header.depth with
+    | 0 -> Some (Mat (Mat.bigarray_of_header Int8_unsigned header))
+    | 1 -> Some (Mat8s (Mat.bigarray_of_header Int8_signed header))
+    | 2 -> Some (Mat16u (Mat.bigarray_of_header Int16_unsigned header))
+    | 3 -> Some (Mat16s (Mat.bigarray_of_header Int16_signed header))
+    | 4 -> Some (Mat32s (Mat.bigarray_of_header Int32 header))
+    | 5 -> Some (Mat32f (Mat.bigarray_of_header Float32 header))
+    | 6 -> Some (Mat64f (Mat.bigarray_of_header Float64 header))
+    | _ -> None
+
+let of_cmat cmat =
+  match mat_of_cmat cmat with
+    | Some cvdata -> cvdata
+    | None -> Unknown cmat
+
+let __release_mat = Glue.release_mat
+
+(* mat_of_cmat for a cmat allocated for the caller, such as a mat returned
+   by a binding, which is then released with the bigarray *)
+let adopt_cmat cmat =
+  let cvdata = mat_of_cmat cmat in
+  Option.iter (with_mat { f = fun mat -> Mat.adopt cmat mat } ()) cvdata;
+  cvdata
+
+let of_new_cmat cmat =
+  match adopt_cmat cmat with
+    | Some cvdata -> cvdata
+    | None ->
+        Gc.finalise_last (fun () -> __release_mat cmat) cmat;
+        Unknown cmat
 
 let extract_cvdata (data : unit ptr) : t =
   match __inputarray_kind data with
     | 1 ->
         begin
           let cmat = __mat_of_inputarray data in
-          (* only extract if mat is 8-bit unsigned *)
-          match __mat_depth cmat with
-            | 0 -> extract_mat_from_cmat cmat
-            | _ -> Unknown data
+          match adopt_cmat cmat with
+            | Some cvdata -> cvdata
+            | None -> __release_mat cmat; Unknown data
         end
     | _ -> Unknown data
 
+let __ragged_header = Glue.ragged_header
+let __ragged_copy = Glue.ragged_copy
+
+(* offsets of the fields of the header filled in by ragged_header, in C
+   ints; see glue.h *)
+let ragged_length = 0
+let ragged_depth = 1
+let ragged_cols = 2
+let ragged_channels = 3
+let ragged_rows = 4
+let ragged_header_size = 5
+
+(* a bigarray allocated by OCaml, of the kind matching depth *)
+let create_typed depth dims =
+  let create kind = Genarray.create kind c_layout dims in
+  match depth with
+    | 0 -> Mat (create Int8_unsigned)
+    | 1 -> Mat8s (create Int8_signed)
+    | 2 -> Mat16u (create Int16_unsigned)
+    | 3 -> Mat16s (create Int16_signed)
+    | 4 -> Mat32s (create Int32)
+    | 5 -> Mat32f (create Float32)
+    | 6 -> Mat64f (create Float64)
+    | _ -> failwith "unrecognized mat depth"
+
+module Ragged = struct
+  type cvdata = t
+
+  type t = {
+    data : cvdata;
+    offsets : (int32, int32_elt, c_layout) Array1.t;
+  }
+
+  let length r = Array1.dim r.offsets - 1
+
+  let data r = r.data
+
+  let offset r i =
+    if i < 0 || i > length r then invalid_arg "Ragged.offset";
+    Int32.to_int (Array1.unsafe_get r.offsets i)
+
+  let get r i =
+    if i < 0 || i >= length r then invalid_arg "Ragged.get";
+    let first = offset r i in
+    let rows = offset r (i + 1) - first in
+    (* a slice of data, which keeps it alive *)
+    with_mat { f = fun mat -> of_typed (Genarray.sub_left mat first rows) } r.data r.data
+
+  let to_list r =
+    List.init (length r) (get r)
+end
+
+let extract_ragged (data : unit ptr) : Ragged.t option =
+  let buf = Bytes.create (ragged_header_size * sizeof int) in
+  if __ragged_header data (ocaml_bytes_start buf) = 0 then None
+  else begin
+    let field i = Int32.to_int (Bytes.get_int32_ne buf (i * sizeof int)) in
+    let length = field ragged_length in
+    let data' = create_typed (field ragged_depth)
+        [| field ragged_rows; field ragged_cols; field ragged_channels |] in
+    let offsets = Array1.create Int32 c_layout (length + 1) in
+    let start = with_mat { f = fun mat -> to_voidp (bigarray_start genarray mat) } null data' in
+    __ragged_copy data start (to_voidp (bigarray_start array1 offsets));
+    Some { Ragged.data = data'; offsets }
+  end
+
 let extract_cvdata_array (data : unit ptr) : t list =
   match __inputarray_kind data with
     | 5 ->
         begin
-          let length = __inputarray_array_length data in
-          List.fold_left
-            begin fun acc index ->
-              let cmat = __mat_from_inputarray_array data index in
-              let cvdata =
-                (* only extract if mat is 8-bit unsigned *)
-                match __mat_depth cmat with
-                  | 0 ->
-                      let mat = Mat.bigarray_of_cmat cmat in
-                      Mat.copy_cmat_bigarray cmat mat;
-                      of_mat mat
-                  | _ -> Unknown cmat in
-              cvdata :: acc
-            end [] (List.init length (fun x -> length - x - 1))
+          match extract_ragged data with
+            | Some ragged -> Ragged.to_list ragged
+            | None ->
+                (* mats of different shapes or depths, one at a time *)
+                let length = __inputarray_array_length data in
+                List.init length (fun index ->
+                    of_new_cmat (__mat_from_inputarray_array data index))
         end
     | _ -> failwith "unrecognized data, not vector of mat"
 
-let __input_array_of_mat =
-  foreign "inputarray_of_mat" (ptr void @-> returning (ptr void))
-let __input_array_of_mat_vector =
-  foreign "inputarray_of_mat_vector" (ptr void @-> returning (ptr void))
+let __input_array_of_mat = Glue.inputarray_of_mat
+let __input_array_of_mat_vector = Glue.inputarray_of_mat_vector
+
+let __create_vector_mat = Glue.create_vector_mat
+let __add_vector_mat = Glue.add_vector_mat
+
+let pack_cmat (cvdata : t) : Mat.cmat =
+  match cvdata with
+    | Unknown data -> data
+    | _ -> with_mat { f = Mat.cmat_of_bigarray } null cvdata
 
-let __create_vector_mat =
-  foreign "create_vector_mat" (int @-> returning (ptr void))
-let __add_vector_mat =
-  foreign "add_vector_mat" (ptr void @-> ptr void @-> returning void)
+(* Copies the header of cmat back into the bigarray of cvdata. If OpenCV
+   changed the depth of the mat, the bigarray cannot hold it, so it is left
+   alone; see output. *)
+let pack_cmat_post (cvdata : t) (cmat : Mat.cmat) =
+  if depth cvdata = Mat.depth cmat then
+    with_mat { f = fun mat -> Mat.copy_cmat_bigarray cmat mat } () cvdata
 
 let pack_cvdata (cvdata : t) : unit ptr =
   match cvdata with
-    | Mat mat -> Mat.cmat_of_bigarray mat |> __input_array_of_mat
     | Unknown data -> data
+    | _ -> pack_cmat cvdata |> __input_array_of_mat
+
+let unshare (cvdata : t) =
+  with_mat { f = Mat.unshare } () cvdata
+
+let pack_cvdata_output (cvdata : t) : unit ptr =
+  unshare cvdata;
+  pack_cvdata cvdata
 
 let pack_cvdata_post (cvdata : t) (arr : unit ptr) =
   match cvdata with
-    | Mat mat ->
-        begin
-          let cmat = __mat_of_inputarray arr in
-          Mat.copy_cmat_bigarray cmat mat
-        end
-    | _ -> ()
+    | Unknown _ -> ()
+    | _ ->
+        (* a no-op if OpenCV changed the depth of the mat, or reallocated
+           one whose data OCaml allocated; see output *)
+        with_mat { f = fun mat -> ignore (Mat.copy_inputarray_bigarray arr mat) } () cvdata
 
-let pack_cvdata_array_elem = function
-  | Mat mat -> Mat.cmat_of_bigarray mat
-  | Unknown data -> data
+let output (cvdata : t) (arr : unit ptr) : t =
+  match cvdata with
+    | Unknown _ -> cvdata
+    | _ ->
+        (* a new value if OpenCV changed the depth, or reallocated a mat
+           whose data OCaml allocated, such as a mat of a Ragged *)
+        let data = with_mat { f = fun mat -> to_voidp (bigarray_start genarray mat) } null cvdata in
+        if __inputarray_holds arr data (depth cvdata) <> 0 then cvdata else extract_cvdata arr
 
 let pack_cvdata_array (cvdata_lst : t list) =
   let vec = __create_vector_mat (List.length cvdata_lst) in
   List.iter (fun cvdata ->
-    __add_vector_mat vec (pack_cvdata_array_elem cvdata)) cvdata_lst;
+    __add_vector_mat vec (pack_cmat cvdata)) cvdata_lst;
   __input_array_of_mat_vector vec
 
+let pack_cvdata_array_output (cvdata_lst : t list) =
+  List.iter unshare cvdata_lst;
+  pack_cvdata_array cvdata_lst
+
 let pack_cvdata_array_post (cvdata_lst : t list ref) (arr_arr : unit ptr) =
   cvdata_lst := extract_cvdata_array arr_arr
 
 let clone = function
-  | Mat mat -> Mat (Mat.clone mat)
+  | Mat mat -> Mat (Mat.share mat)
+  | Mat8s mat -> Mat8s (Mat.share mat)
+  | Mat16u mat -> Mat16u (Mat.share mat)
+  | Mat16s mat -> Mat16s (Mat.share mat)
+  | Mat32s mat -> Mat32s (Mat.share mat)
+  | Mat32f mat -> Mat32f (Mat.share mat)
+  | Mat64f mat -> Mat64f (Mat.share mat)
   | _ -> failwith "clone non-mat"
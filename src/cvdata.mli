@@ -1,16 +1,104 @@
+open Bigarray
 open Ctypes
 
+(** Data passed to and from OpenCV. Mats are wrapped in the constructor
+    for their depth; the 8-bit unsigned ones, which is what most image
+    functions work with, are just [Mat]. *)
 type t =
   | Mat of Mat.t
+  | Mat8s of (int, int8_signed_elt) Mat.typed
+  | Mat16u of (int, int16_unsigned_elt) Mat.typed
+  | Mat16s of (int, int16_signed_elt) Mat.typed
+  | Mat32s of (int32, int32_elt) Mat.typed
+  | Mat32f of (float, float32_elt) Mat.typed
+  | Mat64f of (float, float64_elt) Mat.typed
   | Unknown of unit ptr
 
 val of_mat : Mat.t -> t
 val to_mat : t -> Mat.t
 
+(** [of_typed mat] is [mat] wrapped in the constructor for its kind.
+    Raises [Invalid_argument] if the kind has no OpenCV depth. *)
+val of_typed : ('a, 'b) Mat.typed -> t
+
+(** [to_typed kind cvdata] is the mat in [cvdata] if its elements are of
+    [kind], e.g. [to_typed Float32] for a [Mat32f]. *)
+val to_typed : ('a, 'b) kind -> t -> ('a, 'b) Mat.typed
+
+(** [depth cvdata] is the OpenCV depth of the mat in [cvdata], numbered as
+    in {!Mat.depth}, or -1 if it is not a mat. *)
+val depth : t -> int
+
+(** A function over mats of any depth. *)
+type 'r mat_fn = { f : 'a 'b. ('a, 'b) Mat.typed -> 'r }
+
+(** [with_mat fn default cvdata] is [fn.f] applied to the mat in [cvdata],
+    or [default] if it is not a mat. *)
+val with_mat : 'r mat_fn -> 'r -> t -> 'r
+
+(** [clone cvdata] is a copy-on-write clone of the mat in [cvdata]; see
+    {!Mat.share}. Raises [Failure] if it is not a mat. *)
 val clone : t -> t
 
+(** [unshare cvdata] gives the mat in [cvdata] its own copy of its data;
+    see {!Mat.unshare}. *)
+val unshare : t -> unit
+
+(** Vectors of mats of the same depth, columns and channels, such as the
+    contours found by [find_contours], packed one after the other into a
+    single mat, whose rows are indexed by offsets. The mat is allocated by
+    OCaml, so that its views keep it alive; when one of them is passed to
+    OpenCV as an output that it resizes, the binding returns a new mat
+    rather than the view. *)
+module Ragged : sig
+  type cvdata = t
+  type t
+
+  (** [length r] is the number of mats in [r]. *)
+  val length : t -> int
+
+  (** [data r] is the mat holding the rows of every mat of [r]. *)
+  val data : t -> cvdata
+
+  (** [offset r i] is the row of [data r] at which the [i]th mat starts;
+      [offset r (length r)] is the number of rows of [data r]. *)
+  val offset : t -> int -> int
+
+  (** [get r i] is the [i]th mat of [r], a view of its rows of [data r]
+      that shares their data. *)
+  val get : t -> int -> cvdata
+
+  val to_list : t -> cvdata list
+end
+
+(** [extract_ragged arr] copies the vector of mats [arr] into a
+    {!Ragged.t}, with a constant number of calls into OpenCV whatever its
+    length, or is [None] if its mats are not all continuous, two-dimensional
+    and of the same depth, columns and channels. *)
+val extract_ragged: unit ptr -> Ragged.t option
+
 val pack_cvdata: t -> unit ptr
+
+(** [pack_cvdata_output cvdata] is [pack_cvdata cvdata] for an argument
+    that OpenCV writes to, which is unshared first. *)
+val pack_cvdata_output: t -> unit ptr
 val pack_cvdata_post: t -> unit ptr -> unit
 val extract_cvdata: unit ptr -> t
 val pack_cvdata_array: t list -> unit ptr
+val pack_cvdata_array_output: t list -> unit ptr
 val pack_cvdata_array_post: t list ref -> unit ptr -> unit
+
+(** [output cvdata arr] is [cvdata] after OpenCV wrote to [arr], its packed
+    form: [cvdata] itself, updated by [pack_cvdata_post], or a new value if
+    OpenCV changed the depth of the mat, or gave new data to a mat whose
+    data OCaml allocated, such as one of a {!Ragged.t}. *)
+val output: t -> unit ptr -> t
+
+val pack_cmat: t -> Mat.cmat
+val pack_cmat_post: t -> Mat.cmat -> unit
+val of_cmat: Mat.cmat -> t
+
+(** [of_new_cmat cmat] is [of_cmat cmat] for a mat allocated for the
+    caller, such as one returned by a binding, which is released once the
+    value is garbage collected; see {!Mat.adopt}. *)
+val of_new_cmat: Mat.cmat -> t
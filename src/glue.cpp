@@ -1,79 +1,263 @@
 
 #include "glue.h"
 #include <stdio.h>
+#include <algorithm>
+#include <condition_variable>
+#include <cstring>
+#include <deque>
+#include <mutex>
+#include <thread>
+#include <unordered_map>
+#include <caml/signals.h>
+
+// The mats that own the data of bigarrays, by the address of the data. A
+// bigarray whose data is owned by a mat is a view of that mat, and passing
+// it to OpenCV passes the mat itself, so that when OpenCV reallocates it,
+// the old data is released.
+static std::unordered_map<void *, cv::Mat *> owners;
+static std::mutex owners_lock;
+
+// The owner of data, or NULL.
+static cv::Mat *find_owner(void *data) {
+    std::lock_guard<std::mutex> guard(owners_lock);
+    auto it = owners.find(data);
+    return it == owners.end() ? NULL : it->second;
+}
+
+// The headers made by mat_of_bigarray on each thread for the calls in
+// progress on it, in the order they were made.
+static thread_local std::vector<cv::Mat *> call_headers;
 
 extern "C" {
     // Mat functions
 
-    cv::Mat *create_mat() {
-        // We need to initialize the mat with at least 2 dimensions.
-        // If we don't, there will be significant issues because
-        // OCaml Bigarrays increase the number of dimensions, as this
-        // would require allocating more memory.
-        // Perhaps a solution is initialize all Bigarrays with the
-        // maximum number of dimensions (16) and waste a little bit
-        // of space but never run into issues like this.
-        // Note that the current solution, i.e. initializing mats with
-        // two dimensions, works for all images.
-        return new cv::Mat(0, 0, CV_8UC3);
+    cv::Mat *create_mat_typed(int num_dims, int *dims, int depth) {
+        int ndims = num_dims - 1;
+        int channels = dims[ndims];
+        cv::Mat *mat = new cv::Mat(ndims, dims, CV_MAKETYPE(depth, channels));
+        if (mat->data != NULL) {
+            std::lock_guard<std::mutex> guard(owners_lock);
+            owners[mat->data] = mat;
+        }
+        return mat;
     }
 
-    void mat_copy(cv::Mat *src, cv::Mat *dst) {
-        src->copyTo(*dst);
+    void release_mat(cv::Mat *mat) {
+        {
+            std::lock_guard<std::mutex> guard(owners_lock);
+            auto it = owners.find(mat->data);
+            if (it != owners.end() && it->second == mat) {
+                owners.erase(it);
+            }
+        }
+        delete mat;
     }
 
-    int mat_num_dims(cv::Mat *mat) {
-        return mat->size.dims() + 1;
+    void adopt_mat(cv::Mat *mat) {
+        // data with no UMatData was not allocated by OpenCV, and may be that
+        // of a bigarray allocated by OCaml
+        if (mat->data == NULL || mat->u == NULL) {
+            return;
+        }
+        std::lock_guard<std::mutex> guard(owners_lock);
+        owners.emplace(mat->data, mat);
     }
 
-    int *mat_dims(cv::Mat *mat) {
-        int *dim = new int[mat->size.dims() + 1];
-        for (int i = 0; i < mat->size.dims(); i++) {
-            dim[i] = mat->size[i];
-        }
-        dim[mat->size.dims()] = mat->channels();
-        return dim;
+    int mat_owns_data(cv::Mat *mat) {
+        return mat->data != NULL && find_owner(mat->data) == mat;
     }
 
-    uchar *mat_data(cv::Mat *mat) {
+    int mat_owners(void) {
+        std::lock_guard<std::mutex> guard(owners_lock);
+        return (int) owners.size();
+    }
+
+    void mat_copy(cv::Mat *src, cv::Mat *dst) {
+        src->copyTo(*dst);
+    }
+
+    void *mat_header(cv::Mat *mat, int *header) {
+        int dims = mat->size.dims();
+        header[MAT_HEADER_NUM_DIMS] = dims + 1;
+        header[MAT_HEADER_DEPTH] = mat_depth(mat);
+        header[MAT_HEADER_CONTINUOUS] = mat->isContinuous();
+        for (int i = 0; i < dims; i++) {
+            header[MAT_HEADER_DIMS + i] = mat->size[i];
+            header[MAT_HEADER_STEP + i] = (int) mat->step[i];
+        }
+        header[MAT_HEADER_DIMS + dims] = mat->channels();
         return mat->data;
     }
 
-    cv::Mat *mat_of_bigarray(int num_dims, int *dims, char *data) {
+    cv::Mat *mat_of_bigarray(int num_dims, int *dims, int depth, void *data) {
         int ndims = num_dims - 1;
         int channels = dims[ndims];
-        int type = CV_MAKETYPE(CV_8U, channels);
-        return new cv::Mat(ndims, dims, type, data);
+        int type = CV_MAKETYPE(depth, channels);
+        cv::Mat *owner = data == NULL ? NULL : find_owner(data);
+        if (owner != NULL && owner->type() == type && owner->size.dims() == ndims
+            && std::equal(dims, dims + ndims, owner->size.p)) {
+            return owner;
+        }
+        cv::Mat *mat = new cv::Mat(ndims, dims, type, data);
+        call_headers.push_back(mat);
+        return mat;
+    }
+
+    int headers_mark(void) {
+        return (int) call_headers.size();
+    }
+
+    void release_headers(int mark) {
+        if ((int) call_headers.size() <= mark) {
+            return;
+        }
+        std::lock_guard<std::mutex> guard(owners_lock);
+        for (auto it = call_headers.begin() + mark; it != call_headers.end(); ++it) {
+            cv::Mat *mat = *it;
+            auto owner = owners.find(mat->data);
+            if (owner == owners.end() || owner->second != mat) {
+                delete mat;
+            }
+        }
+        call_headers.resize(mark);
+    }
+
+    // The OpenCV depth of the elements of a bigarray, or -1 if there is no
+    // OpenCV depth for its kind.
+    static int bigarray_depth(bigarray *ba) {
+        switch (ba->flags & CAML_BA_KIND_MASK) {
+        case CAML_BA_UINT8:
+        case CAML_BA_CHAR:
+            return CV_8U;
+        case CAML_BA_SINT8:
+            return CV_8S;
+        case CAML_BA_UINT16:
+            return CV_16U;
+        case CAML_BA_SINT16:
+            return CV_16S;
+        case CAML_BA_INT32:
+            return CV_32S;
+        case CAML_BA_FLOAT32:
+            return CV_32F;
+        case CAML_BA_FLOAT64:
+            return CV_64F;
+        default:
+            return -1;
+        }
+    }
+
+    int bigarray_external(value *v) {
+        return (Caml_ba_array_val(*v)->flags & CAML_BA_MANAGED_MASK) == CAML_BA_EXTERNAL;
+    }
+
+    int copy_inputarray_bigarray(cv::InputArray arr, value *v) {
+        bigarray *ba = Caml_ba_array_val(*v);
+        if (arr.kind() != cv::_InputArray::MAT) {
+            return -1;
+        }
+        if (arr.depth() != bigarray_depth(ba)) {
+            // OpenCV gave the mat new data, of another depth, which the
+            // bigarray cannot point at; the mat no longer owns the old data
+            cv::Mat *mat = (cv::Mat *) arr.getObj();
+            std::lock_guard<std::mutex> guard(owners_lock);
+            auto it = owners.find(ba->data);
+            if (it != owners.end() && it->second == mat && mat->data != ba->data) {
+                owners.erase(it);
+            }
+            return -1;
+        }
+        if ((ba->flags & CAML_BA_MANAGED_MASK) != CAML_BA_EXTERNAL
+            && ((cv::Mat *) arr.getObj())->data != ba->data) {
+            // OpenCV reallocated data that OCaml allocated, such as that of
+            // a Cvdata.Ragged, which the bigarray cannot be pointed away
+            // from; see inputarray_holds
+            return -1;
+        }
+        // the heap-allocated mat made by mat_of_bigarray, which can own the
+        // data if OpenCV reallocated it
+        return copy_mat_bigarray((cv::Mat *) arr.getObj(), v);
     }
 
-    void copy_mat_bigarray(cv::Mat *mat, value *v) {
+    int copy_mat_bigarray(cv::Mat *mat, value *v) {
         bigarray *ba = Caml_ba_array_val(*v);
+        if (mat->depth() != bigarray_depth(ba)) {
+            // the bigarray's elements would be read as the wrong type
+            caml_failwith("opencv: mat changed depth");
+        }
         if (mat->size.dims() + 1 > ba->num_dims) {
             // TODO this is a problem
             // Need to throw an exception or something
             caml_failwith("opencv: mat increased dimensionality");
         }
+        int owned = 0;
+        if (ba->data != mat->data) {
+            if ((ba->flags & CAML_BA_MANAGED_MASK) != CAML_BA_EXTERNAL) {
+                // OCaml would free the data that OpenCV allocated
+                caml_failwith("opencv: cannot reallocate a bigarray allocated by OCaml");
+            }
+            // mat becomes the owner of the new data
+            std::lock_guard<std::mutex> guard(owners_lock);
+            auto it = owners.find(ba->data);
+            bool was_owner = it != owners.end() && it->second == mat;
+            if (was_owner) {
+                owners.erase(it);
+            }
+            if (mat->data != NULL) {
+                owners[mat->data] = mat;
+                owned = was_owner ? 1 : 2;
+            }
+        }
         ba->data = mat->data;
         ba->num_dims = mat->size.dims() + 1;
         for (int i = 0; i < mat->size.dims(); i++) {
             ba->dim[i] = mat->size[i];
         }
         ba->dim[mat->size.dims()] = mat->channels();
+        return owned;
     }
 
 
     // Vector functions
 
-    void *vector_data(std::vector<char> v) {
-        return v.data();
+    void *vector_data(std::vector<char> *v) {
+        return v->data();
     }
 
-    int vector_length(std::vector<char> v) {
-        return v.size();
+    int vector_length(std::vector<char> *v) {
+        return v->size();
     }
 
-    std::vector<char> *create_vector(char &arr, int length, int item_size) {
-        return new std::vector<char>(length * item_size, arr);
+    std::vector<char> *create_vector(char *arr, int length, int item_size) {
+        return new std::vector<char>(arr, arr + (size_t) length * item_size);
+    }
+
+    void delete_vector(std::vector<char> *v) {
+        delete v;
+    }
+
+    std::vector<char> *copy_vector_bigarray(std::vector<char> *vec, value *v) {
+        bigarray *ba = Caml_ba_array_val(*v);
+        // the size of an element, which is a number or a struct of them
+        intnat item_size = caml_ba_element_size[ba->flags & CAML_BA_KIND_MASK];
+        for (int i = 1; i < ba->num_dims; i++) {
+            item_size *= ba->dim[i];
+        }
+        if (item_size == 0) {
+            return NULL;
+        }
+        intnat length = vec->size() / item_size;
+        if (length == ba->dim[0]) {
+            std::copy(vec->begin(), vec->end(), (char *) ba->data);
+            return NULL;
+        }
+        if ((ba->flags & CAML_BA_MANAGED_MASK) != CAML_BA_EXTERNAL) {
+            caml_failwith("opencv: cannot resize a vector allocated by OCaml");
+        }
+        // the elements move without being copied, leaving vec empty
+        std::vector<char> *kept = new std::vector<char>(std::move(*vec));
+        ba->data = kept->data();
+        ba->dim[0] = length;
+        return kept;
     }
 
 
@@ -87,6 +271,13 @@ extern "C" {
         return mat;
     }
 
+    cv::Mat *inputarray_mat(cv::InputArray arr) {
+        if (!arr.isMat()) {
+            caml_failwith("opencv: InputArray is not Mat");
+        }
+        return (cv::Mat *) arr.getObj();
+    }
+
     std::vector<cv::Mat> *mat_vector_of_inputarray(cv::InputArray arr) {
         if (!arr.isMatVector()) {
             caml_failwith("opencv: InputArray is not vector<Mat>");
@@ -111,6 +302,50 @@ extern "C" {
         return mat;
     }
 
+    int ragged_header(cv::InputArrayOfArrays arr, int *header) {
+        if (!arr.isMatVector()) {
+            caml_failwith("opencv: InputArray is not vector of Mat");
+        }
+        int length = (int) arr.total();
+        int type = -1, depth = 0, cols = 0, rows = 0;
+        for (int i = 0; i < length; i++) {
+            cv::Mat mat = arr.getMat(i);
+            if (mat.dims != 2 || !mat.isContinuous()) {
+                return 0;
+            }
+            if (i == 0) {
+                type = mat.type();
+                depth = mat_depth(&mat);
+                cols = mat.cols;
+            } else if (mat.type() != type || mat.cols != cols) {
+                return 0;
+            }
+            rows += mat.rows;
+        }
+        header[RAGGED_HEADER_LENGTH] = length;
+        header[RAGGED_HEADER_DEPTH] = depth;
+        header[RAGGED_HEADER_COLS] = cols;
+        header[RAGGED_HEADER_CHANNELS] = length == 0 ? 1 : CV_MAT_CN(type);
+        header[RAGGED_HEADER_ROWS] = rows;
+        return 1;
+    }
+
+    void ragged_copy(cv::InputArrayOfArrays arr, char *data, int *offsets) {
+        int length = (int) arr.total();
+        int rows = 0;
+        for (int i = 0; i < length; i++) {
+            cv::Mat mat = arr.getMat(i);
+            size_t size = mat.total() * mat.elemSize();
+            if (size > 0) {
+                std::memcpy(data, mat.data, size);
+            }
+            data += size;
+            offsets[i] = rows;
+            rows += mat.rows;
+        }
+        offsets[length] = rows;
+    }
+
     int inputarray_kind(cv::InputArray cvdata) {
         switch (cvdata.kind()) {
         case cv::_InputArray::NONE:
@@ -171,6 +406,32 @@ extern "C" {
         }
     }
 
+    int inputarray_holds(cv::InputArray arr, void *data, int depth) {
+        return arr.kind() == cv::_InputArray::MAT && inputarray_depth(arr) == depth
+            && ((cv::Mat *) arr.getObj())->data == data;
+    }
+
+    int inputarray_depth(cv::InputArray arr) {
+        switch (arr.depth()) {
+        case CV_8U:
+            return 0;
+        case CV_8S:
+            return 1;
+        case CV_16U:
+            return 2;
+        case CV_16S:
+            return 3;
+        case CV_32S:
+            return 4;
+        case CV_32F:
+            return 5;
+        case CV_64F:
+            return 6;
+        default:
+            return -1;
+        }
+    }
+
     std::vector<cv::Mat> *create_vector_mat(long int length) {
         std::vector<cv::Mat> *vec = new std::vector<cv::Mat>();
         vec->reserve(length);
@@ -192,6 +453,18 @@ extern "C" {
     }
 
 
+    // Struct argument functions
+
+    void *struct_arg(void) {
+        // doubles, so that the buffers are aligned for any struct
+        static thread_local double args[STRUCT_ARGS][STRUCT_ARG_SIZE / sizeof(double)];
+        static thread_local int next = 0;
+        void *arg = args[next];
+        next = (next + 1) % STRUCT_ARGS;
+        return arg;
+    }
+
+
     // Scalar functions
 
     cv::Scalar *build_scalar(double w, double x, double y, double z) {
@@ -210,4 +483,278 @@ extern "C" {
     double scalar_z(cv::Scalar &scalar) {
         return scalar[3];
     }
+
+
+    // Thread functions
+
+    int get_num_threads() {
+        return cv::getNumThreads();
+    }
+
+    void set_num_threads(int n) {
+        cv::setNumThreads(n);
+    }
+
+
+    // Prefetching reader functions
+
+    struct prefetch_reader {
+        cv::VideoCapture capture;
+        std::vector<cv::Mat> ring;
+        // slots in the order they were read into, and slots to read into
+        std::deque<int> ready;
+        std::deque<int> free;
+        bool finished = false;
+        bool stopping = false;
+        int read = 0;
+        int waits = 0;
+        int stalls = 0;
+        std::mutex lock;
+        std::condition_variable changed;
+        std::thread thread;
+    };
+
+    static void prefetch_run(prefetch_reader *reader) {
+        std::unique_lock<std::mutex> guard(reader->lock);
+        while (true) {
+            if (reader->free.empty() && !reader->stopping) {
+                reader->stalls++;
+                reader->changed.wait(guard, [reader] {
+                    return !reader->free.empty() || reader->stopping;
+                });
+            }
+            if (reader->stopping) {
+                break;
+            }
+            int slot = reader->free.front();
+            reader->free.pop_front();
+            // the mat of the slot is only touched here until it is ready,
+            // and its data is reused once it has the size of the frames
+            guard.unlock();
+            bool ok = reader->capture.read(reader->ring[slot]);
+            guard.lock();
+            if (!ok) {
+                reader->free.push_back(slot);
+                reader->finished = true;
+                reader->changed.notify_all();
+                break;
+            }
+            reader->ready.push_back(slot);
+            reader->read++;
+            reader->changed.notify_all();
+        }
+    }
+
+    prefetch_reader *prefetch_open(const char *filename, int api_preference, int slots) {
+        prefetch_reader *reader = new prefetch_reader();
+        if (!reader->capture.open(filename, api_preference)) {
+            delete reader;
+            return NULL;
+        }
+        reader->ring.resize(slots);
+        for (int i = 0; i < slots; i++) {
+            reader->free.push_back(i);
+        }
+        reader->thread = std::thread(prefetch_run, reader);
+        return reader;
+    }
+
+    int prefetch_next(prefetch_reader *reader) {
+        int slot = -1;
+        caml_enter_blocking_section();
+        {
+            std::unique_lock<std::mutex> guard(reader->lock);
+            if (reader->ready.empty() && !reader->finished) {
+                reader->waits++;
+                reader->changed.wait(guard, [reader] {
+                    return !reader->ready.empty() || reader->finished;
+                });
+            }
+            if (!reader->ready.empty()) {
+                slot = reader->ready.front();
+                reader->ready.pop_front();
+            }
+        }
+        caml_leave_blocking_section();
+        return slot;
+    }
+
+    cv::Mat *prefetch_frame(prefetch_reader *reader, int slot) {
+        return &reader->ring[slot];
+    }
+
+    void prefetch_release(prefetch_reader *reader, int slot) {
+        std::lock_guard<std::mutex> guard(reader->lock);
+        reader->free.push_back(slot);
+        reader->changed.notify_all();
+    }
+
+    void prefetch_stats(prefetch_reader *reader, int *stats) {
+        std::lock_guard<std::mutex> guard(reader->lock);
+        stats[PREFETCH_STATS_READ] = reader->read;
+        stats[PREFETCH_STATS_WAITS] = reader->waits;
+        stats[PREFETCH_STATS_STALLS] = reader->stalls;
+        stats[PREFETCH_STATS_READY] = (int) reader->ready.size();
+    }
+
+    void prefetch_close(prefetch_reader *reader) {
+        caml_enter_blocking_section();
+        {
+            std::lock_guard<std::mutex> guard(reader->lock);
+            reader->stopping = true;
+            reader->changed.notify_all();
+        }
+        // waits for the frame being read, if any
+        reader->thread.join();
+        caml_leave_blocking_section();
+        delete reader;
+    }
+
+
+    // Asynchronous writer functions
+
+    struct async_writer {
+        cv::VideoWriter writer;
+        int capacity;
+        int policy;
+        // copies of the frames to encode, in order, and mats that have been
+        // encoded, to copy frames into again
+        std::deque<cv::Mat> queue;
+        std::vector<cv::Mat> spare;
+        bool encoding = false;
+        bool stopping = false;
+        int queued = 0;
+        int written = 0;
+        int dropped = 0;
+        int max_depth = 0;
+        std::mutex lock;
+        std::condition_variable changed;
+        std::thread thread;
+    };
+
+    static void async_writer_run(async_writer *writer) {
+        std::unique_lock<std::mutex> guard(writer->lock);
+        while (true) {
+            writer->changed.wait(guard, [writer] {
+                return !writer->queue.empty() || writer->stopping;
+            });
+            if (writer->queue.empty()) {
+                break;
+            }
+            cv::Mat frame = std::move(writer->queue.front());
+            writer->queue.pop_front();
+            writer->encoding = true;
+            writer->changed.notify_all();
+            guard.unlock();
+            writer->writer.write(frame);
+            guard.lock();
+            writer->encoding = false;
+            writer->written++;
+            writer->spare.push_back(std::move(frame));
+            writer->changed.notify_all();
+        }
+    }
+
+    async_writer *async_writer_open(const char *filename, int fourcc, double fps,
+                                    int width, int height, int is_color,
+                                    int capacity, int policy) {
+        async_writer *writer = new async_writer();
+        if (!writer->writer.open(filename, fourcc, fps, cv::Size(width, height), is_color != 0)) {
+            delete writer;
+            return NULL;
+        }
+        writer->capacity = capacity;
+        writer->policy = policy;
+        writer->thread = std::thread(async_writer_run, writer);
+        return writer;
+    }
+
+    int async_writer_write(async_writer *writer, value *v) {
+        // read before the runtime lock is released, after which the GC can
+        // move the bigarray, though not its data
+        bigarray *ba = Caml_ba_array_val(*v);
+        int num_dims = ba->num_dims - 1;
+        int depth = bigarray_depth(ba);
+        if (num_dims < 1 || depth < 0) {
+            caml_failwith("opencv: bigarray is not a mat");
+        }
+        int dims[MAT_MAX_DIMS];
+        for (int i = 0; i < num_dims; i++) {
+            dims[i] = (int) ba->dim[i];
+        }
+        cv::Mat frame(num_dims, dims, CV_MAKETYPE(depth, (int) ba->dim[num_dims]), ba->data);
+
+        int queued = 1;
+        caml_enter_blocking_section();
+        {
+            std::unique_lock<std::mutex> guard(writer->lock);
+            if ((int) writer->queue.size() >= writer->capacity) {
+                switch (writer->policy) {
+                case ASYNC_WRITER_DROP_NEWEST:
+                    queued = 0;
+                    writer->dropped++;
+                    break;
+                case ASYNC_WRITER_DROP_OLDEST:
+                    writer->spare.push_back(std::move(writer->queue.front()));
+                    writer->queue.pop_front();
+                    writer->dropped++;
+                    break;
+                default:
+                    writer->changed.wait(guard, [writer] {
+                        return (int) writer->queue.size() < writer->capacity;
+                    });
+                }
+            }
+            if (queued) {
+                // a copy, since the OCaml mat can be reused, e.g. by the pool,
+                // before the frame is encoded
+                cv::Mat copy;
+                if (!writer->spare.empty()) {
+                    copy = std::move(writer->spare.back());
+                    writer->spare.pop_back();
+                }
+                frame.copyTo(copy);
+                writer->queue.push_back(std::move(copy));
+                writer->queued++;
+                writer->max_depth = std::max(writer->max_depth, (int) writer->queue.size());
+                writer->changed.notify_all();
+            }
+        }
+        caml_leave_blocking_section();
+        return queued;
+    }
+
+    void async_writer_flush(async_writer *writer) {
+        caml_enter_blocking_section();
+        {
+            std::unique_lock<std::mutex> guard(writer->lock);
+            writer->changed.wait(guard, [writer] {
+                return writer->queue.empty() && !writer->encoding;
+            });
+        }
+        caml_leave_blocking_section();
+    }
+
+    void async_writer_stats(async_writer *writer, int *stats) {
+        std::lock_guard<std::mutex> guard(writer->lock);
+        stats[ASYNC_WRITER_STATS_QUEUED] = writer->queued;
+        stats[ASYNC_WRITER_STATS_WRITTEN] = writer->written;
+        stats[ASYNC_WRITER_STATS_DROPPED] = writer->dropped;
+        stats[ASYNC_WRITER_STATS_DEPTH] = (int) writer->queue.size() + writer->encoding;
+        stats[ASYNC_WRITER_STATS_MAX_DEPTH] = writer->max_depth;
+    }
+
+    void async_writer_close(async_writer *writer) {
+        caml_enter_blocking_section();
+        {
+            std::lock_guard<std::mutex> guard(writer->lock);
+            writer->stopping = true;
+            writer->changed.notify_all();
+        }
+        // the thread encodes what is left in the queue first
+        writer->thread.join();
+        writer->writer.release();
+        caml_leave_blocking_section();
+        delete writer;
+    }
 }
@@ -1,6 +1,7 @@
 
 #include <stdlib.h>
-#include <opencv2/opencv.hpp>
+#include <opencv2/core.hpp>
+#include <opencv2/videoio.hpp>
 #include <caml/mlvalues.h>
 #include <caml/bigarray.h>
 #include <caml/fail.h>
@@ -8,35 +9,112 @@
 extern "C" {
     // Mat functions
 
-    cv::Mat *create_mat();
+    // Mats created by create_mat_typed, and those that OpenCV allocates
+    // data in when they are made by mat_of_bigarray from a bigarray, own
+    // that data until release_mat deletes them.
+    cv::Mat *create_mat_typed(int num_dims, int *dims, int depth);
+    void release_mat(cv::Mat *mat);
+    // Makes mat, a mat allocated for the caller, the owner of its data if
+    // OpenCV allocated it and no other mat owns it; either way, release_mat
+    // deletes it.
+    void adopt_mat(cv::Mat *mat);
+    int mat_owns_data(cv::Mat *mat);
+    // the number of mats that own data
+    int mat_owners(void);
     void mat_copy(cv::Mat *src, cv::Mat *dst);
 
     typedef struct caml_ba_array bigarray;
 
-    int mat_num_dims(cv::Mat *mat);
-    int *mat_dims(cv::Mat *mat);
-    uchar *mat_data(cv::Mat *mat);
-
-    cv::Mat *mat_of_bigarray(int num_dims, int *dims, char *data);
-    void copy_mat_bigarray(cv::Mat *mat, value *v);
+    // Offsets, in ints, of the fields of the header that mat_header fills
+    // in: the number of dimensions of the bigarray, i.e. of the mat plus
+    // one for the channels, the depth as returned by mat_depth, whether
+    // the mat is continuous, the dimensions and the step of each dimension
+    // of the mat in bytes. MAT_MAX_DIMS is CV_MAX_DIM, which is only
+    // defined in the C API headers.
+    #define MAT_MAX_DIMS 32
+    #define MAT_HEADER_NUM_DIMS 0
+    #define MAT_HEADER_DEPTH 1
+    #define MAT_HEADER_CONTINUOUS 2
+    #define MAT_HEADER_DIMS 3
+    #define MAT_HEADER_STEP (MAT_HEADER_DIMS + MAT_MAX_DIMS + 1)
+    #define MAT_HEADER_SIZE (MAT_HEADER_STEP + MAT_MAX_DIMS)
+
+    void *mat_header(cv::Mat *mat, int *header);
+
+    // A mat sharing the data of a bigarray: the mat that owns the data, if
+    // it has the same shape, or else a header that only lives for the call
+    // it is made for, which release_headers deletes.
+    cv::Mat *mat_of_bigarray(int num_dims, int *dims, int depth, void *data);
+    // The number of headers made by mat_of_bigarray on the calling thread
+    // that have not been released.
+    int headers_mark(void);
+    // Deletes the headers made by mat_of_bigarray on the calling thread
+    // since headers_mark returned mark, except those that have come to own
+    // data that OpenCV allocated for them, which release_mat deletes.
+    void release_headers(int mark);
+    // whether the data of v was not allocated by OCaml, so that it can be
+    // pointed at other data
+    int bigarray_external(value *v);
+    // These point the bigarray v at the data of a mat, and return 2 if the
+    // mat has just become the owner of the data, 1 if it already was, and
+    // 0 if nothing owns it; copy_inputarray_bigarray returns -1 without
+    // pointing v anywhere if arr is not a mat of the depth of v, whose data
+    // the mat then no longer owns, or if v was allocated by OCaml and
+    // OpenCV gave the mat new data.
+    int copy_inputarray_bigarray(cv::InputArray arr, value *v);
+    int copy_mat_bigarray(cv::Mat *mat, value *v);
 
 
     // Vector functions
 
-    void *vector_data(std::vector<char> v);
-    int vector_length(std::vector<char> v);
-    std::vector<char> *create_vector(char &arr, int length, int item_size);
+    // Vectors of any type are made and read as vectors of bytes, which have
+    // the same layout. The length of a vector is in bytes.
+    void *vector_data(std::vector<char> *v);
+    int vector_length(std::vector<char> *v);
+    std::vector<char> *create_vector(char *arr, int length, int item_size);
+    void delete_vector(std::vector<char> *v);
+    // Copies the contents of vec into the bigarray v if it has the same
+    // number of elements and returns NULL. Otherwise moves them into a new
+    // vector, which it returns, and points v at its data, so the new vector
+    // must outlive v. Either way vec is still for the caller to delete.
+    std::vector<char> *copy_vector_bigarray(std::vector<char> *vec, value *v);
 
 
     // InputArray functions
 
     cv::Mat *mat_of_inputarray(cv::InputArray arr);
+    // the mat that arr refers to itself, not a copy of its header
+    cv::Mat *inputarray_mat(cv::InputArray arr);
     std::vector<cv::Mat> *mat_vector_of_inputarray(cv::InputArray arr);
     int inputarray_array_length(cv::InputArrayOfArrays arr);
     cv::Mat *mat_from_inputarray_array(cv::InputArrayOfArrays arr, int index);
 
+    // Offsets, in ints, of the fields of the header that ragged_header
+    // fills in for a vector of mats that can be packed into one buffer: the
+    // number of mats, their depth as returned by mat_depth, their columns
+    // and channels, which they all share, and the sum of their rows.
+    #define RAGGED_HEADER_LENGTH 0
+    #define RAGGED_HEADER_DEPTH 1
+    #define RAGGED_HEADER_COLS 2
+    #define RAGGED_HEADER_CHANNELS 3
+    #define RAGGED_HEADER_ROWS 4
+    #define RAGGED_HEADER_SIZE 5
+
+    // Whether the mats of arr are all continuous and two-dimensional, with
+    // the same depth, columns and channels; if so, header is filled in.
+    int ragged_header(cv::InputArrayOfArrays arr, int *header);
+    // Copies the data of the mats of arr one after the other into data,
+    // which must hold the rows counted by ragged_header, and the row at
+    // which each starts into offsets, followed by the total.
+    void ragged_copy(cv::InputArrayOfArrays arr, char *data, int *offsets);
+
     int inputarray_kind(cv::InputArray cvdata);
     int mat_depth(cv::Mat *mat);
+    int inputarray_depth(cv::InputArray arr);
+    // Whether arr is a mat of depth, numbered as by mat_depth, whose data is
+    // data, i.e. whether a bigarray with that data and depth still holds
+    // what OpenCV wrote to arr.
+    int inputarray_holds(cv::InputArray arr, void *data, int depth);
 
     std::vector<cv::Mat> *create_vector_mat(long int length);
     void add_vector_mat(std::vector<cv::Mat> *vec, cv::Mat &mat);
@@ -45,6 +123,20 @@ extern "C" {
     cv::InputArray inputarray_of_mat_vector(const std::vector<cv::Mat> &mats);
 
 
+    // Struct argument functions
+
+    // The generated bindings write a struct argument into a buffer of
+    // STRUCT_ARG_SIZE bytes that struct_arg hands out, rather than into
+    // memory allocated for the call. Each thread has a ring of STRUCT_ARGS
+    // of them, so a buffer is only handed out again once STRUCT_ARGS - 1
+    // other structs have been converted on the same thread, far more than
+    // any one function takes.
+    #define STRUCT_ARGS 64
+    #define STRUCT_ARG_SIZE 32
+
+    void *struct_arg(void);
+
+
     // Scalar functions
 
     cv::Scalar *build_scalar(double w, double x, double y, double z);
@@ -52,4 +144,80 @@ extern "C" {
     double scalar_x(cv::Scalar &scalar);
     double scalar_y(cv::Scalar &scalar);
     double scalar_z(cv::Scalar &scalar);
+
+
+    // Thread functions
+
+    // the number of threads that OpenCV parallelises its functions over
+    int get_num_threads();
+    void set_num_threads(int n);
+
+
+    // Prefetching reader functions
+
+    // A VideoCapture that a thread of its own reads ahead from into a ring
+    // of mats, which are handed out in order and given back to be read into
+    // again. The waits release the OCaml runtime lock.
+    struct prefetch_reader;
+
+    // Offsets, in ints, of the fields of the statistics that
+    // prefetch_stats fills in: the frames read so far, the times that
+    // prefetch_next had to wait for a frame, the times that the thread had
+    // to wait for a mat to be given back, and the frames read but not yet
+    // handed out.
+    #define PREFETCH_STATS_READ 0
+    #define PREFETCH_STATS_WAITS 1
+    #define PREFETCH_STATS_STALLS 2
+    #define PREFETCH_STATS_READY 3
+    #define PREFETCH_STATS_SIZE 4
+
+    // NULL if the file could not be opened
+    prefetch_reader *prefetch_open(const char *filename, int api_preference, int slots);
+    // The slot of the next frame, once it has been read, or -1 once there
+    // are no more.
+    int prefetch_next(prefetch_reader *reader);
+    cv::Mat *prefetch_frame(prefetch_reader *reader, int slot);
+    void prefetch_release(prefetch_reader *reader, int slot);
+    void prefetch_stats(prefetch_reader *reader, int *stats);
+    // Stops the thread and frees the reader and its mats.
+    void prefetch_close(prefetch_reader *reader);
+
+
+    // Asynchronous writer functions
+
+    // A VideoWriter that a thread of its own encodes frames for, from a
+    // bounded queue of copies of them. The waits release the OCaml runtime
+    // lock.
+    struct async_writer;
+
+    // What async_writer_write does when the queue is full: wait for room,
+    // drop the frame, or drop the oldest frame in the queue.
+    #define ASYNC_WRITER_BLOCK 0
+    #define ASYNC_WRITER_DROP_NEWEST 1
+    #define ASYNC_WRITER_DROP_OLDEST 2
+
+    // Offsets, in ints, of the fields of the statistics that
+    // async_writer_stats fills in: the frames queued, encoded and dropped
+    // so far, the frames in the queue or being encoded, and the most that
+    // have been in the queue at once.
+    #define ASYNC_WRITER_STATS_QUEUED 0
+    #define ASYNC_WRITER_STATS_WRITTEN 1
+    #define ASYNC_WRITER_STATS_DROPPED 2
+    #define ASYNC_WRITER_STATS_DEPTH 3
+    #define ASYNC_WRITER_STATS_MAX_DEPTH 4
+    #define ASYNC_WRITER_STATS_SIZE 5
+
+    // NULL if the file could not be opened
+    async_writer *async_writer_open(const char *filename, int fourcc, double fps,
+                                    int width, int height, int is_color,
+                                    int capacity, int policy);
+    // Queues a copy of the bigarray v to be encoded, and returns whether it
+    // was queued rather than dropped.
+    int async_writer_write(async_writer *writer, value *v);
+    // Waits until every frame queued has been encoded.
+    void async_writer_flush(async_writer *writer);
+    void async_writer_stats(async_writer *writer, int *stats);
+    // Encodes the frames still queued, stops the thread, and closes and
+    // frees the writer.
+    void async_writer_close(async_writer *writer);
 }
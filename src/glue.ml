@@ -0,0 +1 @@
+include Glue_bindings.Make (Glue_generated)
@@ -0,0 +1,95 @@
+/*
+ * The functions declared in glue.h, with C types in place of the C++ ones,
+ * for the C stubs that ctypes generates from Glue_bindings. C++ references
+ * and the InputArray types are passed as pointers, so they are all void *.
+ */
+
+// Mat functions
+
+void *create_mat_typed(int num_dims, void *dims, int depth);
+void release_mat(void *mat);
+void adopt_mat(void *mat);
+int mat_owns_data(void *mat);
+int mat_owners(void);
+void mat_copy(void *src, void *dst);
+
+void *mat_header(void *mat, void *header);
+
+void *mat_of_bigarray(int num_dims, void *dims, int depth, void *data);
+int headers_mark(void);
+void release_headers(int mark);
+int bigarray_external(void *v);
+int copy_inputarray_bigarray(void *arr, void *v);
+int copy_mat_bigarray(void *mat, void *v);
+
+
+// Vector functions
+
+void *vector_data(void *v);
+int vector_length(void *v);
+void *create_vector(void *arr, int length, int item_size);
+void delete_vector(void *v);
+void *copy_vector_bigarray(void *vec, void *v);
+
+
+// InputArray functions
+
+void *mat_of_inputarray(void *arr);
+void *inputarray_mat(void *arr);
+void *mat_vector_of_inputarray(void *arr);
+int inputarray_array_length(void *arr);
+void *mat_from_inputarray_array(void *arr, int index);
+int ragged_header(void *arr, void *header);
+void ragged_copy(void *arr, void *data, void *offsets);
+
+int inputarray_kind(void *cvdata);
+int mat_depth(void *mat);
+int inputarray_depth(void *arr);
+int inputarray_holds(void *arr, void *data, int depth);
+
+void *create_vector_mat(long int length);
+void add_vector_mat(void *vec, void *mat);
+
+void *inputarray_of_mat(void *mat);
+void *inputarray_of_mat_vector(void *mats);
+
+
+// Struct argument functions
+
+void *struct_arg(void);
+
+
+// Scalar functions
+
+void *build_scalar(double w, double x, double y, double z);
+double scalar_w(void *scalar);
+double scalar_x(void *scalar);
+double scalar_y(void *scalar);
+double scalar_z(void *scalar);
+
+
+// Thread functions
+
+int get_num_threads(void);
+void set_num_threads(int n);
+
+
+// Prefetching reader functions
+
+void *prefetch_open(char *filename, int api_preference, int slots);
+int prefetch_next(void *reader);
+void *prefetch_frame(void *reader, int slot);
+void prefetch_release(void *reader, int slot);
+void prefetch_stats(void *reader, void *stats);
+void prefetch_close(void *reader);
+
+
+// Asynchronous writer functions
+
+void *async_writer_open(char *filename, int fourcc, double fps,
+                        int width, int height, int is_color,
+                        int capacity, int policy);
+int async_writer_write(void *writer, void *v);
+void async_writer_flush(void *writer);
+void async_writer_stats(void *writer, void *stats);
+void async_writer_close(void *writer);
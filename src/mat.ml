@@ -2,94 +2,416 @@ open Bigarray
 open Ctypes
 open Ctypes_static
 
-let foreign = Loader.foreign
+type ('a, 'b) typed = ('a, 'b, c_layout) Genarray.t
 
-type t = (int, int8_unsigned_elt, c_layout) Genarray.t
+type t = (int, int8_unsigned_elt) typed
 
 type cmat = unit ptr
 let voidp = ptr void
 
-let __mat_of_bigarray =
-  foreign "mat_of_bigarray" (int @-> ptr int @-> ptr int @-> returning voidp)
+(* the OpenCV depths, as returned by mat_depth in glue.cpp *)
+let depth_of_kind : type a b. (a, b) kind -> int = function
+  | Int8_unsigned -> 0
+  | Char -> 0
+  | Int8_signed -> 1
+  | Int16_unsigned -> 2
+  | Int16_signed -> 3
+  | Int32 -> 4
+  | Float32 -> 5
+  | Float64 -> 6
+  | _ -> invalid_arg "Mat: bigarray kind has no OpenCV depth"
 
-let cmat_of_bigarray (m : t) : cmat =
+let __mat_of_bigarray = Glue.mat_of_bigarray
+let __headers_mark = Glue.headers_mark
+let __release_headers = Glue.release_headers
+let __mat_depth = Glue.mat_depth
+
+let cmat_of_bigarray (m : ('a, 'b) typed) : cmat =
   let num_dims = Genarray.num_dims m in
   let dims = Genarray.dims m |> Array.to_list |> CArray.of_list int |> CArray.start in
-  let data = bigarray_start genarray m in
-  __mat_of_bigarray num_dims dims data
+  let depth = depth_of_kind (Genarray.kind m) in
+  let data = bigarray_start genarray m |> to_voidp in
+  __mat_of_bigarray num_dims dims depth data
+
+let headers_mark () = __headers_mark ()
+let release_headers mark = __release_headers mark
+
+let depth (m : cmat) = __mat_depth m
+
+type header = {
+  data : unit ptr;
+  depth : int;
+  continuous : bool;
+  dims : int array;
+  step : int array;
+}
+
+(* offsets of the fields of the header filled in by mat_header, in C ints;
+   see glue.h *)
+let max_dims = 32
+let header_num_dims = 0
+let header_depth = 1
+let header_continuous = 2
+let header_dims = 3
+let header_step = header_dims + max_dims + 1
+let header_size = header_step + max_dims
+
+let __mat_header = Glue.mat_header
+
+let header (m : cmat) : header =
+  (* a buffer on the minor heap costs next to nothing to allocate, and
+     unlike a shared one it is safe to use from any thread or domain *)
+  let buf = Bytes.create (header_size * sizeof int) in
+  let data = __mat_header m (ocaml_bytes_start buf) in
+  let field i = Int32.to_int (Bytes.get_int32_ne buf (i * sizeof int)) in
+  let num_dims = field header_num_dims in
+  {
+    data;
+    depth = field header_depth;
+    continuous = field header_continuous <> 0;
+    dims = Array.init num_dims (fun i -> field (header_dims + i));
+    step = Array.init (num_dims - 1) (fun i -> field (header_step + i));
+  }
+
+(* the data of empty mats, which OpenCV does not allocate any for; a
+   bigarray with no data would be allocated by OCaml, and OpenCV could not
+   then reallocate it *)
+let empty_buffer = allocate_n int64_t ~count:1
+let empty_data = to_voidp empty_buffer
+
+let bigarray_of_header (kind : ('a, 'b) kind) (h : header) : ('a, 'b) typed =
+  if h.depth <> depth_of_kind kind then
+    invalid_arg "Mat: bigarray kind does not match the depth of the mat";
+  if not h.continuous then
+    failwith "Mat: mat is not continuous";
+  let data = if is_null h.data then empty_data else h.data in
+  bigarray_of_ptr genarray h.dims kind (from_voidp (typ_of_bigarray_kind kind) data)
+
+let bigarray_of_cmat (kind : ('a, 'b) kind) (m : cmat) : ('a, 'b) typed =
+  bigarray_of_header kind (header m)
+
+let __create_mat_typed = Glue.create_mat_typed
+let __release_mat = Glue.release_mat
+let __adopt_mat = Glue.adopt_mat
+let __mat_owns_data = Glue.mat_owns_data
+let __mat_owners = Glue.mat_owners
+
+(* the size in bytes of an element of each depth *)
+let elt_sizes = [| 1; 1; 2; 2; 4; 4; 8 |]
+
+let rec update atomic f =
+  let old = Atomic.get atomic in
+  if not (Atomic.compare_and_set atomic old (f old)) then update atomic f
+
+module Pool = struct
+  type stats = {
+    hits : int;
+    misses : int;
+    evictions : int;
+    bytes : int;
+    mats : int;
+    capacity : int;
+  }
+
+  type entry = {
+    cmat : cmat;
+    bytes : int;
+    stamp : int;
+  }
+
+  (* The mats pooled by one domain, by depth and dimensions, most recently
+     returned first. Mats are returned by finalisers, which can run while
+     the lock is held by the same thread, so they are pushed onto
+     [returned] and moved into the buckets by whoever holds the lock. *)
+  type shard = {
+    lock : Mutex.t;
+    returned : cmat list Atomic.t;
+    buckets : (int * int array, entry list) Hashtbl.t;
+    mutable clock : int;
+    mutable bytes : int;
+    mutable mats : int;
+    mutable hits : int;
+    mutable misses : int;
+    mutable evictions : int;
+  }
+
+  let capacity_bytes = Atomic.make (128 * 1024 * 1024)
+
+  let shards : shard list Atomic.t = Atomic.make []
+
+  let add (s : shard) key (entry : entry) =
+    let entries = Option.value (Hashtbl.find_opt s.buckets key) ~default:[] in
+    Hashtbl.replace s.buckets key (entry :: entries);
+    s.bytes <- s.bytes + entry.bytes;
+    s.mats <- s.mats + 1
+
+  let remove (s : shard) key (entry : entry) =
+    match List.filter (fun e -> e != entry) (Hashtbl.find s.buckets key) with
+      | [] -> Hashtbl.remove s.buckets key
+      | entries -> Hashtbl.replace s.buckets key entries
+
+  let put (s : shard) cmat =
+    let h = header cmat in
+    let bytes =
+      if h.depth < 0 || is_null h.data then 0
+      else Array.fold_left ( * ) elt_sizes.(h.depth) h.dims in
+    (* a mat whose data another mat has come to own, because OpenCV gave it
+       data of another depth, would share it with the mat it was handed to *)
+    if bytes = 0 || __mat_owns_data cmat = 0 then __release_mat cmat
+    else begin
+      s.clock <- s.clock + 1;
+      add s (h.depth, h.dims) { cmat; bytes; stamp = s.clock }
+    end
+
+  let rec last = function
+    | [entry] -> entry
+    | _ :: entries -> last entries
+    | [] -> raise Not_found
+
+  (* releases the least recently returned mat *)
+  let evict (s : shard) =
+    let oldest =
+      Hashtbl.fold (fun key entries oldest ->
+          let entry : entry = last entries in
+          match oldest with
+            | Some (_, e) when e.stamp < entry.stamp -> oldest
+            | _ -> Some (key, entry)) s.buckets None in
+    match oldest with
+      | None -> ()
+      | Some (key, entry) ->
+          remove s key entry;
+          s.bytes <- s.bytes - entry.bytes;
+          s.mats <- s.mats - 1;
+          s.evictions <- s.evictions + 1;
+          __release_mat entry.cmat
+
+  let trim (s : shard) capacity =
+    while s.bytes > capacity do evict s done
+
+  let drain (s : shard) =
+    List.iter (put s) (List.rev (Atomic.exchange s.returned []));
+    trim s (Atomic.get capacity_bytes)
+
+  let locked (s : shard) f =
+    Mutex.lock s.lock;
+    Fun.protect ~finally:(fun () -> Mutex.unlock s.lock) (fun () -> drain s; f ())
 
-let __mat_num_dims = foreign "mat_num_dims" (voidp @-> returning int)
-let __mat_dims = foreign "mat_dims" (voidp @-> returning (ptr int))
-let __mat_data = foreign "mat_data" (voidp @-> returning (ptr int))
+  (* releases every mat in s *)
+  let empty (s : shard) =
+    locked s (fun () ->
+        Hashtbl.iter (fun _ -> List.iter (fun e -> __release_mat e.cmat)) s.buckets;
+        Hashtbl.reset s.buckets;
+        s.bytes <- 0;
+        s.mats <- 0)
 
-let bigarray_of_cmat (m : cmat) : t =
-  let num_dims = __mat_num_dims m in
-  let dims_arr = __mat_dims m in
-  let dims = CArray.from_ptr dims_arr num_dims |> CArray.to_list |> Array.of_list in
-  let data = __mat_data m in
-  bigarray_of_ptr genarray dims Int8_unsigned data
+  let shard_key = Domain.DLS.new_key (fun () ->
+      let s = {
+        lock = Mutex.create ();
+        returned = Atomic.make [];
+        buckets = Hashtbl.create 16;
+        clock = 0;
+        bytes = 0;
+        mats = 0;
+        hits = 0;
+        misses = 0;
+        evictions = 0;
+      } in
+      update shards (List.cons s);
+      (* nothing would take the mats of a domain that has exited *)
+      Domain.at_exit (fun () ->
+          empty s;
+          update shards (List.filter (fun s' -> s' != s)));
+      s)
 
-let __copy_cmat_bigarray =
-  foreign "copy_mat_bigarray" (voidp @-> voidp @-> returning void)
+  let shard () = Domain.DLS.get shard_key
 
-let copy_cmat_bigarray (m1 : cmat) (m2 : t) =
+  let return cmat =
+    let s = shard () in
+    update s.returned (List.cons cmat);
+    if Mutex.try_lock s.lock then
+      Fun.protect ~finally:(fun () -> Mutex.unlock s.lock) (fun () -> drain s)
+
+  let track cmat m =
+    Gc.finalise_last (fun () -> return cmat) m
+
+  let take depth dims =
+    let s = shard () in
+    locked s (fun () ->
+        match Hashtbl.find_opt s.buckets (depth, dims) with
+          | Some (entry :: _) ->
+              remove s (depth, dims) entry;
+              s.bytes <- s.bytes - entry.bytes;
+              s.mats <- s.mats - 1;
+              s.hits <- s.hits + 1;
+              Some entry.cmat
+          | _ ->
+              s.misses <- s.misses + 1;
+              None)
+
+  let capacity () = Atomic.get capacity_bytes
+
+  let set_capacity bytes =
+    if bytes < 0 then invalid_arg "Mat.Pool.set_capacity";
+    Atomic.set capacity_bytes bytes;
+    let s = shard () in
+    locked s (fun () -> trim s bytes)
+
+  let clear () =
+    List.iter empty (Atomic.get shards)
+
+  let stats () =
+    List.fold_left (fun (acc : stats) (s : shard) ->
+        locked s (fun () -> {
+              acc with
+              hits = acc.hits + s.hits;
+              misses = acc.misses + s.misses;
+              evictions = acc.evictions + s.evictions;
+              bytes = acc.bytes + s.bytes;
+              mats = acc.mats + s.mats;
+            }))
+      { hits = 0; misses = 0; evictions = 0; bytes = 0; mats = 0; capacity = capacity () }
+      (Atomic.get shards)
+end
+
+let __copy_cmat_bigarray = Glue.copy_mat_bigarray
+let __copy_inputarray_bigarray = Glue.copy_inputarray_bigarray
+let __inputarray_mat = Glue.inputarray_mat
+
+(* The copy functions return 2 when the mat has just come to own data that
+   OpenCV allocated, which m2 now shares; the mat is released with m2. *)
+let copy_cmat_bigarray (m1 : cmat) (m2 : ('a, 'b) typed) =
   let root = Root.create m2 in
-  let res = __copy_cmat_bigarray m1 root
-  in Root.release root; res
-
-let __create = foreign "create_mat" (void @-> returning voidp)
-let __copy = foreign "mat_copy" (voidp @-> voidp @-> returning void)
-
-let recycling = ref []
-
-let finaliser value =
-  recycling := value :: !recycling
-
-let create () =
-    (*
-     * Instead of allowing mats to be freed, we keep a pool
-     * of "recyclable" mats for re-use by future invocations
-     * of Mat.create. This conveniently solves a couple of
-     * problems at once.
-     *
-     * First, many programs that create lots of mats probably do
-     * so as part of a loop, such as reading from a video file.
-     * It is a bit inefficient to destroy and recreate the mat
-     * every iteration. Using a mat pool should give us
-     * significant reductions in memory allocation and therefore
-     * better performance.
-     *
-     * Second, OpenCV has its own mechanism for garbage collection
-     * of mats that interferes with OCaml's garbage collector.
-     * There were significant issues with double-free errors.
-     * This solution solves the problem by preventing the OCaml
-     * GC from ever trying to free a mat.
-     *
-     * We only add a mat to the recycling list when the OCaml GC
-     * tries to run, which ensures that the OCaml GC never frees
-     * the mat and that the mat is no longer in scope in the
-     * program (the GC only runs on unreachable values).
-     *
-     * This approach feels really dirty but it's almost too good
-     * to be true so we are going to roll with it for now.
-    *)
-  match !recycling with
-    | [] ->
-        begin
-          let mat = __create () |> bigarray_of_cmat in
-          Gc.finalise finaliser mat;
-          mat
-        end
-    | hd :: tl ->
-        begin
-          recycling := tl;
-          Gc.finalise finaliser hd;
-          hd
-        end
-
-let clone mat =
-  let mat' = create () in
-  let cmat' = cmat_of_bigarray mat' in
-  __copy (cmat_of_bigarray mat) cmat';
-  copy_cmat_bigarray cmat' mat';
+  let res = __copy_cmat_bigarray m1 root in
+  Root.release root;
+  if res = 2 then Pool.track m1 m2
+
+let copy_inputarray_bigarray (arr : unit ptr) (m : ('a, 'b) typed) =
+  let root = Root.create m in
+  let res = __copy_inputarray_bigarray arr root in
+  Root.release root;
+  if res = 2 then Pool.track (__inputarray_mat arr) m;
+  res >= 0
+
+(* Releases cmat, a mat allocated for the caller that nothing else
+   releases, when m, which shares its data, is garbage collected. It owns its
+   data until then if OpenCV allocated it, but is not pooled, as OpenCV may
+   share that data with other mats. *)
+let adopt (cmat : cmat) (m : ('a, 'b) typed) =
+  __adopt_mat cmat;
+  Gc.finalise_last (fun () -> __release_mat cmat) m
+
+let owners () = __mat_owners ()
+
+let __copy = Glue.mat_copy
+
+(* a mat of depth and shape dims from the pool, or a new one *)
+let acquire_cmat depth dims =
+  match Pool.take depth dims with
+    | Some cmat -> cmat
+    | None ->
+        let dims' = Array.to_list dims |> CArray.of_list int |> CArray.start in
+        __create_mat_typed (Array.length dims) dims' depth
+
+let acquire (kind : ('a, 'b) kind) (dims : int array) : ('a, 'b) typed =
+  if Array.length dims < 3 then
+    invalid_arg "Mat.acquire: a mat needs at least two dimensions besides the channels";
+  let cmat = acquire_cmat (depth_of_kind kind) dims in
+  let m = bigarray_of_cmat kind cmat in
+  Pool.track cmat m;
+  m
+
+let create () : t =
+  (* OpenCV allocates the data when the mat is first used as an output, and
+     the mat then comes to own it. Mats need at least two dimensions, as
+     OpenCV cannot increase the number of dimensions of a bigarray. *)
+  bigarray_of_ptr genarray [| 0; 0; 3 |] Int8_unsigned
+    (from_voidp (typ_of_bigarray_kind Int8_unsigned) empty_data)
+
+let clone (mat : ('a, 'b) typed) : ('a, 'b) typed =
+  (* only the headers made here, as this can run while the arguments of a
+     binding are being converted *)
+  let mark = __headers_mark () in
+  let mat' = acquire (Genarray.kind mat) (Genarray.dims mat) in
+  __copy (cmat_of_bigarray mat) (cmat_of_bigarray mat');
+  __release_headers mark;
   mat'
+
+(* Copy-on-write *)
+
+let __bigarray_external = Glue.bigarray_external
+
+let is_external (m : ('a, 'b) typed) =
+  let root = Root.create m in
+  let res = __bigarray_external root in
+  Root.release root; res <> 0
+
+let address (m : ('a, 'b) typed) =
+  raw_address_of_ptr (to_voidp (bigarray_start genarray m))
+
+(* The number of bigarrays sharing data through [share], by the address of
+   the data, counting the one it was shared from; data that is not shared
+   has no entry. Finalisers can run while the lock is held by the same
+   thread, so they push the addresses of the bigarrays that they drop onto
+   [dropped], which whoever holds the lock next takes off. *)
+let sharers : (nativeint, int) Hashtbl.t = Hashtbl.create 16
+let sharers_lock = Mutex.create ()
+let dropped = Atomic.make []
+(* the number of entries in sharers, so that unshare can skip the lock
+   when nothing is shared *)
+let shared_count = Atomic.make 0
+
+let drop addr =
+  match Hashtbl.find_opt sharers addr with
+    | Some n when n > 2 -> Hashtbl.replace sharers addr (n - 1)
+    | Some _ -> Hashtbl.remove sharers addr; Atomic.decr shared_count
+    | None -> ()
+
+let drain_dropped () =
+  List.iter drop (Atomic.exchange dropped [])
+
+let with_sharers f =
+  Mutex.lock sharers_lock;
+  Fun.protect ~finally:(fun () -> Mutex.unlock sharers_lock)
+    (fun () -> drain_dropped (); f ())
+
+let share (m : ('a, 'b) typed) : ('a, 'b) typed =
+  (* the data of a bigarray allocated by OCaml cannot be replaced with a
+     copy when it is written to, so it is copied now *)
+  if Genarray.size_in_bytes m = 0 || not (is_external m) then clone m
+  else begin
+    let addr = address m in
+    with_sharers (fun () ->
+        match Hashtbl.find_opt sharers addr with
+          | Some n -> Hashtbl.replace sharers addr (n + 1)
+          | None -> Hashtbl.replace sharers addr 2; Atomic.incr shared_count);
+    let view = bigarray_of_ptr genarray (Genarray.dims m) (Genarray.kind m)
+        (bigarray_start genarray m) in
+    (* the view keeps m alive, and with it the mat that owns the data; if it
+       has been unshared, it no longer counts *)
+    Gc.finalise (fun view ->
+        ignore (Sys.opaque_identity m);
+        if address view = addr then begin
+          update dropped (List.cons addr);
+          if Mutex.try_lock sharers_lock then
+            Fun.protect ~finally:(fun () -> Mutex.unlock sharers_lock) drain_dropped
+        end) view;
+    view
+  end
+
+let unshare (m : ('a, 'b) typed) =
+  if Atomic.get shared_count > 0 && Genarray.size_in_bytes m > 0 then begin
+    let addr = address m in
+    let shared = with_sharers (fun () ->
+        let shared = Hashtbl.mem sharers addr in
+        drop addr;
+        shared) in
+    if shared then begin
+      let cmat = acquire_cmat (depth_of_kind (Genarray.kind m)) (Genarray.dims m) in
+      (* called while the arguments of a binding are being converted, so
+         only the header made here is released *)
+      let mark = __headers_mark () in
+      __copy (cmat_of_bigarray m) cmat;
+      __release_headers mark;
+      copy_cmat_bigarray cmat m
+    end
+  end
@@ -3,16 +3,137 @@ open Ctypes_static
 
 type cmat = unit ptr
 
-type t = (int, int8_unsigned_elt, c_layout) Genarray.t
+(** A mat whose elements have the OpenCV depth corresponding to the
+    bigarray kind: [Int8_unsigned] (or [Char]) for [CV_8U], [Int8_signed]
+    for [CV_8S], [Int16_unsigned] for [CV_16U], [Int16_signed] for
+    [CV_16S], [Int32] for [CV_32S], [Float32] for [CV_32F] and [Float64]
+    for [CV_64F]. The last dimension is the channels. *)
+type ('a, 'b) typed = ('a, 'b, c_layout) Genarray.t
 
-(** [create ()] is a fresh mat. *)
+(** An 8-bit unsigned mat. *)
+type t = (int, int8_unsigned_elt) typed
+
+(** [create ()] is a fresh, empty 8-bit unsigned mat, for OpenCV to
+    allocate the data of when it is used as an output. *)
 val create : unit -> t
 
+(** [acquire kind dims] is a mat of elements of [kind] with dimensions
+    [dims], the last of which is the channels, taken from {!Pool} if it has
+    one of that depth and shape. Its contents are unspecified. Raises
+    [Invalid_argument] if [dims] has fewer than three dimensions. *)
+val acquire : ('a, 'b) kind -> int array -> ('a, 'b) typed
+
 (** [clone src] is a fresh mat containing the same data as
     [src], but with a different underlying array so that the
     new mat is independent from [src]. *)
-val clone : t -> t
+val clone : ('a, 'b) typed -> ('a, 'b) typed
+
+(** [share src] is a copy-on-write clone of [src]: it shares the data of
+    [src] until OpenCV is about to write to either of them, at which point
+    the one written to gets a copy; see {!unshare}. Writes made through
+    [Bigarray] are seen by both, so {!unshare} a mat before setting its
+    elements. Mats allocated by OCaml rather than OpenCV are copied at
+    once. *)
+val share : ('a, 'b) typed -> ('a, 'b) typed
+
+(** [unshare mat] gives [mat] its own copy of its data if it shares it
+    through {!share}, and does nothing otherwise. The bindings call it on
+    every mat passed as an output. *)
+val unshare : ('a, 'b) typed -> unit
+
+(** The mats made by {!acquire}, and those whose data OpenCV allocated when
+    they were passed as outputs, are returned to a pool when they are
+    garbage collected rather than freed, and handed out again by {!acquire}
+    for mats of the same depth and shape. The pool is split into one shard
+    per domain, and holds at most {!capacity} bytes of mats in each shard,
+    releasing the least recently returned ones past that.
+
+    A slice or other view of a mat does not keep it alive, so it must not
+    be used once the mat is unreachable; nor should a view with the same
+    data and shape as the mat be passed to OpenCV as an output. *)
+module Pool : sig
+  type stats = {
+    hits : int;  (** mats that {!acquire} took from the pool *)
+    misses : int;  (** mats that {!acquire} had to create *)
+    evictions : int;  (** mats released to keep under the capacity *)
+    bytes : int;  (** the size of the mats in the pool *)
+    mats : int;  (** the number of mats in the pool *)
+    capacity : int;  (** the capacity of each shard, in bytes *)
+  }
+
+  (** [capacity ()] is the maximum size in bytes of the mats pooled by each
+      domain, 128 MiB by default. *)
+  val capacity : unit -> int
+
+  (** [set_capacity bytes] sets the capacity, releasing mats pooled by the
+      calling domain past it at once, and those of other domains the next
+      time they use the pool. *)
+  val set_capacity : int -> unit
+
+  (** [clear ()] releases every pooled mat. *)
+  val clear : unit -> unit
+
+  (** [stats ()] is the statistics of the pool, summed over domains. *)
+  val stats : unit -> stats
+end
+
+(** [depth_of_kind kind] is the OpenCV depth of mats of elements of
+    [kind], numbered as in {!depth}. Raises [Invalid_argument] if there is
+    no such depth. *)
+val depth_of_kind : ('a, 'b) kind -> int
+
+(** [depth cmat] is the depth of [cmat], from 0 for [CV_8U] to 6 for
+    [CV_64F], or -1 for any other depth. *)
+val depth : cmat -> int
+
+(** The header of a cmat: its data, depth, whether it is continuous, its
+    dimensions as those of a bigarray, i.e. with the channels last, and the
+    step of each of its own dimensions in bytes. *)
+type header = {
+  data : unit ptr;
+  depth : int;
+  continuous : bool;
+  dims : int array;
+  step : int array;
+}
+
+(** [header cmat] is the header of [cmat], read with a single call. *)
+val header : cmat -> header
+
+(** [bigarray_of_header kind header] is a bigarray sharing the data of the
+    mat with [header]. Raises [Invalid_argument] if [kind] does not match
+    its depth and [Failure] if it is not continuous. *)
+val bigarray_of_header : ('a, 'b) kind -> header -> ('a, 'b) typed
+
+(** [cmat_of_bigarray mat] is a mat sharing the data of [mat]: the mat
+    that owns the data, or else a header that is deleted by the
+    {!release_headers} that follows on the calling thread. *)
+val cmat_of_bigarray: ('a, 'b) typed -> cmat
+
+(** [headers_mark ()] marks the headers made by {!cmat_of_bigarray} on the
+    calling thread so far, for {!release_headers}. *)
+val headers_mark : unit -> int
+
+(** [release_headers mark] deletes the headers made by {!cmat_of_bigarray}
+    on the calling thread since [headers_mark ()] returned [mark], other
+    than those that have come to own data that OpenCV allocated for them.
+    The bindings take a mark before converting their arguments, and release
+    from it once they are done with them, or if they raise, so the headers
+    of a caller are left alone. *)
+val release_headers : int -> unit
+
+val bigarray_of_cmat: ('a, 'b) kind -> cmat -> ('a, 'b) typed
+
+(** [adopt cmat mat] releases [cmat], a mat that OpenCV allocated for the
+    caller and [mat] was made from, when [mat] is garbage collected. *)
+val adopt: cmat -> ('a, 'b) typed -> unit
+
+(** [owners ()] is the number of mats that own data that bigarrays point
+    at, whether in use or pooled. *)
+val owners : unit -> int
+val copy_cmat_bigarray: cmat -> ('a, 'b) typed -> unit
 
-val cmat_of_bigarray: t -> cmat
-val bigarray_of_cmat: cmat -> t
-val copy_cmat_bigarray: cmat -> t -> unit
+(** [copy_inputarray_bigarray arr mat] points [mat] at the data of the mat
+    that the InputArray [arr] refers to, if it is a mat of the same depth,
+    and is whether it did. *)
+val copy_inputarray_bigarray: unit ptr -> ('a, 'b) typed -> bool
@@ -0,0 +1,199 @@
+open Bigarray
+
+let __get_num_threads = Glue.get_num_threads
+let __set_num_threads = Glue.set_num_threads
+
+let opencv_threads () = __get_num_threads ()
+let set_opencv_threads n = __set_num_threads n
+
+(* a value published by one domain for others to wait for *)
+type 'a cell = {
+  lock : Mutex.t;
+  ready : Condition.t;
+  mutable value : 'a option;
+}
+
+let publish cell v =
+  Mutex.lock cell.lock;
+  cell.value <- Some v;
+  Condition.broadcast cell.ready;
+  Mutex.unlock cell.lock
+
+let wait cell =
+  Mutex.lock cell.lock;
+  while Option.is_none cell.value do Condition.wait cell.ready cell.lock done;
+  let v = Option.get cell.value in
+  Mutex.unlock cell.lock;
+  v
+
+let rows (cvdata : Cvdata.t) =
+  Cvdata.with_mat { f = fun mat -> (Genarray.dims mat).(0) } 0 cvdata
+
+(* rows [first, first + len) of cvdata, sharing its data *)
+let sub_rows (cvdata : Cvdata.t) first len =
+  Cvdata.with_mat
+    { f = fun mat -> Cvdata.of_typed (Genarray.sub_left mat first len) } cvdata cvdata
+
+(* The bands of rows that count tiles of a mat of the given rows cover: the
+   rows [first, last) that each tile is responsible for, and the rows
+   [lo, hi) that it is given, up to halo more either side. *)
+let tiles ~halo count rows =
+  List.init count (fun i ->
+      let first = rows * i / count and last = rows * (i + 1) / count in
+      first, last, max 0 (first - halo), min rows (last + halo))
+
+(* a pooled mat of the depth and shape of result, but with the given rows *)
+let acquire_like (result : Cvdata.t) rows =
+  match result with
+    | Cvdata.Unknown _ -> invalid_arg "Parallel.map: op did not return a mat"
+    | _ ->
+        Cvdata.with_mat { f = fun mat ->
+            let dims = Array.copy (Genarray.dims mat) in
+            dims.(0) <- rows;
+            Cvdata.of_typed (Mat.acquire (Genarray.kind mat) dims) } result result
+
+(* copies the rows of result that tile is responsible for into out *)
+let stitch (result : Cvdata.t) (first, last, lo, hi) (out : Cvdata.t) =
+  (match result with
+    | Cvdata.Unknown _ -> invalid_arg "Parallel.map: op did not return a mat"
+    | _ -> ());
+  Cvdata.with_mat { f = fun mat ->
+      if (Genarray.dims mat).(0) <> hi - lo then
+        invalid_arg "Parallel.map: op changed the number of rows";
+      let dst =
+        try Cvdata.to_typed (Genarray.kind mat) out
+        with Failure _ -> invalid_arg "Parallel.map: op returned mats of different depths" in
+      Genarray.blit (Genarray.sub_left mat (first - lo) (last - first))
+        (Genarray.sub_left dst first (last - first)) } () result
+
+let map ?(domains = Domain.recommended_domain_count ()) ?(halo = 0) op src =
+  if domains < 1 then invalid_arg "Parallel.map: domains must be positive";
+  if halo < 0 then invalid_arg "Parallel.map: halo must not be negative";
+  (match src with Cvdata.Unknown _ -> invalid_arg "Parallel.map: not a mat" | _ -> ());
+  let rows = rows src in
+  let tiles = tiles ~halo (max 1 (min domains rows)) rows in
+  let run (_, _, lo, hi) = op (sub_rows src lo (hi - lo)) in
+  (* the output is made by the calling domain, whose pool outlives the
+     others, once it has the result of the first tile to go by *)
+  let output = { lock = Mutex.create (); ready = Condition.create (); value = None } in
+  let work tile () =
+    let result = run tile in
+    match wait output with
+      | Ok out -> stitch result tile out
+      | Error _ -> () in
+  let workers = ref [] in
+  (try List.iter (fun tile -> workers := Domain.spawn (work tile) :: !workers) (List.tl tiles)
+   with e ->
+     (* e.g. too many domains; release the ones already running *)
+     publish output (Error e);
+     List.iter (fun worker -> try Domain.join worker with _ -> ()) !workers;
+     raise e);
+  let tile = List.hd tiles in
+  let result = try Ok (run tile) with e -> Error e in
+  let out = Result.bind result (fun result ->
+      try Ok (acquire_like result rows) with e -> Error e) in
+  publish output out;
+  let stitched = match result, out with
+    | Ok result, Ok out -> (try Ok (stitch result tile out) with e -> Error e)
+    | _ -> Ok () in
+  let errors = List.filter_map (fun worker ->
+      match Domain.join worker with
+        | () -> None
+        | exception e -> Some e) (List.rev !workers) in
+  (* the tiles do not keep src alive *)
+  ignore (Sys.opaque_identity src);
+  match out, stitched, errors with
+    | Error e, _, _ | _, Error e, _ | _, _, e :: _ -> raise e
+    | Ok out, Ok (), [] -> out
+
+(* the state shared by the calling domain and the workers of map_frames:
+   the frames to process, in the order they were read, with None telling a
+   worker to stop, and the results by frame number *)
+type 'a frames = {
+  frames_lock : Mutex.t;
+  jobs : (int * Cvdata.t) option Queue.t;
+  job_ready : Condition.t;
+  results : (int, ('a, exn) result) Hashtbl.t;
+  result_ready : Condition.t;
+}
+
+let map_frames ?(domains = max 1 (Domain.recommended_domain_count () - 1)) ?window ~read
+    process consume =
+  if domains < 1 then invalid_arg "Parallel.map_frames: domains must be positive";
+  let window = Option.value window ~default:(2 * domains) in
+  if window < 1 then invalid_arg "Parallel.map_frames: window must be positive";
+  let s = {
+    frames_lock = Mutex.create ();
+    jobs = Queue.create ();
+    job_ready = Condition.create ();
+    results = Hashtbl.create window;
+    result_ready = Condition.create ();
+  } in
+  let submit job =
+    Mutex.lock s.frames_lock;
+    Queue.push job s.jobs;
+    Condition.signal s.job_ready;
+    Mutex.unlock s.frames_lock in
+  let rec work () =
+    Mutex.lock s.frames_lock;
+    while Queue.is_empty s.jobs do Condition.wait s.job_ready s.frames_lock done;
+    let job = Queue.pop s.jobs in
+    Mutex.unlock s.frames_lock;
+    match job with
+      | None -> ()
+      | Some (index, frame) ->
+          let result = try Ok (process frame) with e -> Error e in
+          Mutex.lock s.frames_lock;
+          Hashtbl.replace s.results index result;
+          Condition.broadcast s.result_ready;
+          Mutex.unlock s.frames_lock;
+          work () in
+  let take index =
+    Mutex.lock s.frames_lock;
+    while not (Hashtbl.mem s.results index) do
+      Condition.wait s.result_ready s.frames_lock
+    done;
+    let result = Hashtbl.find s.results index in
+    Hashtbl.remove s.results index;
+    Mutex.unlock s.frames_lock;
+    result in
+  let workers = List.init domains (fun _ -> Domain.spawn work) in
+  let stop () =
+    List.iter (fun _ -> submit None) workers;
+    List.iter Domain.join workers in
+  (* The frames in flight by number, and the frames whose results have been
+     consumed, which are read into again. Past those, frames are taken from
+     the pool in the shape of the last one read, so at most window frames
+     are ever allocated. *)
+  let in_flight = Hashtbl.create window in
+  let free = ref [] in
+  let last = ref None in
+  let buffer () =
+    match !free, !last with
+      | frame :: frames, _ -> free := frames; frame
+      | [], Some (Cvdata.Unknown _) | [], None -> Cvdata.Mat (Mat.create ())
+      | [], Some frame -> acquire_like frame (rows frame) in
+  let read_count = ref 0 and consumed = ref 0 and finished = ref false in
+  Fun.protect ~finally:stop (fun () ->
+      while not !finished || !consumed < !read_count do
+        if not !finished && !read_count - !consumed < window then begin
+          let frame = buffer () in
+          match read frame with
+            | None -> finished := true
+            | Some frame ->
+                last := Some frame;
+                Hashtbl.replace in_flight !read_count frame;
+                submit (Some (!read_count, frame));
+                incr read_count
+        end else begin
+          let result = take !consumed in
+          let frame = Hashtbl.find in_flight !consumed in
+          Hashtbl.remove in_flight !consumed;
+          incr consumed;
+          match result with
+            | Ok result ->
+                consume result;
+                free := frame :: !free
+            | Error e -> raise e
+        end
+      done)
@@ -0,0 +1,49 @@
+(** Running image operations in several domains at once, over bands of
+    the rows of a large mat or over the frames of a video, rather than
+    relying on the threads of OpenCV. *)
+
+(** [map ?domains ?halo op src] is [op src], computed by splitting [src]
+    into [domains] bands of rows, which share its data, and running [op] on
+    each band in a domain of its own. Each band is given up to [halo] rows
+    either side of the rows it is responsible for, so that an operation
+    that looks at the neighbours of a pixel, such as a blur with a kernel
+    of [2 * halo + 1] rows, gives the same result as it does on the whole
+    mat; [halo] is 0, enough for per-pixel operations such as [threshold]
+    or [cvt_color], by default. The results are copied into a mat taken
+    from {!Mat.Pool}.
+
+    [op] must return a mat with the same number of rows as the mat it is
+    given, of the same depth and other dimensions for every band, and
+    raises [Invalid_argument] otherwise, as it does if [src] is not a mat.
+    [domains] is [Domain.recommended_domain_count ()] by default. *)
+val map : ?domains:int -> ?halo:int -> (Cvdata.t -> Cvdata.t) -> Cvdata.t -> Cvdata.t
+
+(** [map_frames ?domains ?window ~read process consume] reads frames with
+    [read] until it returns [None], runs [process] on each in one of
+    [domains] worker domains, and calls [consume] on the results in the
+    order in which the frames were read. [read] and [consume] run in the
+    calling domain, so [read] can decode from a [Video_capture] and
+    [consume] can show the results, e.g.
+    [~read:(fun image -> match Video_capture.read vid ~image with
+    | frame, true -> Some frame | _ -> None)].
+
+    [read] is given a mat to read the frame into. At most [window] frames,
+    [2 * domains] by default, are read but not yet consumed at any time,
+    and the mat of a frame is read into again once its result has been
+    consumed, so [process] must not return the frame or views of it. The
+    mats are taken from {!Mat.Pool} in the shape of the previous frame.
+    [domains] is one less than [Domain.recommended_domain_count ()] by
+    default, leaving a core for [read]. An exception raised by [process] is
+    raised again when its result would have been consumed. *)
+val map_frames : ?domains:int -> ?window:int -> read:(Cvdata.t -> Cvdata.t option) ->
+  (Cvdata.t -> 'a) -> ('a -> unit) -> unit
+
+(** [opencv_threads ()] is the number of threads that OpenCV runs each of
+    its functions over. *)
+val opencv_threads : unit -> int
+
+(** [set_opencv_threads n] makes OpenCV run its functions over [n] threads,
+    or on the calling thread alone if [n] is 0 or 1, which avoids running
+    more threads than there are cores when using {!map}. A negative [n]
+    restores the default. *)
+val set_opencv_threads : int -> unit
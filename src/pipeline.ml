@@ -0,0 +1,79 @@
+type timings = {
+  name : string;
+  mutable calls : int;
+  mutable total : float;
+  mutable max : float;
+}
+
+type ('a, 'b) t = {
+  apply : 'a -> 'b;
+  (* in the order they run in *)
+  stages : timings list;
+}
+
+type metrics = {
+  name : string;
+  calls : int;
+  total : float;
+  mean : float;
+  max : float;
+}
+
+let timings name : timings = { name; calls = 0; total = 0.; max = 0. }
+
+let timed (timings : timings) f x =
+  let start = Unix.gettimeofday () in
+  let y = f x in
+  let elapsed = Unix.gettimeofday () -. start in
+  timings.calls <- timings.calls + 1;
+  timings.total <- timings.total +. elapsed;
+  if elapsed > timings.max then timings.max <- elapsed;
+  y
+
+let stage name f =
+  let timings = timings name in
+  let dst = ref None in
+  let apply src =
+    let dst' = match !dst with
+      | Some dst' -> dst'
+      | None -> Cvdata.Mat (Mat.create ()) in
+    let result = timed timings (fun src -> f ~dst:dst' src) src in
+    (* a new value if the depth changed, which is then reused *)
+    dst := Some result;
+    result in
+  { apply; stages = [timings] }
+
+let map name f =
+  let timings = timings name in
+  { apply = timed timings f; stages = [timings] }
+
+let id = { apply = Fun.id; stages = [] }
+
+let ( >>> ) p q = { apply = (fun x -> q.apply (p.apply x)); stages = p.stages @ q.stages }
+
+let ( &&& ) p q = { apply = (fun x -> p.apply x, q.apply x); stages = p.stages @ q.stages }
+
+let run p frames = Seq.map p.apply frames
+
+let frames read =
+  let rec next image () =
+    match read image with
+      | Some frame -> Seq.Cons (frame, next frame)
+      | None -> Seq.Nil in
+  next (Cvdata.Mat (Mat.create ()))
+
+let metrics p =
+  List.map (fun (timings : timings) ->
+      {
+        name = timings.name;
+        calls = timings.calls;
+        total = timings.total;
+        mean = if timings.calls = 0 then 0. else timings.total /. float_of_int timings.calls;
+        max = timings.max;
+      }) p.stages
+
+let reset_metrics p =
+  List.iter (fun (timings : timings) ->
+      timings.calls <- 0;
+      timings.total <- 0.;
+      timings.max <- 0.) p.stages
@@ -0,0 +1,68 @@
+(** Chains of operations run on every frame of a [Seq.t], each writing into
+    a mat of its own that is reused from one frame to the next, as in
+    [demos/reuse], without the caller having to keep the mats and pass them
+    as [~dst]. The time each operation takes is recorded.
+
+    Since the mats are reused, the results for a frame, and any mat made by
+    an operation for it, are only valid until the next frame is taken from
+    the sequence; clone them to keep them longer. *)
+
+(** A chain of operations from an ['a] to a ['b]. Each stage of a chain
+    owns its mat and its timings, so a stage should appear only once in a
+    chain, and a chain should be run over one sequence at a time. *)
+type ('a, 'b) t
+
+(** [stage name f] is the operation [f ~dst src], e.g.
+    [stage "blur" (fun ~dst src -> gaussian_blur src ~dst {width=21; height=21} 10.)],
+    where [dst] is the mat that [f] returned for the previous frame, or
+    an empty mat for the first. OpenCV writes into [dst] rather than
+    allocating if the result has the same depth and shape as it did for the
+    previous frame, and allocates a new mat otherwise, which is reused from
+    then on. [f] should return [dst] or a mat of its own, as the generated
+    functions do, and not its input, which would then be written to as
+    [dst] the next time. *)
+val stage : string -> (dst:Cvdata.t -> 'a -> Cvdata.t) -> ('a, Cvdata.t) t
+
+(** [map name f] is the operation [f], for those that do not write to a
+    mat, such as [bounding_rect] or [find_contours], or that allocate their
+    own. *)
+val map : string -> ('a -> 'b) -> ('a, 'b) t
+
+(** [id] passes its input through, e.g. to keep a result alongside a
+    later one with {!(&&&)}. *)
+val id : ('a, 'a) t
+
+(** [p >>> q] runs [q] on the results of [p]. *)
+val ( >>> ) : ('a, 'b) t -> ('b, 'c) t -> ('a, 'c) t
+
+(** [p &&& q] runs both [p] and [q] on the same input, and gives both
+    their results, e.g. [id &&& stage "threshold" ...] to keep the input of
+    the threshold as well as its result. *)
+val ( &&& ) : ('a, 'b) t -> ('a, 'c) t -> ('a, 'b * 'c) t
+
+(** [run p frames] is the results of [p] for each of [frames], computed as
+    they are taken from the sequence. *)
+val run : ('a, 'b) t -> 'a Seq.t -> 'b Seq.t
+
+(** [frames read] is the frames read by [read] until it returns [None].
+    [read] is given a mat to read the frame into, the frame it returned
+    the previous time, as for [Parallel.map_frames], e.g.
+    [frames (fun image -> match Video_capture.read vid ~image with
+    | frame, true -> Some frame | _ -> None)]. *)
+val frames : (Cvdata.t -> Cvdata.t option) -> Cvdata.t Seq.t
+
+type metrics = {
+  name : string;  (** the name of the stage *)
+  calls : int;  (** the number of frames it has run on *)
+  total : float;  (** the time it took over all of them, in seconds *)
+  mean : float;  (** the time it took for a frame on average, in seconds *)
+  max : float;  (** the longest it took for a frame, in seconds *)
+}
+
+(** [metrics p] is the timings of the stages of [p], made with {!stage} or
+    {!map}, in the order they run in, since they were made or last reset. *)
+val metrics : ('a, 'b) t -> metrics list
+
+(** [reset_metrics p] sets the timings of the stages of [p] back to
+    zero. *)
+val reset_metrics : ('a, 'b) t -> unit
@@ -0,0 +1,98 @@
+open Ctypes
+
+let __prefetch_open = Glue.prefetch_open
+let __prefetch_next = Glue.prefetch_next
+let __prefetch_frame = Glue.prefetch_frame
+let __prefetch_release = Glue.prefetch_release
+let __prefetch_stats = Glue.prefetch_stats
+let __prefetch_close = Glue.prefetch_close
+
+type t = {
+  reader : unit ptr;
+  slots : int;
+  mutable closed : bool;
+  (* the frames handed out and not yet released *)
+  mutable outstanding : int;
+}
+
+type frame = {
+  owner : t;
+  slot : int;
+  image : Cvdata.t;
+  mutable released : bool;
+}
+
+type stats = {
+  read : int;
+  waits : int;
+  stalls : int;
+  ready : int;
+  held : int;
+}
+
+(* offsets of the fields of the statistics filled in by prefetch_stats, in
+   C ints; see glue.h *)
+let stats_read = 0
+let stats_waits = 1
+let stats_stalls = 2
+let stats_ready = 3
+let stats_size = 4
+
+let check_open name t =
+  if t.closed then invalid_arg (name ^ ": reader is closed")
+
+let open_file ?(api_preference = 0) ?(slots = 4) filename =
+  if slots < 1 then invalid_arg "Prefetch.open_file: slots must be positive";
+  let reader = __prefetch_open filename api_preference slots in
+  if is_null reader then failwith ("Prefetch.open_file: cannot open " ^ filename);
+  { reader; slots; closed = false; outstanding = 0 }
+
+let next t =
+  check_open "Prefetch.next" t;
+  (* the thread would have no mat to decode into *)
+  if t.outstanding = t.slots then
+    invalid_arg "Prefetch.next: every frame of the ring is held";
+  match __prefetch_next t.reader with
+    | -1 -> None
+    | slot ->
+        t.outstanding <- t.outstanding + 1;
+        let image = Cvdata.of_cmat (__prefetch_frame t.reader slot) in
+        Some { owner = t; slot; image; released = false }
+
+let image frame =
+  if frame.released then invalid_arg "Prefetch.image: frame has been released";
+  frame.image
+
+let release frame =
+  if frame.released then invalid_arg "Prefetch.release: frame has been released";
+  check_open "Prefetch.release" frame.owner;
+  frame.released <- true;
+  frame.owner.outstanding <- frame.owner.outstanding - 1;
+  __prefetch_release frame.owner.reader frame.slot
+
+let rec iter f t =
+  match next t with
+    | None -> ()
+    | Some frame ->
+        Fun.protect ~finally:(fun () -> release frame) (fun () -> f frame.image);
+        iter f t
+
+let stats t =
+  check_open "Prefetch.stats" t;
+  let buf = Bytes.create (stats_size * sizeof int) in
+  __prefetch_stats t.reader (ocaml_bytes_start buf);
+  let field i = Int32.to_int (Bytes.get_int32_ne buf (i * sizeof int)) in
+  {
+    read = field stats_read;
+    waits = field stats_waits;
+    stalls = field stats_stalls;
+    ready = field stats_ready;
+    held = t.outstanding;
+  }
+
+let close t =
+  if not t.closed then begin
+    if t.outstanding > 0 then invalid_arg "Prefetch.close: frames have not been released";
+    t.closed <- true;
+    __prefetch_close t.reader
+  end
@@ -0,0 +1,46 @@
+(** Reading a video with a thread of its own that decodes ahead of the
+    caller, into a ring of mats that are handed out in turn and given back
+    with {!release} to be decoded into again. The caller only waits for
+    decoding when it processes frames faster than they can be decoded. *)
+
+type t
+
+(** A frame handed out by {!next}. *)
+type frame
+
+type stats = {
+  read : int;  (** the frames decoded so far *)
+  waits : int;  (** the times that {!next} had to wait for a frame *)
+  stalls : int;  (** the times that the ring was full of frames not yet released *)
+  ready : int;  (** the frames decoded but not yet handed out *)
+  held : int;  (** the frames handed out but not yet released *)
+}
+
+(** [open_file ?api_preference ?slots filename] starts decoding the video
+    [filename], as [Video_capture] would with the given API preference, 0
+    for any by default, into a ring of [slots] mats, 4 by default. Raises
+    [Failure] if the file cannot be opened. *)
+val open_file : ?api_preference:int -> ?slots:int -> string -> t
+
+(** [next t] is the next frame of the video, waiting for it to be decoded
+    if need be without holding the runtime lock, or [None] at the end of
+    the video. Raises [Invalid_argument] if all [slots] frames are held. *)
+val next : t -> frame option
+
+(** [image frame] is the mat of [frame], which shares its data with the
+    ring, so it must not be used once the frame is released. *)
+val image : frame -> Cvdata.t
+
+(** [release frame] gives the mat of [frame] back to the ring to be decoded
+    into. Every frame must be released, in any order. *)
+val release : frame -> unit
+
+(** [iter f t] calls [f] on the image of each remaining frame of [t],
+    releasing each once [f] returns. *)
+val iter : (Cvdata.t -> unit) -> t -> unit
+
+val stats : t -> stats
+
+(** [close t] stops decoding and frees the ring. Raises [Invalid_argument]
+    if frames have not been released. *)
+val close : t -> unit
@@ -1,15 +1,10 @@
-open Ctypes_static
-
-let foreign = Loader.foreign
-
 type t = { w : float; x : float; y : float; z : float }
 
-let __build_scalar = foreign "build_scalar"
-                       (double @-> double @-> double @-> double @-> returning (ptr void))
-let __scalar_w = foreign "scalar_w" (ptr void @-> returning double)
-let __scalar_x = foreign "scalar_x" (ptr void @-> returning double)
-let __scalar_y = foreign "scalar_y" (ptr void @-> returning double)
-let __scalar_z = foreign "scalar_z" (ptr void @-> returning double)
+let __build_scalar = Glue.build_scalar
+let __scalar_w = Glue.scalar_w
+let __scalar_x = Glue.scalar_x
+let __scalar_y = Glue.scalar_y
+let __scalar_z = Glue.scalar_z
 
 let ocaml_to_ctypes s =
   __build_scalar s.w s.x s.y s.z
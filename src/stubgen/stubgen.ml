@@ -0,0 +1,42 @@
+(* Generates the C stubs and the OCaml modules that call them for the
+   functions declared in Glue_bindings and Opencv_bindings, so that they are
+   linked statically rather than looked up with libffi at runtime.
+
+   The functions in Opencv_bindings.Make_unlocked get stubs of their own that
+   release the runtime lock while they run.
+
+   Usage: stubgen.exe glue.c glue.ml opencv.c opencv.ml unlocked.c unlocked.ml *)
+
+let with_formatter fname f =
+  let oc = open_out fname in
+  let fmt = Format.formatter_of_out_channel oc in
+  f fmt;
+  Format.pp_print_flush fmt ();
+  close_out oc
+
+let write_stubs ?(concurrency = Cstubs.sequential) ~prefix ~header ~c_file ~ml_file
+    bindings =
+  with_formatter c_file (fun fmt ->
+      Format.fprintf fmt "#include \"%s\"@.@." header;
+      Cstubs.write_c fmt ~concurrency ~prefix bindings);
+  with_formatter ml_file (fun fmt ->
+      (* the generated code is not warning-clean *)
+      Format.fprintf fmt "[@@@@@@warning \"-a\"]@.@.";
+      Cstubs.write_ml fmt ~concurrency ~prefix bindings)
+
+let () =
+  match Array.to_list Sys.argv with
+  | [_; glue_c; glue_ml; opencv_c; opencv_ml; unlocked_c; unlocked_ml] ->
+     write_stubs ~prefix:"caml_opencv_glue" ~header:"glue_cstubs.h"
+       ~c_file:glue_c ~ml_file:glue_ml
+       (module Glue_bindings.Make : Cstubs.BINDINGS);
+     write_stubs ~prefix:"caml_opencv" ~header:"opencv_cstubs.h"
+       ~c_file:opencv_c ~ml_file:opencv_ml
+       (module Opencv_bindings.Make : Cstubs.BINDINGS);
+     write_stubs ~concurrency:Cstubs.unlocked ~prefix:"caml_opencv_unlocked"
+       ~header:"opencv_cstubs.h" ~c_file:unlocked_c ~ml_file:unlocked_ml
+       (module Opencv_bindings.Make_unlocked : Cstubs.BINDINGS)
+  | _ ->
+     prerr_endline
+       "usage: stubgen.exe glue.c glue.ml opencv.c opencv.ml unlocked.c unlocked.ml";
+     exit 2
@@ -1,12 +1,14 @@
+open Bigarray
 open Ctypes
 open Ctypes_static
 
-let foreign = Loader.foreign
+type ('a, 'b) t = ('a, 'b, c_layout) Genarray.t
 
-let __vector_data = foreign "vector_data" (ptr void @-> returning (ptr void))
-let __vector_length = foreign "vector_length" (ptr void @-> returning int)
-let __create_vector =
-  foreign "create_vector" (ptr void @-> int @-> int @-> returning (ptr void))
+let __vector_data = Glue.vector_data
+let __vector_length = Glue.vector_length
+let __create_vector = Glue.create_vector
+let __delete_vector = Glue.delete_vector
+let __copy_vector_bigarray = Glue.copy_vector_bigarray
 
 let list_of_vector (t : 'a typ) (p : unit ptr) =
   let len = __vector_length p in
@@ -16,3 +18,46 @@ let list_of_vector (t : 'a typ) (p : unit ptr) =
 let vector_of_list (t : 'a typ) (lst : 'a list) =
   let arr = CArray.of_list t lst in
   __create_vector (CArray.start arr |> to_voidp) (CArray.length arr) (sizeof t)
+
+let create (kind : ('a, 'b) kind) (dims : int array) : ('a, 'b) t =
+  (* allocated by ctypes rather than OCaml, so that OpenCV can resize it *)
+  let count = Array.fold_left ( * ) 1 dims in
+  bigarray_of_ptr genarray dims kind
+    (allocate_n (typ_of_bigarray_kind kind) ~count:(max count 1))
+
+let of_array (kind : ('a, 'b) kind) ?(fields = 0) (arr : 'a array) : ('a, 'b) t =
+  let length = if fields = 0 then Array.length arr else Array.length arr / fields in
+  let v = create kind (if fields = 0 then [| length |] else [| length; fields |]) in
+  let flat = reshape_1 v (Array.length arr) in
+  Array.iteri (Array1.unsafe_set flat) arr;
+  v
+
+let to_array (v : ('a, 'b) t) : 'a array =
+  let flat = reshape_1 v (Array.fold_left ( * ) 1 (Genarray.dims v)) in
+  let arr = Array.init (Array1.dim flat) (Array1.unsafe_get flat) in
+  (* flat does not keep the data of v alive *)
+  ignore (Sys.opaque_identity v);
+  arr
+
+let of_vector (kind : ('a, 'b) kind) (fields : int) (p : unit ptr) : ('a, 'b) t =
+  let item_size = kind_size_in_bytes kind * max fields 1 in
+  let length = __vector_length p / item_size in
+  let dims = if fields = 0 then [| length |] else [| length; fields |] in
+  let v = create kind dims in
+  if length > 0 then
+    Genarray.blit (bigarray_of_ptr genarray dims kind
+                     (from_voidp (typ_of_bigarray_kind kind) (__vector_data p))) v;
+  v
+
+let pack (v : ('a, 'b) t) : unit ptr =
+  __create_vector (bigarray_start genarray v |> to_voidp) (Genarray.size_in_bytes v) 1
+
+let pack_post (v : ('a, 'b) t) (p : unit ptr) =
+  let root = Root.create v in
+  let kept = Fun.protect ~finally:(fun () -> Root.release root)
+      (fun () -> __copy_vector_bigarray p root) in
+  (* if v now shares the data of a new vector, that vector is freed with it;
+     p itself is left for release *)
+  if not (is_null kept) then Gc.finalise_last (fun () -> __delete_vector kept) v
+
+let release (p : unit ptr) = __delete_vector p
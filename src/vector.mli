@@ -1,4 +1,46 @@
+open Bigarray
 open Ctypes
 
+(** A [std::vector] of numbers, or of structs whose fields are all numbers
+    of the same type, such as points and rects. The first dimension is the
+    elements, and the second, if there is one, the fields of each element,
+    e.g. [[| n; 2 |]] for [n] points. A [std::vector<int>] is a vector of
+    [Int32], of [float] one of [Float32] and of [double] one of [Float64].
+
+    A vector passed to OpenCV is still copied into a [std::vector] for the
+    call, but in one block rather than element by element through a list,
+    and one that OpenCV takes by non-const reference is copied back in
+    place. If OpenCV changes the number of elements of such a vector, the
+    vector is pointed at the new elements instead, which is only possible
+    for a vector made by {!create} or returned by a function, not one
+    allocated by OCaml. *)
+type ('a, 'b) t = ('a, 'b, c_layout) Genarray.t
+
+(** [create kind dims] is a vector of elements of [kind] with dimensions
+    [dims], e.g. [create Int32 [| 0 |]] for an empty vector of ints to pass
+    as an output. Its contents are unspecified. *)
+val create : ('a, 'b) kind -> int array -> ('a, 'b) t
+
+(** [of_array kind ~fields arr] is a vector of the elements of [arr], each
+    of [fields] numbers (or a single number if [fields] is [0], the
+    default), laid out one after the other. *)
+val of_array : ('a, 'b) kind -> ?fields:int -> 'a array -> ('a, 'b) t
+
+(** [to_array v] is the numbers in [v], the fields of each element one after
+    the other. *)
+val to_array : ('a, 'b) t -> 'a array
+
+val of_vector : ('a, 'b) kind -> int -> unit ptr -> ('a, 'b) t
+
+(** [pack v] is a [std::vector] holding a copy of [v], which {!release}
+    frees. The bindings release it once the call returns or raises. *)
+val pack : ('a, 'b) t -> unit ptr
+
+(** [pack_post v p] writes the [std::vector] [p] that OpenCV has written
+    to back into [v], and leaves [p] to be released. *)
+val pack_post : ('a, 'b) t -> unit ptr -> unit
+
+val release : unit ptr -> unit
+
 val list_of_vector: 'a typ -> unit ptr -> 'a list
 val vector_of_list: 'a typ -> 'a list -> unit ptr
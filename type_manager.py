@@ -3,8 +3,12 @@ class Conv(str):
     def __new__(self, conv, *args, **kwargs):
         return super(Conv, self).__new__(self, conv)
 
-    def __init__(self, conv, post=None):
+    def __init__(self, conv, post=None, release=None):
+        # what to do with the original and converted values after the call,
+        # and what to do with the converted value whether or not the call
+        # raises
         self.post = post
+        self.release = release
 
 
 class Type():
@@ -47,9 +51,22 @@ class Type():
     def ctypes_to_ocaml(self, val):
         return Conv(val)
 
+    def ctypes_to_ocaml_new(self, val):
+        """The conversion of a pointer to an object that C++ allocated
+        for the OCaml value, which frees it, or None if values of this type
+        cannot free one.
+        """
+        return None
+
     def ocaml_to_ctypes(self, val):
         return Conv(val)
 
+    def ocaml_to_ctypes_const(self, val):
+        """The conversion of a value that C++ takes as const, and so does
+        not write to.
+        """
+        return self.ocaml_to_ctypes(val)
+
     def must_pass_pointer(self):
         """False iff this value can be passed on the stack.
         (True iff it must be passed on the heap insead.)
@@ -88,6 +105,27 @@ class Type():
         """
         return False
 
+    def is_value(self):
+        """True iff OCaml values of this type are immutable and do not
+        refer to C++ memory, so that one value can be shared, e.g. as the
+        default value of a parameter.
+        """
+        return False
+
+    def is_copied(self):
+        """True iff OCaml values of this type are copied to and from a C++
+        object that only needs to live for the call, so that a function can
+        return a pointer to a static object, and a pointer or reference to
+        one is passed as the pointer to that object.
+        """
+        return self.is_value()
+
+    def is_array(self):
+        """True iff values of this type are image data, which OpenCV can
+        take long enough over that the runtime lock should be released.
+        """
+        return False
+
 
 class BaseType(Type):
     def __init__(self, cpp_type, c_type, ctypes_type, ctypes_value, ocaml_type):
@@ -112,6 +150,9 @@ class BaseType(Type):
     def get_ocaml_type(self):
         return self.ocaml_type
 
+    def is_value(self):
+        return True
+
 
 class String(BaseType):
     def __init__(self):
@@ -155,11 +196,29 @@ class WrapperType(Type):
     def ocaml_to_ctypes(self, val):
         return self.inner.ocaml_to_ctypes(val)
 
+    def ocaml_to_ctypes_const(self, val):
+        return self.inner.ocaml_to_ctypes_const(val)
+
+    def is_value(self):
+        return self.inner.is_value()
+
+    def is_copied(self):
+        return self.inner.is_copied()
+
+    def is_array(self):
+        return self.inner.is_array()
+
 
 class Const(WrapperType):
     def __init__(self, inner):
         super().__init__(inner)
 
+    def ocaml_to_ctypes(self, val):
+        return self.inner.ocaml_to_ctypes_const(val)
+
+    def ctypes_to_ocaml_new(self, val):
+        return self.inner.ctypes_to_ocaml_new(val)
+
     def get_cpp_type(self):
         # don't double const
         return 'const {}'.format(self.inner.get_cpp_type().replace('const ', ''))
@@ -180,21 +239,44 @@ class GenericPointer(WrapperType):
     def get_c_type(self):
         return '{}{}'.format(self.inner.get_c_type(), self.pointer_char)
 
+    def points_to_inner(self):
+        """True iff the inner type is already passed to C as a pointer to
+        the C++ object (e.g. a struct), so a pointer or reference to it is
+        passed the same way rather than through another pointer.
+        """
+        inner = self.inner.inner if isinstance(self.inner, Const) else self.inner
+        return inner.is_copied() and inner.must_pass_pointer() \
+            and not inner.get_c_type().endswith('*')
+
     def get_ctypes_type(self):
+        if self.points_to_inner():
+            return self.inner.get_ctypes_type()
         return '({}) ptr'.format(self.inner.get_ctypes_type())
 
     def get_ctypes_value(self):
+        if self.points_to_inner():
+            return self.inner.get_ctypes_value()
         return 'ptr ({})'.format(self.inner.get_ctypes_value())
 
     def get_ocaml_type(self):
         return self.inner.get_ocaml_type()
 
     def ctypes_to_ocaml(self, val):
+        if self.points_to_inner():
+            return self.inner.ctypes_to_ocaml(val)
         return Conv(self.inner.ctypes_to_ocaml('(!@ ({}))'.format(val)))
 
     def ocaml_to_ctypes(self, val):
+        return self._ocaml_to_ctypes(val, self.inner.ocaml_to_ctypes)
+
+    def ocaml_to_ctypes_const(self, val):
+        return self._ocaml_to_ctypes(val, self.inner.ocaml_to_ctypes_const)
+
+    def _ocaml_to_ctypes(self, val, inner_conv):
+        if self.points_to_inner():
+            return inner_conv(val)
         return Conv('(allocate ({}) ({}))'.format(self.inner.get_ctypes_value(),
-                                                  self.inner.ocaml_to_ctypes(val)))
+                                                  inner_conv(val)))
 
     def is_pointer(self):
         return True
@@ -236,6 +318,12 @@ class Array(WrapperType):
         # TODO currently no fancy processing to extract array values
         return '({}) ptr'.format(self.inner.get_ctypes_type())
 
+    def is_value(self):
+        return False
+
+    def is_copied(self):
+        return False
+
 
 class Vector(WrapperType):
     def __init__(self, inner):
@@ -257,7 +345,7 @@ class Vector(WrapperType):
         return '({}) list'.format(self.inner.get_ocaml_type())
 
     def ctypes_to_ocaml(self, val):
-        return Conv('list_of_vector ({}) ({}) |> List.map (fun x -> {})'
+        return Conv('Vector.list_of_vector ({}) ({}) |> List.map (fun x -> {})'
                     .format(self.inner.get_ctypes_value(), val,
                             self.inner.ctypes_to_ocaml('x')))
 
@@ -273,10 +361,76 @@ class Vector(WrapperType):
         return True
 
 
+# The bigarray kind and OCaml element type of vectors of each C++ number
+# type; see NumericVector.
+numeric_kinds = {
+    'int': ('Bigarray.Int32', 'int32', 'Bigarray.int32_elt'),
+    'float': ('Bigarray.Float32', 'float', 'Bigarray.float32_elt'),
+    'double': ('Bigarray.Float64', 'float', 'Bigarray.float64_elt'),
+}
+
+
+class NumericVector(WrapperType):
+    """A std::vector of numbers, or of structs of numbers of one type, which
+    is a bigarray in OCaml (see vector.mli) that is copied into a
+    std::vector in one go, rather than element by element through a list.
+    The std::vector is written back to the bigarray after the call, unless
+    it is const.
+    """
+
+    def __init__(self, inner, number_type, fields):
+        super().__init__(inner)
+        self.kind, self.elt, self.elt_kind = numeric_kinds[number_type]
+        # the numbers in each element, or 0 for vectors of numbers
+        self.fields = fields
+
+    def get_cpp_type(self):
+        return 'std::vector<{}>'.format(self.inner.get_cpp_type())
+
+    def get_c_type(self):
+        return 'std::vector<{}>'.format(self.inner.get_c_type())
+
+    def get_ctypes_type(self):
+        return 'unit ptr'
+
+    def get_ctypes_value(self):
+        return 'ptr void'
+
+    def get_ocaml_type(self):
+        return '({}, {}) Vector.t'.format(self.elt, self.elt_kind)
+
+    def ctypes_to_ocaml(self, val):
+        return Conv('(Vector.of_vector {} {} ({}))'.format(self.kind, self.fields, val))
+
+    def _post(self, original, converted):
+        return 'Vector.pack_post {} {}'.format(original, converted)
+
+    def _release(self, original, converted):
+        return 'Vector.release {}'.format(converted)
+
+    def ocaml_to_ctypes(self, val):
+        return Conv('(Vector.pack ({}))'.format(val), post=self._post,
+                    release=self._release)
+
+    def ocaml_to_ctypes_const(self, val):
+        return Conv('(Vector.pack ({}))'.format(val), release=self._release)
+
+    def must_pass_pointer(self):
+        return True
+
+    def is_value(self):
+        # a bigarray, which OpenCV can write to, so a default value must not
+        # be shared between calls
+        return False
+
+    def is_copied(self):
+        return True
+
+
 class CustomType(BaseType):
     def __init__(self, cpp_type, c_type, ctypes_type, ctypes_value, ocaml_type,
                  cpp2c='{}', c2cpp='{}', ctypes2ocaml='{}', ocaml2ctypes='{}', post=None,
-                 must_pointerize=False):
+                 must_pointerize=False, value=False, numeric_fields=None):
 
         super().__init__(cpp_type, c_type, ctypes_type, ctypes_value, ocaml_type)
         self.cpp2c = cpp2c
@@ -285,6 +439,10 @@ class CustomType(BaseType):
         self.ocaml2ctypes = ocaml2ctypes
         self.post = post
         self.must_pointerize = must_pointerize
+        self.value = value
+        # (number type, count) if this is a struct of numbers of one type,
+        # which vectors of can be bigarrays; see NumericVector
+        self.numeric_fields = numeric_fields
 
     def cpp_to_c(self, val):
         return Conv(self.cpp2c.format(val))
@@ -302,6 +460,9 @@ class CustomType(BaseType):
     def must_pass_pointer(self):
         return self.must_pointerize
 
+    def is_value(self):
+        return self.value
+
 
 class Mat(Type):
     def get_cpp_type(self):
@@ -317,29 +478,39 @@ class Mat(Type):
         return 'ptr void'
 
     def get_ocaml_type(self):
-        return 'Mat.t'
+        # a mat can be of any depth, which only Cvdata keeps track of
+        return 'Cvdata.t'
 
     def ctypes_to_ocaml(self, val):
-        return Conv('(Mat.bigarray_of_cmat ({}))'.format(val))
+        return Conv('(Cvdata.of_cmat ({}))'.format(val))
+
+    def ctypes_to_ocaml_new(self, val):
+        return Conv('(Cvdata.of_new_cmat ({}))'.format(val))
 
     def _post(self, original, converted):
-        return 'Mat.copy_cmat_bigarray {} {}'.format(original, converted)
+        return 'Cvdata.pack_cmat_post {} {}'.format(original, converted)
 
     def ocaml_to_ctypes(self, val):
-        return Conv('(Mat.cmat_of_bigarray ({}))'.format(val), post=self._post)
+        return Conv('(Cvdata.pack_cmat ({}))'.format(val), post=self._post)
 
     def must_pass_pointer(self):
         return True
 
+    def is_array(self):
+        return True
+
 
 class Cvdata(Type):
     def __init__(self, cpp_type, optional=False, ret=False, cloneable=False,
-                 is_draw=False):
+                 is_draw=False, output=False):
         self.cpp_type = cpp_type
         self.optional = optional
         self.ret = ret
         self.cloneable = cloneable
         self.is_draw = is_draw
+        # OpenCV writes to the argument, so it must not share its data with
+        # a copy-on-write clone
+        self.output = output
 
     def get_cpp_type(self):
         return 'cv::{}'.format(self.cpp_type)
@@ -363,13 +534,16 @@ class Cvdata(Type):
         return 'Cvdata.pack_cvdata_post {} {}'.format(original, converted)
 
     def ocaml_to_ctypes(self, val):
-        return Conv('(Cvdata.pack_cvdata ({}))'.format(val), post=self._post)
+        pack = 'pack_cvdata_output' if self.output else 'pack_cvdata'
+        return Conv('(Cvdata.{} ({}))'.format(pack, val), post=self._post)
 
     def get_default_value(self):
         return '(Cvdata.Mat (Mat.create ()))' if self.optional else None
 
     def return_value(self, val):
-        return val if self.ret else None
+        # OpenCV may have changed the depth of an output mat, in which case a
+        # new value is returned in its place
+        return "(Cvdata.output {0} {0}')".format(val) if self.ret else None
 
     def is_cloneable(self):
         return self.cloneable
@@ -377,6 +551,9 @@ class Cvdata(Type):
     def is_draw_function(self):
         return self.is_draw
 
+    def is_array(self):
+        return True
+
 
 class CvdataArray(Cvdata):
     def __init__(self, *args, mutable=False, **kwargs):
@@ -399,10 +576,11 @@ class CvdataArray(Cvdata):
         return 'Cvdata.pack_cvdata_array_post {} {}'.format(original, converted)
 
     def ocaml_to_ctypes(self, val):
+        pack = 'pack_cvdata_array_output' if self.output else 'pack_cvdata_array'
         if self.mutable:
-            return Conv('(Cvdata.pack_cvdata_array (!({})))'.format(val), post=self._post)
+            return Conv('(Cvdata.{} (!({})))'.format(pack, val), post=self._post)
         else:
-            return Conv('(Cvdata.pack_cvdata_array ({}))'.format(val))
+            return Conv('(Cvdata.{} ({}))'.format(pack, val))
 
     def get_default_value(self):
         if self.optional:
@@ -451,6 +629,9 @@ class Scalar(Type):
     def must_pass_pointer(self):
         return True
 
+    def is_value(self):
+        return True
+
 
 class RecycleFlag(BaseType):
     def __init__(self):
@@ -466,6 +647,33 @@ CV_NAMESPACE = 'cv::'
 
 type_map = {}
 
+# Memoized results of get_type, including failed lookups (None), so that
+# each distinct C++ type string is only resolved once. Any change to
+# type_map can change how a name resolves, so it clears the whole cache.
+type_cache = {}
+
+
+class CacheStats():
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __str__(self):
+        total = self.hits + self.misses
+        return '{} lookups, {} hits ({:.1f}%), {} misses, {} invalidations' \
+            .format(total, self.hits, 100.0 * self.hits / total if total > 0 else 0.0,
+                    self.misses, self.invalidations)
+
+
+cache_stats = CacheStats()
+
+
+def invalidate_cache():
+    if len(type_cache) > 0:
+        type_cache.clear()
+        cache_stats.invalidations += 1
+
 
 def add_type(new_type, silent_on_exists=False):
     if new_type.get_cpp_type() in type_map:
@@ -474,6 +682,7 @@ def add_type(new_type, silent_on_exists=False):
                             .format(new_type.get_cpp_type()))
     else:
         type_map[new_type.get_cpp_type()] = new_type
+        invalidate_cache()
 
 
 def wrap_type(cls, inner, *args):
@@ -483,8 +692,20 @@ def wrap_type(cls, inner, *args):
 def get_type(cpp_name):
     """Returns the type associated with the given C++ name.
     Returns None if no type could be found.
+    The same object is returned for every lookup of the same name until
+    the type map is next modified.
     """
     cpp_name = cpp_name.strip()
+    if cpp_name in type_cache:
+        cache_stats.hits += 1
+        return type_cache[cpp_name]
+    cache_stats.misses += 1
+    resolved = resolve_type(cpp_name)
+    type_cache[cpp_name] = resolved
+    return resolved
+
+
+def resolve_type(cpp_name):
     if cpp_name in type_map:
         return type_map[cpp_name]
     if (CV_NAMESPACE + cpp_name) in type_map:
@@ -504,7 +725,16 @@ def get_type(cpp_name):
     if cpp_name.startswith(STD_VECTOR):
         try:
             right = cpp_name.rindex('>')
-            return wrap_type(Vector, get_type(cpp_name[len(STD_VECTOR):right]))
+            inner = get_type(cpp_name[len(STD_VECTOR):right])
+            # elements are passed through as they are, so they must have the
+            # same representation in C and C++ (e.g. not cv::String)
+            if inner is not None and inner.get_c_type() != inner.get_cpp_type():
+                inner = None
+            if isinstance(inner, BaseType) and inner.get_cpp_type() in numeric_kinds:
+                return NumericVector(inner, inner.get_cpp_type(), 0)
+            if isinstance(inner, CustomType) and inner.numeric_fields is not None:
+                return NumericVector(inner, *inner.numeric_fields)
+            return wrap_type(Vector, inner)
         except ValueError:
             pass
     print('Could not find type for cpp_name: {}'.format(cpp_name))
@@ -515,11 +745,21 @@ def has_type(cpp_name):
     return get_type(cpp_name) is not None
 
 
+def base_type(typ):
+    """The innermost type of a wrapped type, e.g. Point for
+    const std::vector<Point>&.
+    """
+    while isinstance(typ, WrapperType):
+        typ = typ.inner
+    return typ
+
+
 def add_type_alias(type_name, alias):
     existing_type = get_type(type_name)
     assert existing_type is not None
     assert alias not in type_map
     type_map[alias] = existing_type
+    invalidate_cache()
 
 
 def add_types():
@@ -535,12 +775,12 @@ def add_types():
     add_type(Scalar())
 
     add_type(Cvdata('InputArray'))
-    add_type(Cvdata('OutputArray', optional=True, ret=True))
-    add_type(Cvdata('InputOutputArray', is_draw=True))
+    add_type(Cvdata('OutputArray', optional=True, ret=True, output=True))
+    add_type(Cvdata('InputOutputArray', is_draw=True, output=True))
     add_type(CvdataArray('InputArrayOfArrays'))
     add_type(CvdataArray('OutputArrayOfArrays',
-                         optional=True, ret=True, mutable=True))
-    add_type(CvdataArray('InputOutputArrayOfArrays', mutable=True))
+                         optional=True, ret=True, mutable=True, output=True))
+    add_type(CvdataArray('InputOutputArrayOfArrays', mutable=True, output=True))
 
     add_type(RecycleFlag())
 